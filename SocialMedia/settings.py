@@ -22,6 +22,54 @@ env = environ.Env(
     EMAIL_HOST_USER=(str),
     EMAIL_HOST_PASSWORD=(str),
     EMAIL_USE_SSL=(bool),
+
+    PROXIMITY_ENGINE=(str, 'postgis'),
+    PROXIMITY_CHANGES_MAXLEN=(int, 100_000),
+    LOCATION_MIN_DISTANCE=(float, 50.0),
+    LOCATION_MIN_INTERVAL=(int, 30),
+    LOCATION_FLUSH_INTERVAL=(float, 10.0),
+
+    AVATAR_FORMAT=(str, 'PNG'),
+    AVATAR_QUALITY=(int, 85),
+    AVATAR_MAX_SIZE=(int, 0),
+    AVATAR_THUMBNAIL_SIZES=(list, ['64', '256']),
+
+    NOTIFICATION_INTERVAL=(float, 5.0),
+    NOTIFICATION_RATE_LIMIT=(int, 20),
+    NOTIFICATION_RATE_WINDOW=(int, 3600),
+    NOTIFICATION_DIGEST=(bool, True),
+
+    LIST_CACHE_ENABLED=(bool, True),
+    LIST_CACHE_TIMEOUT=(int, 300),
+
+    SLOW_REQUEST_MS=(int, None),
+    METRICS_ALLOWED_IPS=(list, ['127.0.0.1', '::1']),
+
+    FEED_RADIUS=(float, 50.0),
+    FEED_SIZE=(int, 500),
+    FEED_TTL=(int, 86400),
+    FEED_MOVE_FANOUT=(int, 1000),
+
+    ASYNC_BLOCKING_THREADS=(int, 32),
+
+    AUTH_TOKEN_TTL=(int, 7 * 24 * 3600),
+    AUTH_USER_CACHE_TIMEOUT=(int, 300),
+
+    LIKES_BLOOM_ENABLED=(bool, False),
+    LIKES_BLOOM_CAPACITY=(int, 10_000_000),
+    LIKES_BLOOM_ERROR_RATE=(float, 0.01),
+
+    CELERY_MODE=(str, 'redis'),
+
+    DB_CONN_MAX_AGE=(int, 60),
+    DB_HEALTH_CHECK_INTERVAL=(int, 10),
+    DB_REPLICA_HOSTS=(list, []),
+    DB_REPLICA_PIN_SECONDS=(int, 5),
+
+    DENSITY_TILE_BINS=(int, 16),
+    DENSITY_MAX_ZOOM=(int, 16),
+    DENSITY_MAX_TILES=(int, 64),
+    DENSITY_TILE_TTL=(int, 3600),
 )
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -51,6 +99,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django.contrib.gis',
+    'django.contrib.postgres',
 
     # other apps
     'rest_framework',
@@ -63,17 +112,24 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.db.PrimaryPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'SocialMedia.urls'
 
+# Запросы дольше SLOW_REQUEST_MS миллисекунд пишутся в лог api.slow_requests вместе с SQL (None - выключено)
+SLOW_REQUEST_MS = env('SLOW_REQUEST_MS')
+# /metrics/ доступен адресам и подсетям METRICS_ALLOWED_IPS (например, сети контейнера Prometheus) и администраторам
+METRICS_ALLOWED_IPS = env('METRICS_ALLOWED_IPS')
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -95,6 +151,42 @@ WSGI_APPLICATION = 'SocialMedia.wsgi.application'
 # redis
 REDIS_HOST = env('REDIS_HOST')
 REDIS_PORT = env('REDIS_PORT')
+# База Redis для данных приложения (буферы, счетчики); брокер Celery использует базу 0
+API_REDIS_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}/1'
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:{REDIS_PORT}/2',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    }
+}
+
+# Кэш списка пользователей: точка пользователя округляется до сетки LIST_CACHE_QUANTUM градусов, записи
+# сбрасываются по версиям ячеек LIST_CACHE_CELL градусов (если круг поиска накрывает больше LIST_CACHE_MAX_CELLS
+# ячеек - по общей версии), LIST_CACHE_TIMEOUT секунд - страховочный срок жизни записи
+LIST_CACHE_ENABLED = env('LIST_CACHE_ENABLED')
+LIST_CACHE_TIMEOUT = env('LIST_CACHE_TIMEOUT')
+LIST_CACHE_QUANTUM = 0.002
+LIST_CACHE_CELL = 0.05
+LIST_CACHE_MAX_CELLS = 64
+
+# Лента кандидатов: до FEED_SIZE ближайших пользователей каждого пола в радиусе FEED_RADIUS км,
+# хранится в Redis FEED_TTL секунд и пересчитывается при первом обращении после истечения
+FEED_RADIUS = env('FEED_RADIUS')
+FEED_SIZE = env('FEED_SIZE')
+FEED_TTL = env('FEED_TTL')
+# Перемещение пользователя обновляет ленты не больше FEED_MOVE_FANOUT ближайших к нему соседей
+FEED_MOVE_FANOUT = env('FEED_MOVE_FANOUT')
+
+# Асинхронные view (ASGI) выполняют запросы к базе и другие блокирующие вызовы в пуле из
+# ASYNC_BLOCKING_THREADS потоков; у каждого потока свое соединение с базой
+ASYNC_BLOCKING_THREADS = env('ASYNC_BLOCKING_THREADS')
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -107,8 +199,39 @@ DATABASES = {
         'PASSWORD': env('DB_PASS'),
         'HOST': env('DB_HOST'),
         'PORT': env('DB_PORT'),
+        # Постоянные соединения: запрос не тратит время на подключение к базе
+        'CONN_MAX_AGE': env('DB_CONN_MAX_AGE'),
     }
 }
+# Постоянное соединение проверяется перед использованием не чаще раза в DB_HEALTH_CHECK_INTERVAL секунд (api.db)
+DB_HEALTH_CHECK_INTERVAL = env('DB_HEALTH_CHECK_INTERVAL')
+
+# Реплики для чтения (хост или хост:порт через запятую): на них идут чтения списка пользователей, остальное
+# и все записи - на основную базу. Пользователь после записи DB_REPLICA_PIN_SECONDS секунд читает с основной базы
+DATABASE_REPLICAS = []
+for number, replica in enumerate(env('DB_REPLICA_HOSTS'), 1):
+    replica_host, _, replica_port = replica.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['api.db.ReplicaRouter']
+DB_REPLICA_PIN_SECONDS = env('DB_REPLICA_PIN_SECONDS')
+
+# Поиск пользователей по радиусу: 'postgis' - запрос к базе, 'memory' - индекс в памяти процесса
+PROXIMITY_ENGINE = env('PROXIMITY_ENGINE')
+# Журнал изменений координат в Redis, по которому индексы процессов догоняют друг друга (движок memory): хранится
+# примерно PROXIMITY_CHANGES_MAXLEN последних изменений, отставший сильнее процесс строит индекс заново
+PROXIMITY_CHANGES_MAXLEN = env('PROXIMITY_CHANGES_MAXLEN')
+
+# Буфер местоположений: обновления ближе LOCATION_MIN_DISTANCE метров или чаще раза в LOCATION_MIN_INTERVAL
+# секунд отбрасываются, принятые записываются в базу раз в LOCATION_FLUSH_INTERVAL секунд
+LOCATION_MIN_DISTANCE = env('LOCATION_MIN_DISTANCE')
+LOCATION_MIN_INTERVAL = env('LOCATION_MIN_INTERVAL')
+LOCATION_FLUSH_INTERVAL = env('LOCATION_FLUSH_INTERVAL')
 
 
 # Password validation
@@ -159,6 +282,15 @@ else:
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Аватар с водяным знаком: формат (PNG, JPEG или WEBP), качество сжатия и максимальная сторона (0 - без ограничения)
+AVATAR_FORMAT = env('AVATAR_FORMAT').upper()
+AVATAR_QUALITY = env('AVATAR_QUALITY')
+AVATAR_MAX_SIZE = env('AVATAR_MAX_SIZE')
+# Стороны уменьшенных копий аватара, которые готовятся при обработке (параметр списка avatar_size);
+# файлы аватаров неизменяемы (имя - хэш содержимого) и кэшируются клиентами AVATAR_CACHE_MAX_AGE секунд
+AVATAR_THUMBNAIL_SIZES = [int(size) for size in env('AVATAR_THUMBNAIL_SIZES')]
+AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -167,9 +299,95 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # User
 AUTH_USER_MODEL = 'api.User'
 
+# Аутентификация: API-клиенты получают подписанный токен (POST /auth/token/), действующий AUTH_TOKEN_TTL секунд;
+# пользователь по токену берется из кэша (AUTH_USER_CACHE_TIMEOUT секунд), поэтому пароль проверяется только при
+# выдаче токена. Сессии и Basic оставлены для совместимости и Swagger
+AUTH_TOKEN_TTL = env('AUTH_TOKEN_TTL')
+AUTH_USER_CACHE_TIMEOUT = env('AUTH_USER_CACHE_TIMEOUT')
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'api.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+SWAGGER_SETTINGS = {
+    'SECURITY_DEFINITIONS': {
+        'Basic': {'type': 'basic'},
+        'Bearer': {'type': 'apiKey', 'name': 'Authorization', 'in': 'header'},
+    },
+    # Swagger UI загружает заранее собранную схему (SocialMedia.utils.schema_json)
+    'SPEC_URL': 'schema-json',
+}
+# Версия API и файл схемы OpenAPI, который собирает команда generate_schema при запуске (см. cmds.sh)
+API_VERSION = 'v1'
+OPENAPI_SCHEMA_PATH = os.path.join(BASE_DIR, 'openapi', f'openapi-{API_VERSION}.json')
+
+# Рассылка писем о парах: очередь разбирается раз в NOTIFICATION_INTERVAL секунд пачками по NOTIFICATION_BATCH_SIZE
+# писем (не больше NOTIFICATION_MAX_BATCHES пачек за запуск), получателю уходит не больше NOTIFICATION_RATE_LIMIT
+# писем за NOTIFICATION_RATE_WINDOW секунд, несколько пар одного получателя объединяются в одно письмо
+NOTIFICATION_INTERVAL = env('NOTIFICATION_INTERVAL')
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_BATCHES = 50
+NOTIFICATION_RATE_LIMIT = env('NOTIFICATION_RATE_LIMIT')
+NOTIFICATION_RATE_WINDOW = env('NOTIFICATION_RATE_WINDOW')
+NOTIFICATION_DIGEST = env('NOTIFICATION_DIGEST')
+
+# Фильтр Блума по лайкам: рассчитан на LIKES_BLOOM_CAPACITY лайков с долей ложных срабатываний LIKES_BLOOM_ERROR_RATE.
+# Повторы и без него отсекает ON CONFLICT, фильтр экономит запрос к базе только для повторов ценой обращения к Redis
+# на каждый лайк, поэтому по умолчанию выключен (LIKES_BLOOM_ENABLED). После включения или изменения параметров
+# фильтр пересобирается командой rebuild_likes_filter
+LIKES_BLOOM_ENABLED = env('LIKES_BLOOM_ENABLED')
+LIKES_BLOOM_CAPACITY = env('LIKES_BLOOM_CAPACITY')
+LIKES_BLOOM_ERROR_RATE = env('LIKES_BLOOM_ERROR_RATE')
+
+# Тайлы плотности для карты (api.density): тайл XYZ делится на DENSITY_TILE_BINS x DENSITY_TILE_BINS ячеек
+# (степень двойки), масштаб не больше DENSITY_MAX_ZOOM, за запрос не больше DENSITY_MAX_TILES тайлов;
+# построенный тайл хранится в Redis DENSITY_TILE_TTL секунд и обновляется при перемещениях пользователей
+DENSITY_TILE_BINS = env('DENSITY_TILE_BINS')
+DENSITY_MAX_ZOOM = env('DENSITY_MAX_ZOOM')
+DENSITY_MAX_TILES = env('DENSITY_MAX_TILES')
+DENSITY_TILE_TTL = env('DENSITY_TILE_TTL')
+
 # celery
-CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}'
-CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}'
+# CELERY_MODE: redis - брокер Redis; eager - задачи выполняются сразу в вызывающем процессе;
+# memory - брокер в памяти процесса (воркер в том же процессе). Последние два режима не требуют Redis (для тестов)
+CELERY_MODE = env('CELERY_MODE')
+if CELERY_MODE == 'redis':
+    CELERY_BROKER_URL = f'redis://{REDIS_HOST}:{REDIS_PORT}'
+    CELERY_RESULT_BACKEND = f'redis://{REDIS_HOST}:{REDIS_PORT}'
+else:
+    CELERY_BROKER_URL = 'memory://'
+    CELERY_RESULT_BACKEND = 'cache+memory://'
+CELERY_TASK_ALWAYS_EAGER = CELERY_MODE == 'eager'
+CELERY_TASK_EAGER_PROPAGATES = True
+# Результаты задач никто не читает: не храним их (задача может включить хранение через ignore_result=False)
+CELERY_TASK_IGNORE_RESULT = True
+# Очереди (api.queues): письма, обработка аватаров и обслуживание (буфер местоположений, ленты); остальное - celery
+CELERY_TASK_ROUTES = {
+    'api.tasks.dispatch_match_emails': {'queue': 'notifications'},
+    'api.tasks.process_avatar': {'queue': 'media'},
+    'api.tasks.flush_locations': {'queue': 'maintenance'},
+    'api.tasks.rebuild_feed': {'queue': 'maintenance'},
+    'api.tasks.rebuild_feeds_batch': {'queue': 'maintenance'},
+    'api.tasks.rebuild_all_feeds': {'queue': 'maintenance'},
+    'api.tasks.update_feeds_after_move': {'queue': 'maintenance'},
+}
+# Параллелизм и prefetch задаются воркеру каждой очереди (docker-compose.yml); по умолчанию воркер берет
+# по одной задаче на процесс, чтобы долгая задача не держала за собой уже полученные короткие
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-match-emails': {
+        'task': 'api.tasks.dispatch_match_emails',
+        'schedule': NOTIFICATION_INTERVAL,
+    },
+    'flush-locations': {
+        'task': 'api.tasks.flush_locations',
+        'schedule': LOCATION_FLUSH_INTERVAL,
+    },
+}
 
 # Send Email
 EMAIL_HOST = env('EMAIL_HOST')
@@ -4,20 +4,39 @@ from django.contrib import admin
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from api.views import MatchViewSet, UserListViewSet, UserViewSet
+from api import async_views
+from api.metrics import metrics_view
+from api.views import (DensityViewSet, FeedViewSet, MatchViewSet, PairViewSet,
+                       TokenViewSet, UserListViewSet, UserViewSet,
+                       serve_avatar)
 
-from .utils import schema_view
+from .utils import schema_json, swagger_ui
 
 router = DefaultRouter()
 router.register(r'clients/create', UserViewSet, basename='create-client')
+router.register(r'auth/token', TokenViewSet, basename='token')
 router.register(r'list', UserListViewSet, basename='user-list')
 router.register(r'clients/(?P<from_user_id>\d+)/match', MatchViewSet, basename='match')
+router.register(r'feed', FeedViewSet, basename='feed')
+router.register(r'pairs', PairViewSet, basename='pairs')
+router.register(r'density', DensityViewSet, basename='density')
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
 
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('metrics/', metrics_view, name='metrics'),
+
+    # Асинхронные варианты горячих ендпоинтов для запуска под ASGI-сервером
+    path('async/list/', async_views.user_list, name='async-user-list'),
+    path('async/clients/<int:from_user_id>/match/', async_views.create_match, name='async-match'),
+
+    # Аватары отдаются с ETag и долгим кэшированием и без DEBUG
+    path(f'{settings.MEDIA_URL.lstrip("/")}avatars/<path:path>', serve_avatar, name='avatar'),
+
+    # Схема собирается заранее командой generate_schema и отдается из памяти с ETag
+    path('swagger.json', schema_json, name='schema-json'),
+    path('swagger/', swagger_ui, name='schema-swagger-ui'),
 ] + router.urls
 
 if settings.DEBUG:
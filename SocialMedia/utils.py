@@ -1,13 +1,82 @@
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
-
-schema_view = get_schema_view(
-    openapi.Info(
-        title="My API",
-        default_version='v1',
-        description="API documentation",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+import hashlib
+import os
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag, require_GET
+
+SCHEMA_INFO = {
+    'title': "My API",
+    'default_version': settings.API_VERSION,
+    'description': "API documentation",
+}
+
+
+def generate_schema():
+    """Строит схему OpenAPI интроспекцией всех view и возвращает ее в JSON (bytes).
+
+    Интроспекция drf_yasg медленная, поэтому схема строится командой generate_schema при
+    запуске и дальше отдается из файла; drf_yasg импортируется только здесь."""
+    from drf_yasg import openapi
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    # Пустой url: в схеме нет хоста, Swagger UI обращается к тому серверу, с которого загружен
+    generator = OpenAPISchemaGenerator(openapi.Info(**SCHEMA_INFO), url='')
+    # Анонимный запрос, как у прежней схемы, генерируемой на каждый запрос (public=True - все ендпоинты)
+    schema = generator.get_schema(request=Request(APIRequestFactory().get('/swagger.json')), public=True)
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def write_schema(path=None):
+    """Сохраняет схему в файл OPENAPI_SCHEMA_PATH (запись через временный файл) и возвращает ее размер."""
+    path = path or settings.OPENAPI_SCHEMA_PATH
+    content = generate_schema()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(content)
+    os.replace(f'{path}.tmp', path)
+    return len(content)
+
+
+@lru_cache(maxsize=None)
+def load_schema():
+    """Схема и ее ETag, загруженные в память процесса один раз.
+
+    Если файл не собран (например, при разработке), схема строится при первом обращении."""
+    try:
+        with open(settings.OPENAPI_SCHEMA_PATH, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        content = generate_schema()
+    return content, hashlib.sha256(content).hexdigest()
+
+
+@require_GET
+@etag(lambda request: load_schema()[1])
+def schema_json(request):
+    """Отдает схему OpenAPI из памяти; клиент с актуальной копией получает 304 по ETag."""
+    response = HttpResponse(load_schema()[0], content_type='application/json')
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+@require_GET
+def swagger_ui(request):
+    """Страница Swagger UI; схему она загружает с schema_json (SWAGGER_SETTINGS['SPEC_URL'])."""
+    if request.GET.get('format') == 'openapi':
+        # Адрес схемы прежнего view drf_yasg
+        return schema_json(request)
+
+    from drf_yasg.renderers import SwaggerUIRenderer
+
+    renderer = SwaggerUIRenderer()
+    context = {'request': request}
+    renderer.set_context(context)
+    context.update(title=SCHEMA_INFO['title'], version=SCHEMA_INFO['default_version'])
+    return HttpResponse(render_to_string(renderer.template, context, request))
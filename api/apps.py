@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Учет SQL в метриках подключается к соединениям при их создании, проверка соединений - к началу запроса
+        from . import db, metrics, signals  # noqa: F401
@@ -0,0 +1,130 @@
+import functools
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import db, feed, list_cache
+from .location import aget_buffered_location, arecord_location
+from .notifications import aqueue_notification_items, notification_items
+from .serializers import MatchSerializer
+from .utils import run_blocking
+from .views import UserListViewSet
+
+
+def render_json(data, status_code=status.HTTP_200_OK):
+    """Отдает данные тем же рендерером, что и синхронные view DRF."""
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def authenticate(request):
+    """Оборачивает запрос в Request DRF и аутентифицирует его классами из DEFAULT_AUTHENTICATION_CLASSES.
+
+    Выполняется в пуле потоков: сессия читается из базы, а проверка пароля Basic-аутентификации
+    нагружает процессор."""
+    request = Request(
+        request,
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    if not request.user.is_authenticated:
+        raise exceptions.NotAuthenticated()
+    return request
+
+
+def _error_response(request, exc):
+    response = render_json({'detail': exc.detail} if isinstance(exc.detail, str) else exc.detail, exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # Как в DRF: 401 с заголовком WWW-Authenticate, если его задает первый класс аутентификации, иначе 403
+        authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        header = authenticators[0]().authenticate_header(request) if authenticators else None
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = status.HTTP_403_FORBIDDEN
+    return response
+
+
+def async_api_view(methods):
+    """Декоратор асинхронных view API.
+
+    Проверяет метод, аутентифицирует запрос так же, как синхронные view DRF, и превращает
+    исключения DRF в ответы с тем же телом. View получает Request DRF с пользователем."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in methods:
+                return _error_response(request, exceptions.MethodNotAllowed(request.method))
+            try:
+                drf_request = await run_blocking(authenticate, request)
+                return await func(drf_request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return _error_response(request, exc)
+
+        # CSRF для сессий проверяет SessionAuthentication, как и в APIView.as_view
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def resolve_search_point(request):
+    """Асинхронный вариант UserListViewSet.get_search_point: буфер местоположений читается без блокировки."""
+    user = request.user
+    latitude = request.query_params.get('latitude', None)
+    longitude = request.query_params.get('longitude', None)
+
+    if longitude and latitude:
+        try:
+            point = Point(float(longitude), float(latitude), srid=4326)
+        except ValueError:
+            raise exceptions.ValidationError({'detail': 'Введены некорректные координаты!'})
+        await arecord_location(user, point)
+    else:
+        point = await aget_buffered_location(user.pk) or user.location
+
+    if point is not None and settings.LIST_CACHE_ENABLED:
+        point = list_cache.quantize(point)
+    return point
+
+
+def _render_user_list(request, point):
+    view = UserListViewSet(request=request, args=(), kwargs={}, format_kwarg=None, action='list')
+    view.set_search_point(point)
+    with db.replica_reads(request.user):
+        return view.list(request).data
+
+
+@async_api_view(['GET'])
+async def user_list(request):
+    """Асинхронный вариант GET /list/ с теми же параметрами, кэшем и форматом ответа.
+
+    Местоположение принимается через асинхронный клиент Redis, запрос к базе и сериализация
+    выполняются в пуле потоков, поэтому медленный запрос PostGIS не занимает воркер ASGI-сервера."""
+    point = await resolve_search_point(request)
+    return render_json(await run_blocking(_render_user_list, request, point))
+
+
+def _create_match(request):
+    serializer = MatchSerializer(data=request.data, context={'request': request})
+    serializer.is_valid(raise_exception=True)
+    match = serializer.save()
+    if match.matched:
+        data = {"match": f"У вас есть пара! Почта участника: {match.to_user.email}"}
+        return match, data, notification_items([match])
+    return match, serializer.data, []
+
+
+@async_api_view(['POST'])
+async def create_match(request, from_user_id):
+    """Асинхронный вариант POST /clients/{from_user_id}/match/.
+
+    Лайк сохраняется в пуле потоков, письма о паре ставятся в очередь и лента кандидатов
+    обновляется через асинхронный клиент Redis."""
+    match, data, items = await run_blocking(_create_match, request)
+    await aqueue_notification_items(items)
+    await feed.aremove_liked(match.from_user_id, [match.to_user_id])
+    return render_json(data, status.HTTP_201_CREATED)
@@ -0,0 +1,34 @@
+from rest_framework import exceptions
+from rest_framework.authentication import (BaseAuthentication,
+                                           get_authorization_header)
+
+from .tokens import user_from_token
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """Аутентификация по подписанному токену из заголовка "Authorization: Bearer <токен>".
+
+    Токен выдает POST /auth/token/. Пароль на каждом запросе не проверяется, а id, активность и
+    отпечаток пароля пользователя берутся из кэша, так что аутентификация обычно не обращается к базе."""
+
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Некорректный заголовок авторизации.')
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Некорректный токен.')
+
+        user = user_from_token(token)
+        if user is None:
+            raise exceptions.AuthenticationFailed('Токен недействителен или истек.')
+        return user, token
+
+    def authenticate_header(self, request):
+        return self.keyword
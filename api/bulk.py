@@ -0,0 +1,346 @@
+import csv
+import gzip
+import io
+import json
+import sys
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.gis.geos import Point
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import connection, transaction
+
+from .models import Match, User
+from .signals import locations_saved
+
+FORMATS = ('csv', 'ndjson')
+FORMAT_EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+
+
+def detect_format(path, fmt=None):
+    """Формат файла: явно заданный или по расширению (.csv, .ndjson, .jsonl, в том числе с .gz)."""
+    if fmt:
+        return fmt
+    name = path.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    for extension, detected in FORMAT_EXTENSIONS.items():
+        if name.endswith(extension):
+            return detected
+    raise ValueError(f'Не удалось определить формат файла {path}: укажите csv или ndjson')
+
+
+@contextmanager
+def open_text(path, mode='r'):
+    """Открывает файл (- означает stdin/stdout, .gz распаковывается на лету) в текстовом режиме."""
+    if path == '-':
+        stream = io.TextIOWrapper((sys.stdin if mode == 'r' else sys.stdout).buffer, encoding='utf-8', newline='')
+        try:
+            yield stream
+        finally:
+            # Сам stdin/stdout не закрываем
+            stream.flush()
+            stream.detach()
+        return
+    if path.lower().endswith('.gz'):
+        stream = gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    else:
+        stream = open(path, mode, encoding='utf-8', newline='')
+    with stream:
+        yield stream
+
+
+def read_records(stream, fmt):
+    """Построчно читает записи (словари) из CSV с заголовком или NDJSON, не загружая файл в память."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+class RecordWriter:
+    """Построчная запись записей в CSV с заголовком или NDJSON."""
+
+    def __init__(self, stream, fmt, columns):
+        self.stream, self.fmt, self.columns = stream, fmt, columns
+        if fmt == 'csv':
+            self.writer = csv.writer(stream)
+            self.writer.writerow(columns)
+
+    def write_rows(self, rows):
+        if self.fmt == 'csv':
+            self.writer.writerows(rows)
+            return
+        self.stream.writelines(
+            json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, separators=(',', ':')) + '\n' for row in rows
+        )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Загружает строки во временную таблицу одной командой COPY (None становится NULL)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def _text(record, field, max_length=None, required=True):
+    value = record.get(field)
+    value = '' if value is None else str(value).strip()
+    if not value:
+        if required:
+            raise ValueError(f'не заполнено поле {field}')
+        return None
+    if max_length is not None and len(value) > max_length:
+        raise ValueError(f'поле {field} длиннее {max_length} символов')
+    return value
+
+
+def _coordinates(record):
+    """Долгота и широта записи или (None, None), если координаты не заданы."""
+    longitude, latitude = record.get('longitude'), record.get('latitude')
+    if longitude in (None, '') and latitude in (None, ''):
+        return None, None
+    try:
+        longitude, latitude = float(longitude), float(latitude)
+    except (TypeError, ValueError):
+        raise ValueError('некорректные координаты')
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        raise ValueError('координаты вне допустимого диапазона')
+    return longitude, latitude
+
+
+def _point(x, y):
+    return None if x is None else Point(x, y, srid=4326)
+
+
+class BulkImporter:
+    """Пакетная загрузка записей через временную таблицу.
+
+    Каждый пакет проверяется в Python, загружается во временную таблицу командой COPY и
+    переносится в рабочие таблицы одним-двумя SQL-запросами в отдельной транзакции, поэтому
+    файл любого размера загружается с постоянным расходом памяти, а прерванную загрузку можно
+    повторить: уже загруженные записи пропускаются по уникальным ограничениям."""
+
+    staging_table = None
+    # Колонки временной таблицы: (имя, тип PostgreSQL)
+    staging_columns = ()
+
+    def clean(self, record):
+        """Возвращает строку временной таблицы для записи или выбрасывает ValueError с причиной отказа."""
+        raise NotImplementedError
+
+    def apply(self, cursor):
+        """Переносит пакет из временной таблицы в рабочие таблицы и возвращает число загруженных записей."""
+        raise NotImplementedError
+
+    def committed(self):
+        """Вызывается после фиксации транзакции пакета."""
+
+    def run(self, records, batch_size=10000):
+        """Загружает записи пакетами, после каждого пакета возвращая (прочитано, загружено, отказы).
+
+        Отказы - список (номер записи, причина, запись)."""
+        columns = [name for name, _ in self.staging_columns]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE IF NOT EXISTS {self.staging_table} '
+                f'({", ".join(f"{name} {sql_type}" for name, sql_type in self.staging_columns)}) ON COMMIT DELETE ROWS'
+            )
+            number = 0
+            try:
+                for batch in batched(records, batch_size):
+                    rows, rejects = [], []
+                    for number, record in enumerate(batch, number + 1):
+                        try:
+                            rows.append(self.clean(record))
+                        except ValueError as exc:
+                            rejects.append((number, str(exc), record))
+
+                    loaded = 0
+                    if rows:
+                        with transaction.atomic():
+                            copy_rows(cursor, self.staging_table, columns, rows)
+                            loaded = self.apply(cursor)
+                        self.committed()
+                    yield len(batch), loaded, rejects
+            finally:
+                cursor.execute(f'DROP TABLE IF EXISTS {self.staging_table}')
+
+
+class UserImporter(BulkImporter):
+    """Пользователи: email, first_name, last_name, gender, необязательные password (уже хэшированный,
+    как в creation_db_data.sql), longitude и latitude. Существующие email пропускаются.
+
+    После каждого пакета для пользователей с координатами отправляется сигнал locations_saved,
+    как при загрузке местоположений."""
+
+    staging_table = 'import_users'
+    staging_columns = (
+        ('email', 'text'), ('first_name', 'text'), ('last_name', 'text'), ('gender', 'text'),
+        ('password', 'text'), ('longitude', 'double precision'), ('latitude', 'double precision'),
+    )
+    INSERT_SQL = """
+        INSERT INTO {user} (password, email, first_name, last_name, gender, avatar, avatar_original, avatar_status,
+                            location, is_active, is_admin)
+        SELECT DISTINCT ON (email) password, email, first_name, last_name, gender, %s, '', %s,
+               ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography, TRUE, FALSE
+        FROM {staging}
+        ORDER BY email
+        ON CONFLICT (email) DO NOTHING
+        RETURNING id, ST_X(location::geometry), ST_Y(location::geometry)
+    """
+
+    def __init__(self, default_password=None):
+        # Хэш пароля по умолчанию считается один раз: PBKDF2 на каждую строку занял бы часы
+        self.default_password = make_password(default_password)
+        self.moves = []
+
+    def clean(self, record):
+        email = BaseUserManager.normalize_email(_text(record, 'email', max_length=255))
+        try:
+            validate_email(email)
+        except ValidationError:
+            raise ValueError('некорректный email')
+        gender = _text(record, 'gender').upper()
+        if gender not in dict(User.CHOICE_GENDER):
+            raise ValueError('некорректный пол')
+        password = _text(record, 'password', max_length=128, required=False)
+        if password is None:
+            password = self.default_password
+        else:
+            try:
+                identify_hasher(password)
+            except ValueError:
+                raise ValueError('пароль должен быть хэширован')
+        return (
+            email, _text(record, 'first_name', max_length=30), _text(record, 'last_name', max_length=30), gender,
+            password, *_coordinates(record),
+        )
+
+    def apply(self, cursor):
+        cursor.execute(
+            self.INSERT_SQL.format(user=User._meta.db_table, staging=self.staging_table),
+            [User._meta.get_field('avatar').default, User.AVATAR_READY],
+        )
+        rows = cursor.fetchall()
+        self.moves = [(user_id, None, _point(x, y)) for user_id, x, y in rows if x is not None]
+        return len(rows)
+
+    def committed(self):
+        if self.moves:
+            locations_saved.send(sender=User, moves=self.moves)
+        self.moves = []
+
+
+class _KeyedImporter(BulkImporter):
+    """Загрузка записей, ссылающихся на пользователей по id или по email (--key)."""
+
+    def __init__(self, key='id'):
+        self.key = key
+        self.key_type = 'bigint' if key == 'id' else 'text'
+
+    def clean_key(self, record, field):
+        value = _text(record, field)
+        if self.key == 'id':
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError(f'поле {field} должно быть числом')
+        return BaseUserManager.normalize_email(value)
+
+
+class LocationImporter(_KeyedImporter):
+    """Местоположения: id (или email) пользователя, longitude и latitude; пустые координаты стирают его.
+
+    После каждого пакета отправляется сигнал locations_saved, как при записи буфера местоположений."""
+
+    staging_table = 'import_locations'
+    UPDATE_SQL = """
+        UPDATE {user} u
+        SET location = ST_SetSRID(ST_MakePoint(s.longitude, s.latitude), 4326)::geography
+        FROM (
+            SELECT DISTINCT ON (s.user_key) o.id, o.location AS old, s.longitude, s.latitude
+            FROM {staging} s
+            JOIN {user} o ON o.{key} = s.user_key
+            ORDER BY s.user_key
+        ) s
+        WHERE u.id = s.id
+        RETURNING u.id, ST_X(s.old::geometry), ST_Y(s.old::geometry), s.longitude, s.latitude
+    """
+
+    def __init__(self, key='id'):
+        super().__init__(key)
+        self.staging_columns = (
+            ('user_key', self.key_type), ('longitude', 'double precision'), ('latitude', 'double precision'),
+        )
+        self.moves = []
+
+    def clean(self, record):
+        return (self.clean_key(record, self.key), *_coordinates(record))
+
+    def apply(self, cursor):
+        cursor.execute(self.UPDATE_SQL.format(user=User._meta.db_table, staging=self.staging_table, key=self.key))
+        self.moves = [
+            (user_id, _point(old_x, old_y), _point(x, y))
+            for user_id, old_x, old_y, x, y in cursor.fetchall()
+        ]
+        return len(self.moves)
+
+    def committed(self):
+        locations_saved.send(sender=User, moves=self.moves)
+        self.moves = []
+
+
+class LikeImporter(_KeyedImporter):
+    """Лайки: from_user и to_user (id или email). Флаг matched проставляется по встречным лайкам,
+    в том числе уже существовавшим; письма о парах не отправляются."""
+
+    staging_table = 'import_likes'
+    PAIRS_SQL = """
+        SELECT f.id AS from_id, t.id AS to_id
+        FROM {staging} s
+        JOIN {user} f ON f.{key} = s.from_key
+        JOIN {user} t ON t.{key} = s.to_key
+        WHERE f.id <> t.id
+    """
+    INSERT_SQL = """
+        INSERT INTO {match} (from_user_id, to_user_id, matched)
+        SELECT DISTINCT from_id, to_id, FALSE FROM ({pairs}) p
+        ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+    """
+    MATCHED_SQL = """
+        UPDATE {match} m SET matched = TRUE
+        FROM (SELECT from_id, to_id FROM ({pairs}) p UNION SELECT to_id, from_id FROM ({pairs}) p) p
+        WHERE m.from_user_id = p.from_id AND m.to_user_id = p.to_id AND NOT m.matched
+          AND EXISTS (SELECT 1 FROM {match} r WHERE r.from_user_id = m.to_user_id AND r.to_user_id = m.from_user_id)
+    """
+
+    def __init__(self, key='id'):
+        super().__init__(key)
+        self.staging_columns = (('from_key', self.key_type), ('to_key', self.key_type))
+
+    def clean(self, record):
+        return self.clean_key(record, 'from_user'), self.clean_key(record, 'to_user')
+
+    def apply(self, cursor):
+        pairs = self.PAIRS_SQL.format(staging=self.staging_table, user=User._meta.db_table, key=self.key)
+        cursor.execute(self.INSERT_SQL.format(match=Match._meta.db_table, pairs=pairs))
+        loaded = cursor.rowcount
+        # Отдельным запросом: UPDATE в том же запросе, что и INSERT, не видит вставленных строк
+        cursor.execute(self.MATCHED_SQL.format(match=Match._meta.db_table, pairs=pairs))
+        return loaded
+
+
+IMPORTERS = {'users': UserImporter, 'locations': LocationImporter, 'likes': LikeImporter}
@@ -0,0 +1,115 @@
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+from .utils import run_blocking
+
+PIN_KEY = 'db:pin:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Реплика, с которой читает текущий запрос (None - основная база); задают view, допускающие отставание реплики
+current_replica = ContextVar('current_replica', default=None)
+
+
+def pin_primary(*user_ids):
+    """Направляет чтения пользователей на основную базу на DB_REPLICA_PIN_SECONDS секунд после их записи,
+    чтобы они видели свои изменения, пока реплики догоняют основную базу."""
+    if settings.DATABASE_REPLICAS and user_ids:
+        cache.set_many({PIN_KEY.format(user_id): 1 for user_id in user_ids}, settings.DB_REPLICA_PIN_SECONDS)
+
+
+def choose_replica(user=None):
+    """Реплика для чтений запроса пользователя или None, если реплик нет или пользователь недавно писал в базу."""
+    if not settings.DATABASE_REPLICAS:
+        return None
+    if user is not None and user.is_authenticated and cache.get(PIN_KEY.format(user.pk)) is not None:
+        return None
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def replica_reads(user=None):
+    """Направляет чтения в блоке на реплику, выбранную choose_replica."""
+    token = current_replica.set(choose_replica(user))
+    try:
+        yield current_replica.get()
+    finally:
+        current_replica.reset(token)
+
+
+class ReplicaRouter:
+    """Чтения view, включивших current_replica, идут на реплику; остальные чтения и все записи - на основную базу.
+
+    Реплики содержат те же данные, поэтому связи между объектами из разных баз разрешены,
+    а миграции выполняются только на основной базе."""
+
+    def db_for_read(self, model, **hints):
+        return current_replica.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """Закрепляет за основной базой пользователя, успешно выполнившего изменяющий запрос (лайк, загрузка и т.п.)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS:
+            # Пользователь сессии загружается из базы, поэтому проверка тоже выполняется в пуле потоков
+            await run_blocking(self.pin, request, response)
+        return response
+
+    @staticmethod
+    def pin(request, response):
+        if not settings.DATABASE_REPLICAS or request.method in SAFE_METHODS or response.status_code >= 400:
+            return
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            pin_primary(user.pk)
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """Проверяет постоянные соединения (CONN_MAX_AGE) перед использованием и закрывает оборванные.
+
+    В Django 3.2 нет CONN_HEALTH_CHECKS, поэтому без проверки первый запрос после перезапуска
+    базы или обрыва соединения получил бы ошибку. Соединение проверяется не чаще раза в
+    DB_HEALTH_CHECK_INTERVAL секунд; закрытое соединение откроется заново при первом запросе к базе."""
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if now - getattr(connection, 'health_checked_at', 0) < settings.DB_HEALTH_CHECK_INTERVAL:
+            continue
+        connection.health_checked_at = now
+        if not connection.is_usable():
+            connection.close()
@@ -0,0 +1,208 @@
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .models import User
+from .utils import get_redis
+
+TILE_KEY = 'density:{}:{}:{}:{}'
+# Поле-метка: тайл построен (хэш без ячеек иначе не существовал бы в Redis)
+BUILT_FIELD = 'built'
+ALL_GENDERS = 'all'
+VARIANTS = (ALL_GENDERS, *dict(User.CHOICE_GENDER))
+# Широта, на которой обрезается проекция Меркатора (квадратная сетка тайлов)
+MAX_LATITUDE = 85.0511287798
+
+# Прибавляет к ячейке тайла, только если тайл уже построен: иначе частичные счетчики выглядели бы как готовый тайл
+INCREMENT_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+local count = redis.call('hincrby', KEYS[1], ARGV[1], ARGV[2])
+if count <= 0 then
+    redis.call('hdel', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+# Индекс user_location_geom_gist (миграция 0007) построен по тому же выражению location::geometry:
+# прямоугольник тайлов задан в долготе и широте, а у geography стороны прямоугольника - дуги большого круга
+GRID_SQL = """
+    SELECT floor((ST_X(g) + 180) / 360 * %(n)s)::bigint,
+           floor((1 - ln(tan(pi() / 4 + radians(LEAST(GREATEST(ST_Y(g), -%(max_lat)s), %(max_lat)s)) / 2)) / pi())
+                 / 2 * %(n)s)::bigint,
+           gender, count(*)
+    FROM (
+        SELECT location::geometry AS g, gender
+        FROM {user}
+        WHERE location::geometry && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)
+    ) u
+    GROUP BY 1, 2, 3
+"""
+
+
+def bins_shift():
+    """Число уровней масштаба между тайлом и его ячейкой (DENSITY_TILE_BINS = 2 ** shift ячеек по стороне)."""
+    return int(math.log2(settings.DENSITY_TILE_BINS))
+
+
+def global_cells(lons, lats, zoom):
+    """Номера столбца и строки сетки XYZ (веб-Меркатор) масштаба zoom для массивов координат в градусах."""
+    n = 2 ** zoom
+    lats = np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+    xs = np.floor((np.asarray(lons, dtype=np.float64) + 180) / 360 * n)
+    ys = np.floor((1 - np.log(np.tan(np.pi / 4 + lats / 2)) / np.pi) / 2 * n)
+    return np.clip(xs, 0, n - 1).astype(np.int64), np.clip(ys, 0, n - 1).astype(np.int64)
+
+
+def tile_bounds(zoom, x, y):
+    """Границы тайла (запад, юг, восток, север) в градусах."""
+    n = 2 ** zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, latitude(y + 1), (x + 1) / n * 360 - 180, latitude(y)
+
+
+def tile_range(west, south, east, north, zoom):
+    """Первый и последний столбцы и строки тайлов масштаба zoom, покрывающих прямоугольник: (x0, x1, y0, y1).
+
+    По ним число тайлов проверяется до того, как строится их список."""
+    xs, ys = global_cells([west, east], [north, south], zoom)
+    return int(xs[0]), int(xs[1]), int(ys[0]), int(ys[1])
+
+
+def tile_count(west, south, east, north, zoom):
+    """Число тайлов масштаба zoom, покрывающих прямоугольник."""
+    x0, x1, y0, y1 = tile_range(west, south, east, north, zoom)
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+
+def tiles_in_bbox(west, south, east, north, zoom):
+    """Тайлы масштаба zoom, покрывающие прямоугольник: список (x, y)."""
+    x0, x1, y0, y1 = tile_range(west, south, east, north, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def get_tiles(zoom, tiles, gender=None):
+    """Счетчики пользователей по ячейкам тайлов: {(x, y): {(cx, cy): count}}.
+
+    Готовые тайлы читаются из Redis одним запросом, недостающие считаются одним запросом к
+    PostGIS по их общему прямоугольнику и сохраняются сразу для всех вариантов пола."""
+    variant = gender or ALL_GENDERS
+    client = get_redis()
+    pipe = client.pipeline(transaction=False)
+    for x, y in tiles:
+        pipe.hgetall(TILE_KEY.format(zoom, x, y, variant))
+    cached = dict(zip(tiles, pipe.execute()))
+
+    result = {tile: _decode_cells(fields) for tile, fields in cached.items() if fields}
+    missing = [tile for tile, fields in cached.items() if not fields]
+    if missing:
+        built = build_tiles(zoom, missing)
+        result.update({tile: variants[variant] for tile, variants in built.items()})
+    return result
+
+
+def build_tiles(zoom, tiles):
+    """Считает тайлы по базе, сохраняет их в Redis и возвращает {(x, y): {вариант: {(cx, cy): count}}}."""
+    shift = bins_shift()
+    mask = settings.DENSITY_TILE_BINS - 1
+    west, _, _, north = tile_bounds(zoom, min(x for x, _ in tiles), min(y for _, y in tiles))
+    _, south, east, _ = tile_bounds(zoom, max(x for x, _ in tiles), max(y for _, y in tiles))
+    # Ячейка считается в SQL как тайл масштаба zoom + shift: старшие биты номера - тайл, младшие - ячейка в нем
+    params = {'n': 2 ** (zoom + shift), 'max_lat': MAX_LATITUDE,
+              'west': west, 'south': south, 'east': east, 'north': north}
+
+    built = {tile: {variant: {} for variant in VARIANTS} for tile in tiles}
+    with connection.cursor() as cursor:
+        cursor.execute(GRID_SQL.format(user=User._meta.db_table), params)
+        rows = cursor.fetchall()
+    for gx, gy, gender, count in rows:
+        variants = built.get((gx >> shift, gy >> shift))
+        if variants is None:
+            continue
+        cell = (gx & mask, gy & mask)
+        for variant in (ALL_GENDERS, gender):
+            variants[variant][cell] = variants[variant].get(cell, 0) + count
+
+    pipe = get_redis().pipeline()
+    for (x, y), variants in built.items():
+        for variant, cells in variants.items():
+            key = TILE_KEY.format(zoom, x, y, variant)
+            pipe.delete(key)
+            pipe.hset(key, mapping={BUILT_FIELD: 1, **{f'{cx}:{cy}': count for (cx, cy), count in cells.items()}})
+            pipe.expire(key, settings.DENSITY_TILE_TTL)
+    pipe.execute()
+    return built
+
+
+def _decode_cells(fields):
+    cells = {}
+    for field, count in fields.items():
+        field = field.decode()
+        if field != BUILT_FIELD:
+            cx, cy = field.split(':')
+            cells[int(cx), int(cy)] = int(count)
+    return cells
+
+
+def apply_moves(moves, genders=None):
+    """Переносит пользователей между ячейками построенных тайлов всех масштабов.
+
+    moves - список (user_id, old, new), как в сигнале locations_saved; genders - пол по id
+    (если не передан, читается из базы). Ячейки всех масштабов для всех точек считаются
+    векторизованно, встречные изменения одной ячейки взаимно сокращаются. Тайлы, которые еще не
+    построены, не трогаются; расхождение с базой из-за гонки с построением тайла ограничено
+    временем жизни тайла DENSITY_TILE_TTL."""
+    points = [(user_id, point, sign) for user_id, old, new in moves for point, sign in ((old, -1), (new, 1))
+              if point is not None]
+    if not points:
+        return 0
+    if genders is None:
+        genders = dict(User.objects.filter(pk__in={user_id for user_id, _, _ in points}).values_list('id', 'gender'))
+
+    # Каждая точка учитывается в варианте "все" и в варианте своего пола
+    variant_index = {variant: i for i, variant in enumerate(VARIANTS)}
+    lons = np.array([point.x for _, point, _ in points] * 2)
+    lats = np.array([point.y for _, point, _ in points] * 2)
+    signs = np.array([sign for _, _, sign in points] * 2, dtype=np.int64)
+    variants = np.array([0] * len(points) + [variant_index.get(genders.get(user_id), 0) for user_id, _, _ in points])
+    keep = np.concatenate([np.ones(len(points), dtype=bool), variants[len(points):] > 0])
+
+    client = get_redis()
+    script = client.register_script(INCREMENT_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    updates = 0
+    for key, field, delta in cell_deltas(lons[keep], lats[keep], signs[keep], variants[keep]):
+        script(keys=[key], args=[field, delta], client=pipe)
+        updates += 1
+    pipe.execute()
+    return updates
+
+
+def cell_deltas(lons, lats, signs, variants):
+    """Суммарные изменения ячеек тайлов масштабов 0..DENSITY_MAX_ZOOM: (ключ тайла, поле ячейки, изменение).
+
+    variants - индексы в VARIANTS; нулевые изменения пропускаются."""
+    shift = bins_shift()
+    mask = settings.DENSITY_TILE_BINS - 1
+    for zoom in range(settings.DENSITY_MAX_ZOOM + 1):
+        gx, gy = global_cells(lons, lats, zoom + shift)
+        keys, inverse = np.unique(np.stack([gx, gy, variants], axis=1), axis=0, return_inverse=True)
+        deltas = np.bincount(inverse.ravel(), weights=signs).astype(np.int64)
+        for (cell_x, cell_y, variant), delta in zip(keys.tolist(), deltas.tolist()):
+            if delta:
+                key = TILE_KEY.format(zoom, cell_x >> shift, cell_y >> shift, VARIANTS[variant])
+                yield key, f'{cell_x & mask}:{cell_y & mask}', delta
+
+
+def clear():
+    """Удаляет все построенные тайлы (после загрузки данных в обход сигналов)."""
+    client = get_redis()
+    keys = list(client.scan_iter(match=TILE_KEY.format('*', '*', '*', '*'), count=1000))
+    for start in range(0, len(keys), 1000):
+        client.delete(*keys[start:start + 1000])
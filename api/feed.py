@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+
+from .location import get_buffered_location
+from .models import Match, User, knn_distance
+from .utils import get_async_redis, get_redis
+
+FEED_KEY = 'feed:{}:{}'
+FEED_READY_KEY = 'feed:{}:ready'
+GENDERS = tuple(dict(User.CHOICE_GENDER))
+
+# Добавляет кандидата (ARGV[1], расстояние ARGV[2]) в построенную ленту (KEYS[2] - метка готовности), если лента
+# короче ARGV[3] или ее худший элемент дальше кандидата, и обрезает ленту до ARGV[3] ближайших
+UPSERT_SCRIPT = """
+if redis.call('exists', KEYS[2]) == 0 then
+    return 0
+end
+local size = tonumber(ARGV[3])
+if not redis.call('zscore', KEYS[1], ARGV[1]) and redis.call('zcard', KEYS[1]) >= size then
+    local worst = redis.call('zrange', KEYS[1], -1, -1, 'WITHSCORES')
+    if tonumber(worst[2]) <= tonumber(ARGV[2]) then
+        return 0
+    end
+end
+redis.call('zadd', KEYS[1], ARGV[2], ARGV[1])
+redis.call('zremrangebyrank', KEYS[1], size, -1)
+if redis.call('ttl', KEYS[1]) < 0 then
+    redis.call('expire', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+
+def candidates(user_id, point, limit=None):
+    """Queryset ближайших к точке пользователей, которых user_id еще не лайкал, с расстоянием."""
+    liked = Match.objects.filter(from_user_id=user_id).values('to_user_id')
+    queryset = (
+        User.objects.filter(location__dwithin=(point, D(km=settings.FEED_RADIUS)))
+        .exclude(pk=user_id)
+        .exclude(pk__in=liked)
+        .annotate(distance=Distance('location', point))
+        .order_by('distance', 'id')
+    )
+    return queryset[:limit] if limit else queryset
+
+
+def rebuild(user_id):
+    """Пересчитывает ленту кандидатов пользователя: по отсортированному множеству Redis на каждый пол."""
+    user = User.objects.only('id', 'location').filter(pk=user_id).first()
+    if user is None:
+        return 0
+    point = get_buffered_location(user_id) or user.location
+
+    rows = []
+    if point is not None:
+        rows = candidates(user_id, point, settings.FEED_SIZE * len(GENDERS)).values_list('id', 'gender', 'distance')
+
+    pipe = get_redis().pipeline()
+    by_gender = {gender: {} for gender in GENDERS}
+    for candidate_id, gender, distance in rows:
+        by_gender[gender][candidate_id] = distance.km
+    for gender, members in by_gender.items():
+        key = FEED_KEY.format(user_id, gender)
+        pipe.delete(key)
+        if members:
+            pipe.zadd(key, dict(list(members.items())[:settings.FEED_SIZE]))
+            pipe.expire(key, settings.FEED_TTL)
+    pipe.set(FEED_READY_KEY.format(user_id), 1, ex=settings.FEED_TTL)
+    pipe.execute()
+    return sum(len(members) for members in by_gender.values())
+
+
+def is_ready(user_id):
+    return bool(get_redis().exists(FEED_READY_KEY.format(user_id)))
+
+
+def remove_liked(user_id, liked_ids):
+    """Убирает из ленты пользователя тех, кого он только что лайкнул."""
+    if not liked_ids:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    for gender in GENDERS:
+        pipe.zrem(FEED_KEY.format(user_id, gender), *liked_ids)
+    pipe.execute()
+
+
+async def aremove_liked(user_id, liked_ids):
+    """Асинхронный вариант remove_liked."""
+    if not liked_ids:
+        return
+    pipe = get_async_redis().pipeline(transaction=False)
+    for gender in GENDERS:
+        pipe.zrem(FEED_KEY.format(user_id, gender), *liked_ids)
+    await pipe.execute()
+
+
+def apply_move(user_id, gender, old_point, new_point):
+    """Переносит переместившегося пользователя в лентах ближайших соседей.
+
+    Соседи берутся в порядке удаления, не больше FEED_MOVE_FANOUT у старой и новой точки, поэтому
+    стоимость перемещения не зависит от населения города. Пользователь попадает только в уже
+    построенные ленты, худший элемент которых дальше него, и лента обрезается до FEED_SIZE;
+    из лент соседей старой точки, до которых он теперь дальше радиуса, он удаляется. Более далекие
+    ленты уточняются при пересчете. Пользователи, лайкнувшие его, пропускаются."""
+    near_new = {}
+    if new_point is not None:
+        liked_by = Match.objects.filter(to_user_id=user_id).values('from_user_id')
+        rows = _nearest(user_id, new_point, liked_by).values_list('id', 'distance')
+        near_new = {neighbour_id: distance.km for neighbour_id, distance in rows}
+    near_old = set()
+    if old_point is not None:
+        near_old = set(_nearest(user_id, old_point).values_list('id', flat=True)) - near_new.keys()
+    if not near_new and not near_old:
+        return 0
+
+    client = get_redis()
+    upsert = client.register_script(UPSERT_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    for neighbour_id, distance in near_new.items():
+        upsert(keys=[FEED_KEY.format(neighbour_id, gender), FEED_READY_KEY.format(neighbour_id)],
+               args=[user_id, distance, settings.FEED_SIZE, settings.FEED_TTL], client=pipe)
+    for neighbour_id in near_old:
+        pipe.zrem(FEED_KEY.format(neighbour_id, gender), user_id)
+    results = pipe.execute()
+    return sum(results)
+
+
+def _nearest(user_id, point, liked_by=None):
+    """Не больше FEED_MOVE_FANOUT ближайших к точке пользователей в радиусе FEED_RADIUS (кроме user_id и liked_by)
+    с расстоянием; порядок по оператору <-> читает из GiST-индекса только эти строки."""
+    queryset = User.objects.filter(location__dwithin=(point, D(km=settings.FEED_RADIUS))).exclude(pk=user_id)
+    if liked_by is not None:
+        queryset = queryset.exclude(pk__in=liked_by)
+    return queryset.annotate(distance=Distance('location', point)).order_by(knn_distance(point))[
+        :settings.FEED_MOVE_FANOUT]
+
+
+def page(user_id, gender=None, after=None, size=20):
+    """Возвращает страницу ленты: список (id, расстояние) и курсор следующей страницы.
+
+    Курсор - пара (расстояние, id) последнего элемента; чтение идет с ZRANGEBYSCORE от
+    расстояния курсора, поэтому стоимость зависит от размера страницы, а не ленты."""
+    genders = [gender] if gender else list(GENDERS)
+    after_score, after_id = after if after else (None, None)
+    client = get_redis()
+
+    pipe = client.pipeline(transaction=False)
+    for item_gender in genders:
+        low = after_score if after_score is not None else '-inf'
+        # Запас на элементы с тем же расстоянием, что и у курсора
+        pipe.zrangebyscore(FEED_KEY.format(user_id, item_gender), low, '+inf', start=0, num=size + 50,
+                           withscores=True)
+    items = []
+    for result in pipe.execute():
+        items.extend((score, int(member)) for member, score in result)
+
+    items.sort()
+    if after_score is not None:
+        items = [item for item in items if item > (after_score, after_id)]
+    items = items[:size + 1]
+
+    next_cursor = items[size - 1] if len(items) > size else None
+    return [(candidate_id, score) for score, candidate_id in items[:size]], next_cursor
@@ -0,0 +1,41 @@
+import django_filters
+
+from .models import User
+
+
+class UserListFilter(django_filters.FilterSet):
+    """Фильтры списка пользователей, которые обслуживаются индексами.
+
+    Пол хранится в верхнем регистре и сравнивается на точное совпадение, поэтому вместе с
+    радиусом запрос использует составной GiST-индекс (location, gender). Имя и фамилия
+    сравниваются без учета регистра по функциональным индексам UPPER(...); режим name_match
+    задает способ сравнения: exact - целиком, prefix - по началу строки, fuzzy - по
+    триграммному сходству (индексы pg_trgm)."""
+
+    NAME_LOOKUPS = {
+        'exact': 'iexact',
+        'prefix': 'istartswith',
+        'fuzzy': 'trigram_similar',
+    }
+
+    gender = django_filters.CharFilter(method='filter_gender')
+    first_name = django_filters.CharFilter(method='filter_name')
+    last_name = django_filters.CharFilter(method='filter_name')
+    name_match = django_filters.ChoiceFilter(
+        choices=[(mode, mode) for mode in NAME_LOOKUPS], method='filter_name_match', empty_label=None,
+    )
+
+    class Meta:
+        model = User
+        fields = ('gender', 'first_name', 'last_name', 'name_match')
+
+    def filter_gender(self, queryset, name, value):
+        return queryset.filter(gender=value.upper())
+
+    def filter_name(self, queryset, name, value):
+        lookup = self.NAME_LOOKUPS[self.form.cleaned_data.get('name_match') or 'exact']
+        return queryset.filter(**{f'{name}__{lookup}': value})
+
+    def filter_name_match(self, queryset, name, value):
+        # Режим только меняет сравнение в filter_name
+        return queryset
@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .utils import get_redis
+
+BLOOM_KEY = 'likes:bloom'
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_SECOND_SEED = np.uint64(0x5851F42D4C957F2D)
+
+
+def bloom_parameters(capacity, error_rate):
+    """Число бит и хэш-функций фильтра Блума на capacity элементов с долей ложных срабатываний error_rate."""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2 / 8) * 8
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def _mix(values):
+    # splitmix64: быстрое перемешивание 64-битных ключей, векторизованное в NumPy
+    with np.errstate(over='ignore'):
+        values = values + _GOLDEN
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return values ^ (values >> np.uint64(31))
+
+
+class LikeBloomFilter:
+    """Фильтр Блума по ребрам графа лайков (from_user_id, to_user_id).
+
+    Ответ "нет" точный, "возможно" требует проверки в базе. Битовая карта хранится в Redis
+    одной строкой (бит i - SETBIT/GETBIT со смещением i), собирается целиком в NumPy по
+    таблице Match и дополняется при каждом новом лайке. Ошибки фильтра влияют только на
+    скорость: повторный лайк, который фильтр пропустил, все равно отсекается в базе."""
+
+    def __init__(self, capacity=None, error_rate=None, key=BLOOM_KEY):
+        self.capacity = capacity or settings.LIKES_BLOOM_CAPACITY
+        self.error_rate = error_rate or settings.LIKES_BLOOM_ERROR_RATE
+        self.bits, self.hashes = bloom_parameters(self.capacity, self.error_rate)
+        self.key = key
+
+    def positions(self, from_ids, to_ids):
+        """Номера бит ребер: массив (число ребер, число хэш-функций), двойное хэширование h1 + i * h2."""
+        keys = (np.asarray(from_ids, dtype=np.uint64) << np.uint64(32)) | np.asarray(to_ids, dtype=np.uint64)
+        first = _mix(keys)
+        second = _mix(keys ^ _SECOND_SEED) | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            return (first[:, None] + steps[None, :] * second[:, None]) % np.uint64(self.bits)
+
+    def build_bitmap(self, edges, chunk_size=1_000_000):
+        """Собирает битовую карту (массив байт в порядке бит Redis) из итератора пар (from_user_id, to_user_id)."""
+        bitmap = np.zeros(self.bits // 8, dtype=np.uint8)
+        chunk = []
+        for edge in edges:
+            chunk.append(edge)
+            if len(chunk) >= chunk_size:
+                self._set_bits(bitmap, chunk)
+                chunk = []
+        if chunk:
+            self._set_bits(bitmap, chunk)
+        return bitmap
+
+    def _set_bits(self, bitmap, chunk):
+        from_ids, to_ids = np.asarray(chunk, dtype=np.uint64).T
+        positions = self.positions(from_ids, to_ids).ravel()
+        # В Redis бит 0 - старший бит первого байта
+        masks = np.uint8(0x80) >> (positions & np.uint64(7)).astype(np.uint8)
+        np.bitwise_or.at(bitmap, positions >> np.uint64(3), masks)
+
+    def bitmap_contains(self, bitmap, from_ids, to_ids):
+        """Проверка по локальной битовой карте (для измерений без Redis)."""
+        positions = self.positions(from_ids, to_ids)
+        bytes_ = bitmap[positions >> np.uint64(3)]
+        masks = np.uint8(0x80) >> (positions & np.uint64(7)).astype(np.uint8)
+        return ((bytes_ & masks) != 0).all(axis=1)
+
+    def rebuild(self, edges):
+        """Пересобирает фильтр в Redis по всем ребрам и атомарно подменяет им текущий. Возвращает размер в байтах."""
+        bitmap = self.build_bitmap(edges)
+        client = get_redis()
+        build_key = f'{self.key}:building'
+        client.set(build_key, bitmap.tobytes())
+        client.rename(build_key, self.key)
+        return bitmap.nbytes
+
+    def add(self, from_id, to_ids):
+        """Добавляет новые лайки from_id. Пока фильтр не собран, ничего не делает."""
+        if not to_ids:
+            return
+        client = get_redis()
+        if not client.exists(self.key):
+            return
+        pipe = client.pipeline(transaction=False)
+        for position in self.positions([from_id] * len(to_ids), to_ids).ravel().tolist():
+            pipe.setbit(self.key, position, 1)
+        pipe.execute()
+
+    def might_contain(self, from_id, to_ids):
+        """Возвращает id из to_ids, которые from_id возможно уже лайкал, или None, если фильтр не собран."""
+        if not to_ids:
+            return []
+        positions = self.positions([from_id] * len(to_ids), to_ids)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.exists(self.key)
+        for position in positions.ravel().tolist():
+            pipe.getbit(self.key, position)
+        exists, *bits = pipe.execute()
+        if not exists:
+            return None
+        bits = np.asarray(bits, dtype=bool).reshape(positions.shape)
+        return [to_id for to_id, hit in zip(to_ids, bits.all(axis=1)) if hit]
+
+
+like_filter = LikeBloomFilter()
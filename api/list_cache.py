@@ -0,0 +1,127 @@
+import hashlib
+import json
+import math
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from rest_framework.utils.urls import replace_query_param
+
+KEY_PREFIX = 'list-cache'
+EPOCH_KEY = f'{KEY_PREFIX}:epoch'
+GLOBAL_VERSION_KEY = f'{KEY_PREFIX}:version'
+CELL_VERSION_KEY = KEY_PREFIX + ':cell:{}:{}'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+# Параметры запроса, от которых зависит ответ списка (координаты учитываются через ячейку)
+KEY_PARAMS = ('gender', 'first_name', 'last_name', 'name_match', 'radius', 'nearest', 'avatar_size', 'cursor',
+              'page_size')
+CASE_INSENSITIVE_PARAMS = ('gender', 'first_name', 'last_name')
+
+
+def quantize(point):
+    """Приводит точку к центру ячейки сетки LIST_CACHE_QUANTUM, чтобы соседние пользователи делили записи кэша."""
+    step = settings.LIST_CACHE_QUANTUM
+    return Point((math.floor(point.x / step) + 0.5) * step, (math.floor(point.y / step) + 0.5) * step, srid=4326)
+
+
+def cell_of(point):
+    """Ячейка сетки инвалидации LIST_CACHE_CELL, в которую попадает точка."""
+    step = settings.LIST_CACHE_CELL
+    return math.floor(point.x / step), math.floor(point.y / step)
+
+
+def cells_around(point, radius_km):
+    """Ячейки инвалидации, покрывающие круг радиуса radius_km, или None, если их слишком много."""
+    dlat = radius_km / 111.32
+    dlon = dlat / max(math.cos(math.radians(point.y)), 0.01)
+    step = settings.LIST_CACHE_CELL
+    x_range = range(math.floor((point.x - dlon) / step), math.floor((point.x + dlon) / step) + 1)
+    y_range = range(math.floor((point.y - dlat) / step), math.floor((point.y + dlat) / step) + 1)
+    if len(x_range) * len(y_range) > settings.LIST_CACHE_MAX_CELLS:
+        return None
+    return [(x, y) for x in x_range for y in y_range]
+
+
+def build_key(query_params, point=None):
+    """Строит ключ кэша по фильтрам запроса, ячейке пользователя и версиям затронутых ячеек.
+
+    Список без радиуса (в том числе ближайшие N без радиуса) зависит от всех пользователей и
+    привязан к общей версии; список с радиусом - только к версиям ячеек, которые покрывает круг поиска."""
+    params = {}
+    for name in KEY_PARAMS:
+        value = query_params.get(name)
+        if value:
+            params[name] = value.upper() if name in CASE_INSENSITIVE_PARAMS else value
+
+    radius = params.get('radius')
+    cells = cells_around(point, float(radius)) if radius and point is not None else None
+    version_keys = [CELL_VERSION_KEY.format(*cell) for cell in cells] if cells else [GLOBAL_VERSION_KEY]
+    version_keys.append(EPOCH_KEY)
+    versions = cache.get_many(version_keys)
+
+    # Результат поиска по радиусу и ближайших зависит от точки
+    if (radius or params.get('nearest')) and point is not None:
+        params['point'] = [point.x, point.y]
+    params['versions'] = [versions.get(key, 0) for key in version_keys]
+
+    digest = hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f'{KEY_PREFIX}:{digest}'
+
+
+def get_response(key, request):
+    """Возвращает закэшированный ответ с переписанными под текущий запрос ссылками пагинации или None."""
+    data = cache.get(key)
+    if data is None:
+        _incr(MISSES_KEY)
+        return None
+
+    _incr(HITS_KEY)
+    # В кэше лежат ссылки запроса, который его наполнил; курсор берем из них, остальное - из текущего запроса
+    url = request.build_absolute_uri()
+    for name in ('next', 'previous'):
+        if data.get(name):
+            cursor = parse_qs(urlsplit(data[name]).query).get('cursor')
+            data[name] = replace_query_param(url, 'cursor', cursor[0]) if cursor else url
+    return data
+
+
+def set_response(key, data):
+    """Сохраняет ответ списка; срок жизни - лишь страховка, записи сбрасываются по версиям ячеек."""
+    cache.set(key, data, settings.LIST_CACHE_TIMEOUT)
+
+
+def invalidate(*points):
+    """Сбрасывает записи, на которые могли повлиять изменения пользователей в ячейках заданных точек."""
+    keys = {GLOBAL_VERSION_KEY}
+    keys.update(CELL_VERSION_KEY.format(*cell_of(point)) for point in points if point is not None)
+    for key in keys:
+        _incr(key)
+
+
+def clear():
+    """Сбрасывает все записи кэша (после массовых изменений в обход сигналов моделей)."""
+    _incr(EPOCH_KEY)
+
+
+def stats():
+    """Счетчики попаданий и промахов кэша."""
+    values = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': values.get(HITS_KEY, 0), 'misses': values.get(MISSES_KEY, 0)}
+
+
+def reset_stats():
+    """Обнуляет счетчики попаданий и промахов."""
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def _incr(key):
+    # Ключ создается без срока жизни, затем атомарно увеличивается
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключ успел истечь или быть удаленным между add и incr
+        cache.set(key, 1, None)
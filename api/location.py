@@ -0,0 +1,115 @@
+import redis
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import transaction
+from geopy.distance import great_circle
+
+from .models import User
+from .signals import location_changed, locations_saved
+from .utils import get_async_redis, get_redis, run_blocking
+
+PENDING_KEY = 'location:pending'
+FLUSHING_KEY = 'location:flushing'
+SEEN_KEY = 'location:seen:{}'
+
+
+def _encode(point):
+    return f'{point.x},{point.y}'
+
+
+def _decode(value):
+    lon, lat = value.decode().split(',')
+    return Point(float(lon), float(lat), srid=4326)
+
+
+def get_buffered_location(user_id):
+    """Возвращает последнее местоположение пользователя, еще не записанное в базу, или None."""
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.hget(PENDING_KEY, user_id)
+    pipe.hget(FLUSHING_KEY, user_id)
+    pending, flushing = pipe.execute()
+    value = pending or flushing
+    return _decode(value) if value else None
+
+
+def record_location(user, point):
+    """Кладет новое местоположение пользователя в буфер вместо записи строки в базу.
+
+    Обновление пропускается, если пользователь сместился меньше чем на LOCATION_MIN_DISTANCE
+    метров или предыдущее обновление принято менее LOCATION_MIN_INTERVAL секунд назад.
+    Возвращает True, если местоположение принято.
+    """
+    current = get_buffered_location(user.pk) or user.location
+    if not _moved_enough(current, point):
+        return False
+
+    client = get_redis()
+    if not client.set(SEEN_KEY.format(user.pk), 1, nx=True, ex=settings.LOCATION_MIN_INTERVAL):
+        return False
+
+    client.hset(PENDING_KEY, user.pk, _encode(point))
+    location_changed.send(sender=User, user_id=user.pk, old=current, new=point)
+    return True
+
+
+def _moved_enough(current, point):
+    if current is None:
+        return True
+    return great_circle((current.y, current.x), (point.y, point.x)).m >= settings.LOCATION_MIN_DISTANCE
+
+
+async def aget_buffered_location(user_id):
+    """Асинхронный вариант get_buffered_location."""
+    pending, flushing = await (
+        get_async_redis().pipeline(transaction=False).hget(PENDING_KEY, user_id).hget(FLUSHING_KEY, user_id).execute()
+    )
+    value = pending or flushing
+    return _decode(value) if value else None
+
+
+async def arecord_location(user, point):
+    """Асинхронный вариант record_location: Redis опрашивается без блокировки цикла событий,
+    обработчики сигнала location_changed (индекс, кэш, задачи Celery) выполняются в пуле потоков."""
+    current = await aget_buffered_location(user.pk) or user.location
+    if not _moved_enough(current, point):
+        return False
+
+    client = get_async_redis()
+    if not await client.set(SEEN_KEY.format(user.pk), 1, nx=True, ex=settings.LOCATION_MIN_INTERVAL):
+        return False
+
+    await client.hset(PENDING_KEY, user.pk, _encode(point))
+    await run_blocking(location_changed.send, sender=User, user_id=user.pk, old=current, new=point)
+    return True
+
+
+def flush_buffered_locations(batch_size=1000):
+    """Записывает накопленные местоположения в базу пакетными UPDATE только поля location.
+
+    Буфер атомарно переименовывается перед записью, поэтому новые позиции, пришедшие во
+    время сброса, попадают уже в следующий пакет. Если предыдущий сброс упал, его данные
+    записываются первыми. Возвращает количество обновленных пользователей.
+    """
+    client = get_redis()
+    if not client.exists(FLUSHING_KEY):
+        try:
+            client.rename(PENDING_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            # Буфер пуст
+            return 0
+
+    pending = client.hgetall(FLUSHING_KEY)
+    users = [User(pk=int(user_id), location=_decode(value)) for user_id, value in pending.items()]
+    # Строки блокируются до записи: пользователи, удаленные до сброса, отбрасываются и не вернутся в индекс и
+    # ленты через locations_saved, а удаление во время сброса дождется его окончания
+    with transaction.atomic():
+        previous = dict(
+            User.objects.select_for_update().filter(pk__in=[user.pk for user in users]).order_by('id')
+            .values_list('id', 'location')
+        )
+        users = [user for user in users if user.pk in previous]
+        User.objects.bulk_update(users, ['location'], batch_size=batch_size)
+    client.delete(FLUSHING_KEY)
+
+    locations_saved.send(sender=User, moves=[(user.pk, previous[user.pk], user.location) for user in users])
+    return len(users)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from api.models import Match
+
+
+class Command(BaseCommand):
+    """Выставляет флаг matched по встречным лайкам для уже существующих данных."""
+
+    help = ('Выставляет Match.matched (на нем основан список пар GET /pairs/) для лайков, сохраненных в обход '
+            'создания лайков API (SQL, старые версии, ручные правки). Таблица обходится диапазонами id, каждый '
+            'в своей транзакции; повторный запуск безопасен.')
+
+    # Только FALSE -> TRUE: встречный лайк, уже видимый в базе, всегда означает пару, поэтому обновление не
+    # конфликтует с одновременными лайками (лайки не удаляются иначе как вместе с обоими пользователями)
+    FIX_SQL = """
+        UPDATE {match} m SET matched = TRUE
+        WHERE m.id >= %s AND m.id < %s AND NOT m.matched
+          AND EXISTS (SELECT 1 FROM {match} r WHERE r.from_user_id = m.to_user_id AND r.to_user_id = m.from_user_id)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help='диапазон id за одну транзакцию')
+
+    def handle(self, *args, **options):
+        last_id = Match.objects.aggregate(last=Max('id'))['last'] or 0
+        sql = self.FIX_SQL.format(match=Match._meta.db_table)
+        fixed = 0
+        for start in range(0, last_id + 1, options['batch_size']):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, [start, start + options['batch_size']])
+                fixed += cursor.rowcount
+        self.stdout.write(f'лайков проверено до id {last_id}, исправлен флаг matched: {fixed}')
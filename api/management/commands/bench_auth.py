@@ -0,0 +1,57 @@
+import base64
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.request import Request
+
+from api import tokens
+from api.authentication import SignedTokenAuthentication
+from api.models import User
+
+
+class Command(BaseCommand):
+    """Сравнивает стоимость аутентификации запроса: Basic (PBKDF2) и подписанный токен с кэшем пользователя и без."""
+
+    help = 'Время и число запросов к базе на аутентификацию одного запроса для Basic и токенов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='запросов на схему')
+        parser.add_argument('--prefix', default='bench', help='префикс email пользователей generate_population')
+        parser.add_argument('--password', default='Password.1', help='пароль пользователей generate_population')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email__startswith=options['prefix']).first()
+        if user is None:
+            raise CommandError('Нет пользователей для проверки: сначала выполните generate_population')
+
+        basic = base64.b64encode(f'{user.email}:{options["password"]}'.encode()).decode()
+        token = tokens.issue_token(user)
+        schemes = [
+            ('basic', BasicAuthentication(), f'Basic {basic}', False),
+            ('token (без кэша)', SignedTokenAuthentication(), f'Bearer {token}', True),
+            ('token (кэш)', SignedTokenAuthentication(), f'Bearer {token}', False),
+        ]
+
+        self.stdout.write(f'{"схема":<18} {"p50, мс":>8} {"p99, мс":>8} {"SQL/запр":>9}')
+        factory = RequestFactory()
+        for name, authenticator, header, cold in schemes:
+            latencies, queries = [], []
+            for _ in range(options['requests']):
+                if cold:
+                    tokens.forget_users(user.pk)
+                request = Request(factory.get('/list/', HTTP_AUTHORIZATION=header), authenticators=[authenticator])
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    authenticated = request.user
+                    latencies.append((time.perf_counter() - started) * 1000)
+                queries.append(len(captured))
+                if not authenticated.is_authenticated:
+                    raise CommandError(f'Схема {name} не аутентифицировала пользователя: проверьте --password')
+
+            p50, p99 = np.percentile(latencies, [50, 99])
+            self.stdout.write(f'{name:<18} {p50:>8.2f} {p99:>8.2f} {np.mean(queries):>9.1f}')
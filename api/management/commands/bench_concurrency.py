@@ -0,0 +1,134 @@
+import asyncio
+import json
+import random
+import time
+
+import httpx
+import numpy as np
+from django.contrib.auth import (BACKEND_SESSION_KEY, HASH_SESSION_KEY,
+                                 SESSION_KEY)
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.middleware.csrf import get_token
+from django.test import RequestFactory
+
+from api.models import User
+
+SCENARIOS = {
+    'list_radius': {'sync': '/list/', 'async': '/async/list/'},
+    'match': {'sync': '/clients/{user_id}/match/', 'async': '/async/clients/{user_id}/match/'},
+}
+
+
+class Command(BaseCommand):
+    """Нагружает запущенный сервер заданным числом одновременных клиентов и сравнивает синхронные и асинхронные view."""
+
+    help = ('Пропускная способность и задержки /list/ и /clients/<id>/match/ и их асинхронных вариантов '
+            'при 1, 100 и 1000 одновременных клиентах. Сервер должен быть запущен отдельно.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', default='http://localhost:8000', help='адрес WSGI-сервера')
+        parser.add_argument('--async-url', default='http://localhost:8001', help='адрес ASGI-сервера')
+        parser.add_argument('--paths', nargs='+', choices=('sync', 'async'), default=['sync', 'async'])
+        parser.add_argument('--scenarios', nargs='+', choices=tuple(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 100, 1000])
+        parser.add_argument('--requests', type=int, default=2000, help='запросов на каждый уровень нагрузки')
+        parser.add_argument('--clients', type=int, default=100, help='число авторизованных пользователей')
+        parser.add_argument('--radius', type=float, default=5.0, help='радиус для list_radius, км')
+        parser.add_argument('--prefix', default='bench', help='префикс email пользователей generate_population')
+        parser.add_argument('--timeout', type=float, default=60.0, help='таймаут одного запроса, с')
+        parser.add_argument('--json', dest='json_path', help='сохранить результаты в JSON-файл')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.users = list(
+            User.objects.filter(email__startswith=options['prefix'], location__isnull=False)
+            .order_by('?').values_list('id', 'location')[:max(options['clients'] * 10, 100)]
+        )
+        if len(self.users) < 2:
+            raise CommandError('Недостаточно пользователей: сначала выполните generate_population')
+        self.sessions = [(user_id, location, self.login(user_id)) for user_id, location in
+                         self.users[:options['clients']]]
+
+        results = []
+        self.stdout.write(f'{"путь":<6} {"сценарий":<12} {"клиентов":>8} {"запросов":>8} {"ошибок":>7} '
+                          f'{"запр/с":>8} {"p50, мс":>8} {"p99, мс":>9}')
+        for path in options['paths']:
+            base_url = options['sync_url'] if path == 'sync' else options['async_url']
+            for scenario in options['scenarios']:
+                for concurrency in options['concurrency']:
+                    row = asyncio.run(self.run_level(base_url, SCENARIOS[scenario][path], scenario, concurrency))
+                    row.update(path=path, scenario=scenario, concurrency=concurrency)
+                    results.append(row)
+                    self.stdout.write(
+                        f'{path:<6} {scenario:<12} {concurrency:>8} {row["requests"]:>8} {row["errors"]:>7} '
+                        f'{row["throughput"]:>8.1f} {row["p50_ms"]:>8.1f} {row["p99_ms"]:>9.1f}'
+                    )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    @staticmethod
+    def login(user_id):
+        """Создает сессию пользователя и CSRF-токен, чтобы не проверять пароль на каждом запросе."""
+        user = User.objects.get(pk=user_id)
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+
+        request = RequestFactory().get('/')
+        token = get_token(request)
+        return {
+            'Cookie': f'sessionid={session.session_key}; csrftoken={request.META["CSRF_COOKIE"]}',
+            'X-CSRFToken': token,
+        }
+
+    def build_request(self, path, scenario):
+        user_id, location, headers = self.rng.choice(self.sessions)
+        if scenario == 'match':
+            to_user_id, _ = self.rng.choice(self.users)
+            return 'POST', path.format(user_id=user_id), {'headers': headers, 'json': {'to_user': to_user_id}}
+        params = {
+            'latitude': location.y + self.rng.uniform(-0.01, 0.01),
+            'longitude': location.x + self.rng.uniform(-0.01, 0.01),
+            'radius': self.options['radius'],
+        }
+        return 'GET', path, {'headers': headers, 'params': params}
+
+    async def run_level(self, base_url, path, scenario, concurrency):
+        count = max(self.options['requests'], concurrency)
+        pending = iter(range(count))
+        latencies, errors = [], 0
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=self.options['timeout']) as client:
+            async def worker():
+                nonlocal errors
+                for _ in pending:
+                    method, url, kwargs = self.build_request(path, scenario)
+                    started = time.perf_counter()
+                    try:
+                        response = await client.request(method, url, **kwargs)
+                        failed = response.status_code >= 400
+                    except httpx.HTTPError:
+                        failed = True
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    errors += failed
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        p50, p99 = np.percentile(latencies, [50, 99])
+        return {
+            'requests': count,
+            'errors': errors,
+            'throughput': count / elapsed,
+            'p50_ms': float(p50),
+            'p99_ms': float(p99),
+        }
@@ -0,0 +1,88 @@
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api import db
+from api.models import User
+from api.views import UserListViewSet
+
+
+class Command(BaseCommand):
+    """Показывает стоимость подключения к базе на запрос и долю чтений списка, ушедших с основной базы на реплики."""
+
+    help = ('Сравнивает запрос к базе с новым соединением и с постоянным (CONN_MAX_AGE) и считает SQL-запросы '
+            'GET /list/ по базам: без реплик, с репликами DB_REPLICA_HOSTS и для пользователя, недавно писавшего в '
+            'базу. Для второй части нужна хотя бы одна реплика (например, второй локальный PostgreSQL).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+        parser.add_argument('--radius', default='10', help='радиус поиска в запросах списка, км')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(location__isnull=False).first()
+        if user is None:
+            raise CommandError('Нет пользователей с местоположением: сначала выполните generate_population')
+
+        self.bench_connection_setup(user, options['requests'])
+        if not settings.DATABASE_REPLICAS:
+            self.stdout.write('Реплики не заданы (DB_REPLICA_HOSTS): распределение чтений не измеряется')
+            return
+        self.bench_routing(user, options)
+
+    def bench_connection_setup(self, user, requests):
+        self.stdout.write(f'{"соединение":<12} {"p50, мс":>8} {"p99, мс":>8}')
+        for name, reconnect in (('новое', True), ('постоянное', False)):
+            latencies = []
+            for _ in range(requests):
+                if reconnect:
+                    # Как в конце запроса при CONN_MAX_AGE = 0
+                    connection.close()
+                started = time.perf_counter()
+                User.objects.filter(pk=user.pk).exists()
+                latencies.append((time.perf_counter() - started) * 1000)
+            p50, p99 = np.percentile(latencies, [50, 99])
+            self.stdout.write(f'{name:<12} {p50:>8.2f} {p99:>8.2f}')
+
+    def bench_routing(self, user, options):
+        view = UserListViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+        aliases = list(settings.DATABASES)
+        scenarios = [
+            ('без реплик', [], False),
+            ('с репликами', settings.DATABASE_REPLICAS, False),
+            ('после записи', settings.DATABASE_REPLICAS, True),
+        ]
+
+        self.stdout.write(f'{"сценарий":<14} ' + ' '.join(f'{alias:>10}' for alias in aliases) + f' {"p50, мс":>8}')
+        for name, replicas, pinned in scenarios:
+            counts = Counter()
+
+            def count_queries(execute, sql, params, many, context):
+                counts[context['connection'].alias] += 1
+                return execute(sql, params, many, context)
+
+            latencies = []
+            with override_settings(DATABASE_REPLICAS=replicas, LIST_CACHE_ENABLED=False), ExitStack() as stack:
+                for alias in aliases:
+                    stack.enter_context(connections[alias].execute_wrapper(count_queries))
+                for _ in range(options['requests']):
+                    if pinned:
+                        db.pin_primary(user.pk)
+                    request = factory.get('/list/', {'radius': options['radius']})
+                    force_authenticate(request, user=user)
+                    started = time.perf_counter()
+                    response = view(request)
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise CommandError(f'GET /list/ вернул {response.status_code}')
+
+            per_request = ' '.join(f'{counts[alias] / options["requests"]:>10.2f}' for alias in aliases)
+            self.stdout.write(f'{name:<14} {per_request} {np.percentile(latencies, 50):>8.2f}')
+        self.stdout.write('(в колонках баз - SQL-запросов на запрос списка)')
@@ -0,0 +1,83 @@
+import json
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import density
+
+
+class Command(BaseCommand):
+    """Сравнивает ответ /density/ с выгрузкой тех же пользователей списком на синтетических точках."""
+
+    help = 'Тайлы плотности без Redis и базы: размер ответа против списка, скорость разбиения и обновлений.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200_000, help='число пользователей вокруг центра')
+        parser.add_argument('--zoom', type=int, default=11)
+        parser.add_argument('--bbox', default='37.3,55.55,37.9,55.9', help='область minlon,minlat,maxlon,maxlat')
+        parser.add_argument('--moves', type=int, default=10_000, help='число перемещений для оценки обновлений')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        west, south, east, north = (float(value) for value in options['bbox'].split(','))
+        zoom = options['zoom']
+        users = options['users']
+        lons = rng.normal((west + east) / 2, (east - west) / 6, users)
+        lats = rng.normal((south + north) / 2, (north - south) / 6, users)
+        genders = rng.integers(1, len(density.VARIANTS), users)
+
+        visible = (lons >= west) & (lons <= east) & (lats >= south) & (lats <= north)
+        rows = [
+            {'id': i + 1, 'first_name': f'Имя{i}', 'last_name': f'Фамилия{i}', 'gender': density.VARIANTS[gender],
+             'avatar': 'http://localhost/media/default/default_avatar.png',
+             'location': f'SRID=4326;POINT ({lon} {lat})'}
+            for i, (lon, lat, gender) in enumerate(zip(lons[visible], lats[visible], genders[visible]))
+        ]
+        list_bytes = len(json.dumps(rows, ensure_ascii=False).encode())
+
+        # Те же ячейки, что считает запрос к PostGIS в density.build_tiles
+        started = time.perf_counter()
+        shift = density.bins_shift()
+        mask = settings.DENSITY_TILE_BINS - 1
+        tiles = set(density.tiles_in_bbox(west, south, east, north, zoom))
+        gx, gy = density.global_cells(lons, lats, zoom + shift)
+        cells, counts = np.unique(np.stack([gx, gy], axis=1), axis=0, return_counts=True)
+        by_tile = {tile: [] for tile in tiles}
+        for (cell_x, cell_y), count in zip(cells.tolist(), counts.tolist()):
+            tile = (cell_x >> shift, cell_y >> shift)
+            if tile in by_tile:
+                by_tile[tile].append([cell_x & mask, cell_y & mask, count])
+        response = {
+            'zoom': zoom,
+            'bins': settings.DENSITY_TILE_BINS,
+            'tiles': [
+                {'x': x, 'y': y, 'bounds': [round(value, 6) for value in density.tile_bounds(zoom, x, y)],
+                 'total': sum(count for _, _, count in tile_cells), 'cells': tile_cells}
+                for (x, y), tile_cells in sorted(by_tile.items())
+            ],
+        }
+        density_bytes = len(json.dumps(response, separators=(',', ':')).encode())
+        build_seconds = time.perf_counter() - started
+
+        moves = min(options['moves'], users)
+        moved = rng.choice(users, moves, replace=False)
+        shifted_lons = lons[moved] + rng.normal(0, 0.01, moves)
+        shifted_lats = lats[moved] + rng.normal(0, 0.01, moves)
+        started = time.perf_counter()
+        updates = sum(1 for _ in density.cell_deltas(
+            np.concatenate([lons[moved], shifted_lons] * 2),
+            np.concatenate([lats[moved], shifted_lats] * 2),
+            np.concatenate([-np.ones(moves, dtype=np.int64), np.ones(moves, dtype=np.int64)] * 2),
+            np.concatenate([np.zeros(2 * moves, dtype=np.int64), genders[moved], genders[moved]]),
+        ))
+        update_seconds = time.perf_counter() - started
+
+        self.stdout.write(f'в области: {len(rows)} пользователей, список: {list_bytes / 1024:,.0f} КБ, '
+                          f'плотность: {len(tiles)} тайлов, {density_bytes / 1024:,.1f} КБ '
+                          f'(в {list_bytes / density_bytes:,.0f} раз меньше)')
+        self.stdout.write(f'разбиение {users} точек: {build_seconds * 1000:.0f} мс; {moves} перемещений: '
+                          f'{updates} изменений ячеек в масштабах 0..{settings.DENSITY_MAX_ZOOM} '
+                          f'за {update_seconds * 1000:.0f} мс')
@@ -0,0 +1,85 @@
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.filters import UserListFilter
+from api.models import User
+from api.views import knn_distance
+
+# Индексы миграции 0004; для плана "до" они удаляются внутри откатываемой транзакции
+FILTER_INDEXES = (
+    'user_first_name_upper_idx',
+    'user_last_name_upper_idx',
+    'user_first_name_trgm_idx',
+    'user_last_name_trgm_idx',
+    'user_location_gender_gist',
+)
+
+
+class Command(BaseCommand):
+    """Выводит планы запросов списка пользователей до и после индексов фильтрации."""
+
+    help = ('EXPLAIN запросов /list/ с фильтрами по имени, полу и радиусу и режима nearest: "до" - прежние '
+            'фильтры (iexact, ST_Distance) без индексов миграции 0004, "после" - текущие. Индексы удаляются '
+            'только внутри транзакции, которая откатывается, но на время запроса таблица блокируется.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='выполнить запросы (EXPLAIN ANALYZE)')
+        parser.add_argument('--radius', type=float, default=5.0, help='радиус, км')
+        parser.add_argument('--page-size', type=int, default=50)
+
+    def handle(self, *args, **options):
+        sample = User.objects.filter(location__isnull=False).order_by('?').first()
+        if sample is None:
+            raise CommandError('В базе нет пользователей с местоположением: выполните generate_population')
+
+        point, radius, size = sample.location, D(km=options['radius']), options['page_size']
+        name = sample.first_name
+        base = User.objects.exclude(location__isnull=True)
+
+        def by_id(queryset):
+            return queryset.order_by('id')[:size]
+
+        def by_distance(queryset):
+            return queryset.annotate(distance=Distance('location', point)).order_by('distance', 'id')[:size]
+
+        def filtered(**data):
+            return UserListFilter(data, queryset=base).qs
+
+        cases = [
+            ('имя целиком', by_id(base.filter(first_name__iexact=name)), by_id(filtered(first_name=name))),
+            ('имя по префиксу', by_id(base.filter(first_name__istartswith=name[:3])),
+             by_id(filtered(first_name=name[:3], name_match='prefix'))),
+            ('имя нечетко', by_id(base.filter(first_name__trigram_similar=name)),
+             by_id(filtered(first_name=name, name_match='fuzzy'))),
+            ('пол и радиус',
+             by_distance(base.filter(gender__iexact=sample.gender, location__distance_lte=(point, radius))),
+             by_distance(filtered(gender=sample.gender).filter(location__dwithin=(point, radius)))),
+            ('пол, имя и радиус',
+             by_distance(base.filter(gender__iexact=sample.gender, first_name__istartswith=name[:1],
+                                     location__distance_lte=(point, radius))),
+             by_distance(filtered(gender=sample.gender, first_name=name[:1], name_match='prefix')
+                         .filter(location__dwithin=(point, radius)))),
+            ('ближайшие N', base.filter(location__distance_lte=(point, radius))
+             .annotate(distance=Distance('location', point)).order_by('distance', 'id'),
+             base.annotate(distance=Distance('location', point)).order_by(knn_distance(point), 'id')[:size]),
+        ]
+
+        explain_options = {'analyze': True, 'buffers': True} if options['analyze'] else {}
+        for title, before, after in cases:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{title}: до'))
+            self.stdout.write(self.explain_without_indexes(before, **explain_options))
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{title}: после'))
+            self.stdout.write(after.explain(**explain_options))
+            self.stdout.write('')
+
+    @staticmethod
+    def explain_without_indexes(queryset, **options):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for index in FILTER_INDEXES:
+                    cursor.execute(f'DROP INDEX IF EXISTS {index}')
+            plan = queryset.explain(**options)
+            transaction.set_rollback(True)
+        return plan
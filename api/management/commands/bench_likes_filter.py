@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from api.likes import LikeBloomFilter
+
+
+class Command(BaseCommand):
+    """Измеряет размер, долю ложных срабатываний и скорость фильтра Блума лайков на синтетическом графе."""
+
+    help = 'Фильтр Блума лайков без Redis и базы: память, ожидаемая и измеренная доля ложных срабатываний, скорость.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, default=1_000_000, help='число лайков в графе')
+        parser.add_argument('--users', type=int, default=100_000, help='число пользователей')
+        parser.add_argument('--probes', type=int, default=1_000_000, help='число проверок пар без лайка')
+        parser.add_argument('--capacity', type=int, help='емкость фильтра (по умолчанию равна --edges)')
+        parser.add_argument('--error-rate', type=float, default=0.01, help='целевая доля ложных срабатываний')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        users = options['users']
+        bloom = LikeBloomFilter(capacity=options['capacity'] or options['edges'], error_rate=options['error_rate'])
+
+        edges = np.unique(rng.integers(1, users + 1, size=(options['edges'], 2), dtype=np.int64), axis=0)
+        started = time.perf_counter()
+        bitmap = bloom.build_bitmap(map(tuple, edges.tolist()))
+        build_time = time.perf_counter() - started
+
+        # Пары без лайка: случайные пары за вычетом существующих ребер
+        packed = edges[:, 0] * (users + 1) + edges[:, 1]
+        probes = rng.integers(1, users + 1, size=(options['probes'], 2), dtype=np.int64)
+        probes = probes[~np.isin(probes[:, 0] * (users + 1) + probes[:, 1], packed)]
+
+        started = time.perf_counter()
+        hits = bloom.bitmap_contains(bitmap, probes[:, 0], probes[:, 1])
+        check_time = time.perf_counter() - started
+        members = bloom.bitmap_contains(bitmap, edges[:, 0], edges[:, 1])
+
+        fill = np.unpackbits(bitmap).mean()
+        self.stdout.write(f'ребер: {len(edges)}, бит: {bloom.bits}, хэш-функций: {bloom.hashes}, '
+                          f'размер: {bitmap.nbytes / 2 ** 20:.2f} МБ '
+                          f'({bitmap.nbytes / len(edges) * 1_000_000 / 2 ** 20:.2f} МБ на 1 млн лайков)')
+        self.stdout.write(f'заполнено бит: {fill:.1%}, ложных срабатываний: {hits.mean():.4%} '
+                          f'(ожидается {fill ** bloom.hashes:.4%}), найдено своих ребер: {members.mean():.0%}')
+        self.stdout.write(f'сборка: {len(edges) / build_time:,.0f} ребер/с, '
+                          f'проверка: {len(probes) / check_time:,.0f} пар/с')
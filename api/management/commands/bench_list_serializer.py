@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import Distance
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.models import User
+from api.serializers import UserListFastSerializer, UserListSerializer
+
+
+class Command(BaseCommand):
+    """Сравнивает UserListSerializer и быстрый путь UserListFastSerializer на синтетических строках."""
+
+    help = 'Бенчмарк сериализации списка пользователей: строк в секунду и побайтовое совпадение ответа.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000)
+        parser.add_argument('--no-radius', action='store_true', help='запрос без радиуса (без поля distance)')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        query = {} if options['no_radius'] else {'radius': '10'}
+        request = Request(APIRequestFactory().get('/list/', query))
+        context = {'request': request, 'distances': None}
+
+        instances, rows = [], []
+        for i in range(options['rows']):
+            location = Point(37.6 + rng.uniform(-0.1, 0.1), 55.7 + rng.uniform(-0.1, 0.1), srid=4326)
+            distance = Distance(m=rng.uniform(0, 10000))
+            avatar = 'default/default_avatar.png' if i % 3 else f'avatars/avatar_{i}.png'
+            user = User(pk=i + 1, first_name=f'Имя{i}', last_name=f'Фамилия{i}', gender='MW'[i % 2],
+                        avatar=avatar, location=location)
+            user.distance = distance
+            instances.append(user)
+            rows.append({'id': i + 1, 'first_name': user.first_name, 'last_name': user.last_name,
+                         'gender': user.gender, 'avatar': avatar, 'location': location, 'distance': distance})
+
+        started = time.perf_counter()
+        expected = UserListSerializer(instances, many=True, context=context).data
+        serializer_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        actual = UserListFastSerializer(context).to_representation(rows)
+        fast_seconds = time.perf_counter() - started
+
+        renderer = JSONRenderer()
+        if renderer.render(expected) != renderer.render(actual):
+            raise CommandError('Ответы быстрого пути и UserListSerializer различаются')
+
+        count = options['rows']
+        self.stdout.write(f'UserListSerializer: {count / serializer_seconds:.0f} строк/с')
+        self.stdout.write(f'UserListFastSerializer: {count / fast_seconds:.0f} строк/с')
+        self.stdout.write('Ответы совпадают побайтно')
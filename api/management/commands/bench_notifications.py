@@ -0,0 +1,59 @@
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from api.notifications import send_batch
+
+
+class Command(BaseCommand):
+    """Сравнивает отправку писем о парах по одному соединению на письмо и пачками по общему соединению."""
+
+    help = ('Бенчмарк рассылки писем о парах. По умолчанию использует locmem backend; чтобы увидеть стоимость '
+            'SMTP-рукопожатий, укажите --backend django.core.mail.backends.smtp.EmailBackend и локальный '
+            'SMTP-сервер-заглушку (например, python -m aiosmtpd -n -l localhost:1025).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--recipients', type=int, default=100, help='число разных получателей')
+        parser.add_argument('--backend', default='django.core.mail.backends.locmem.EmailBackend')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--port', type=int, default=1025)
+
+    def handle(self, *args, **options):
+        items = [
+            {
+                'to_email': f'user{i % options["recipients"]}@example.com',
+                'match_name': f'User{i}',
+                'match_email': f'match{i}@example.com',
+            }
+            for i in range(options['messages'])
+        ]
+        backend_options = {'backend': options['backend']}
+        if options['backend'].endswith('smtp.EmailBackend'):
+            backend_options.update(host=options['host'], port=options['port'], use_ssl=False, use_tls=False,
+                                   username='', password='')
+
+        # Прежняя задача: на каждое письмо свое соединение
+        started = time.perf_counter()
+        for item in items:
+            EmailMessage(
+                subject='У вас есть пара!',
+                body='Вы понравились "{}"! Почта участника: {}'.format(item['match_name'], item['to_email']),
+                to=[item['to_email']],
+                connection=get_connection(**backend_options),
+            ).send()
+        self.report('по одному соединению на письмо', len(items), len(items), time.perf_counter() - started)
+
+        for digest in (False, True):
+            started = time.perf_counter()
+            with get_connection(**backend_options) as connection:
+                sent = send_batch(items, connection=connection, digest=digest)
+            label = 'пачкой с дайджестом' if digest else 'пачкой по общему соединению'
+            self.report(label, len(items), sent, time.perf_counter() - started)
+
+    def report(self, label, matches, sent, elapsed):
+        self.stdout.write(
+            f'{label}: {sent} писем на {matches} пар за {elapsed:.3f} с, '
+            f'{matches / elapsed:.0f} пар/с'
+        )
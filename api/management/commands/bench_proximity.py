@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.proximity import ProximityIndex
+
+
+class Command(BaseCommand):
+    """Сравнивает поиск по радиусу в индексе процесса с запросом к PostGIS на синтетических данных."""
+
+    help = 'Бенчмарк поиска пользователей по радиусу: индекс в памяти против PostGIS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000, 1000000])
+        parser.add_argument('--radius', type=float, default=5.0, help='радиус поиска, км')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--center', type=float, nargs=2, default=[37.62, 55.75], metavar=('LON', 'LAT'))
+        parser.add_argument('--spread', type=float, default=1.0, help='разброс координат вокруг центра, градусы')
+        parser.add_argument('--no-postgis', action='store_true', help='не выполнять сравнение с PostGIS')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        lon0, lat0 = options['center']
+        spread, radius = options['spread'], options['radius']
+
+        for count in options['users']:
+            lons = lon0 + rng.uniform(-spread, spread, count)
+            lats = lat0 + rng.uniform(-spread, spread, count)
+            ids = np.arange(1, count + 1)
+            probes = rng.integers(0, count, options['queries'])
+
+            index = ProximityIndex()
+            started = time.perf_counter()
+            index.build(zip(ids.tolist(), lons.tolist(), lats.tolist()))
+            build_ms = (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            results = [index.query(lons[i], lats[i], radius) for i in probes]
+            memory_ms = (time.perf_counter() - started) * 1000 / len(probes)
+            found = np.mean([len(result[0]) for result in results])
+
+            self.stdout.write(
+                f'{count} пользователей: построение {build_ms:.1f} мс, '
+                f'запрос в памяти {memory_ms:.3f} мс, в среднем найдено {found:.0f}'
+            )
+
+            if not options['no_postgis']:
+                self.compare_with_postgis(ids, lons, lats, probes, radius, results)
+
+    def compare_with_postgis(self, ids, lons, lats, probes, radius, results):
+        """Загружает те же точки во временную таблицу и сверяет время и состав результатов с PostGIS."""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS bench_points')
+            cursor.execute('CREATE TEMP TABLE bench_points (id bigint, location geography(Point, 4326))')
+            cursor.execute(
+                'INSERT INTO bench_points '
+                'SELECT i, ST_SetSRID(ST_MakePoint(x, y), 4326)::geography '
+                'FROM unnest(%s::bigint[], %s::float8[], %s::float8[]) AS t(i, x, y)',
+                [ids.tolist(), lons.tolist(), lats.tolist()],
+            )
+            cursor.execute('CREATE INDEX ON bench_points USING gist (location)')
+            cursor.execute('ANALYZE bench_points')
+
+            elapsed = 0.0
+            mismatched = 0
+            for i, (memory_ids, _) in zip(probes, results):
+                started = time.perf_counter()
+                cursor.execute(
+                    'SELECT id, ST_Distance(location, p) FROM bench_points, '
+                    'ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography AS p '
+                    'WHERE ST_DWithin(location, p, %s)',
+                    [float(lons[i]), float(lats[i]), radius * 1000],
+                )
+                postgis_ids = {row[0] for row in cursor.fetchall()}
+                elapsed += time.perf_counter() - started
+                # Сфера и сфероид расходятся на доли процента, поэтому расхождения возможны только у границы
+                mismatched += len(postgis_ids.symmetric_difference(memory_ids.tolist()))
+
+            cursor.execute('DROP TABLE bench_points')
+
+        self.stdout.write(
+            f'    PostGIS {elapsed * 1000 / len(probes):.3f} мс на запрос, '
+            f'расхождений у границы радиуса: {mismatched}'
+        )
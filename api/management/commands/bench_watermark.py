@@ -0,0 +1,83 @@
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from api.utils import WatermarkCompositor
+
+RESOLUTIONS = [(720, 1280), (1080, 1920), (1200, 1600), (3024, 4032)]
+
+
+def legacy_apply(image, watermark_path):
+    """Прежняя реализация: водяной знак читается с диска и масштабируется при каждом вызове."""
+    watermark = Image.open(watermark_path).convert('RGBA')
+    base_image = Image.open(image).convert('RGBA')
+    base_width, base_height = base_image.size
+    watermark_width, watermark_height = base_width // 4, base_height // 4
+    watermark = watermark.resize((watermark_width, watermark_height), Image.LANCZOS)
+    base_image.paste(watermark, (base_width - watermark_width, base_height - watermark_height), watermark)
+    output = BytesIO()
+    base_image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def synthetic_corpus(count):
+    """Набор JPEG-снимков типовых разрешений с шумом, чтобы сжатие было похоже на фото."""
+    corpus = []
+    for i in range(count):
+        width, height = RESOLUTIONS[i % len(RESOLUTIONS)]
+        image = Image.effect_noise((width // 8, height // 8), 60 + i % 40).convert('RGB').resize((width, height))
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        corpus.append(buffer.getvalue())
+    return corpus
+
+
+def run_variant(name, corpus, watermark_path, options, queue):
+    """Выполняется в отдельном процессе, чтобы пиковая память каждого варианта мерилась отдельно."""
+    compositor = WatermarkCompositor(watermark_path)
+    started = time.perf_counter()
+    output_bytes = 0
+    for data in corpus:
+        if name == 'legacy':
+            result = legacy_apply(BytesIO(data), watermark_path)
+        else:
+            result = compositor.apply(BytesIO(data), output_format=name, max_size=options['max_size'],
+                                      quality=options['quality'])
+        output_bytes += len(result)
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((len(corpus) / elapsed, output_bytes / len(corpus), peak_kb))
+
+
+class Command(BaseCommand):
+    """Сравнивает прежнее наложение водяного знака с WatermarkCompositor на синтетических изображениях."""
+
+    help = 'Бенчмарк наложения водяного знака: пропускная способность, размер результата и пиковая память.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=40)
+        parser.add_argument('--watermark', default='media/watermark/watermark.png')
+        parser.add_argument('--formats', nargs='+', default=['PNG', 'JPEG', 'WEBP'])
+        parser.add_argument('--max-size', type=int, default=1280)
+        parser.add_argument('--quality', type=int, default=85)
+
+    def handle(self, *args, **options):
+        corpus = synthetic_corpus(options['images'])
+        context = multiprocessing.get_context('fork')
+
+        for name in ['legacy', *options['formats']]:
+            queue = context.Queue()
+            process = context.Process(target=run_variant, args=(name, corpus, options['watermark'], options, queue))
+            process.start()
+            process.join()
+            if process.exitcode:
+                raise CommandError(f'Вариант {name} завершился с ошибкой')
+            per_second, average_bytes, peak_kb = queue.get()
+            self.stdout.write(
+                f'{name:>6}: {per_second:.1f} изобр./с, в среднем {average_bytes / 1024:.0f} КБ на результат, '
+                f'пиковая память процесса {peak_kb / 1024:.0f} МБ'
+            )
@@ -0,0 +1,136 @@
+import time
+from io import BytesIO
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import Point
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+
+from api import list_cache
+from api.models import Match, User
+from api.signals import locations_saved
+from api.utils import save_avatar_thumbnails
+
+# Центры городов (долгота, широта), вокруг которых группируются пользователи
+CITIES = [
+    (37.62, 55.75), (30.31, 59.94), (82.92, 55.03), (60.60, 56.84), (49.11, 55.79),
+    (44.00, 56.33), (61.40, 55.16), (39.72, 47.23), (50.10, 53.20), (73.37, 54.99),
+]
+EARTH_KM_PER_DEGREE = 111.32
+
+
+class Command(BaseCommand):
+    """Генерирует синтетическую популяцию пользователей и лайков для нагрузочных тестов."""
+
+    help = ('Создает N пользователей со сгруппированными вокруг городов координатами, полом и аватарами '
+            'и M лайков с заданной долей взаимных.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--reciprocity', type=float, default=0.2, help='доля лайков, на которые есть ответный')
+        parser.add_argument('--cluster-km', type=float, default=8.0, help='разброс координат вокруг центра, км')
+        parser.add_argument('--avatars', type=int, default=20, help='число сгенерированных аватаров в наборе')
+        parser.add_argument('--avatar-share', type=float, default=0.3, help='доля пользователей с аватаром')
+        parser.add_argument('--prefix', default='bench', help='префикс email создаваемых пользователей')
+        parser.add_argument('--password', default='Password.1')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        started = time.perf_counter()
+
+        user_ids = self.create_users(rng, options)
+        self.stdout.write(f'Пользователей создано: {len(user_ids)} за {time.perf_counter() - started:.1f} с')
+
+        started = time.perf_counter()
+        likes = self.create_likes(rng, user_ids, options)
+        self.stdout.write(f'Лайков создано: {likes} за {time.perf_counter() - started:.1f} с')
+
+        # bulk_create не отправляет сигналы моделей: местоположения передаются сигналом locations_saved после
+        # каждой пачки (индекс в памяти, тайлы), а закэшированные списки сбрасываем явно
+        list_cache.clear()
+
+    def create_avatars(self, rng, count, prefix):
+        """Сохраняет небольшой набор синтетических аватаров, которые переиспользуются пользователями.
+
+        Для них сразу готовятся уменьшенные копии, на которые ссылаются списки с avatar_size."""
+        names = []
+        storage = User._meta.get_field('avatar').storage
+        for i in range(count):
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            image = Image.new('RGB', (256, 256), color)
+            buffer = BytesIO()
+            image.save(buffer, format='PNG')
+            name = storage.save(f'avatars/{prefix}/avatar_{i}.png', ContentFile(buffer.getvalue()))
+            save_avatar_thumbnails(storage, name, buffer.getvalue())
+            names.append(name)
+        return names
+
+    def create_users(self, rng, options):
+        count, prefix = options['users'], options['prefix']
+        password = make_password(options['password'])  # хэшируем один раз - PBKDF2 на каждого слишком дорог
+        avatars = self.create_avatars(rng, options['avatars'], prefix) if options['avatars'] else []
+
+        cities = rng.integers(0, len(CITIES), count)
+        centers = np.array(CITIES)[cities]
+        offsets_km = rng.normal(0, options['cluster_km'], (count, 2))
+        lats = centers[:, 1] + offsets_km[:, 1] / EARTH_KM_PER_DEGREE
+        lons = centers[:, 0] + offsets_km[:, 0] / (EARTH_KM_PER_DEGREE * np.cos(np.radians(lats)))
+        genders = rng.choice(['M', 'W'], count)
+        with_avatar = rng.random(count) < options['avatar_share']
+        avatar_choice = rng.integers(0, max(len(avatars), 1), count)
+
+        start = User.objects.filter(email__startswith=f'{prefix}').count()
+        ids = []
+        for offset in range(0, count, options['batch_size']):
+            batch = []
+            for i in range(offset, min(offset + options['batch_size'], count)):
+                number = start + i
+                batch.append(User(
+                    email=f'{prefix}{number}@example.com',
+                    password=password,
+                    first_name=f'User{number}',
+                    last_name=f'Name{number}',
+                    gender=genders[i],
+                    avatar=avatars[avatar_choice[i]] if avatars and with_avatar[i] else 'default/default_avatar.png',
+                    location=Point(float(lons[i]), float(lats[i]), srid=4326),
+                ))
+            with transaction.atomic():
+                created = User.objects.bulk_create(batch)
+            ids.extend(user.pk for user in created)
+            locations_saved.send(sender=User, moves=[(user.pk, None, user.location) for user in created])
+        return np.array(ids, dtype=np.int64)
+
+    def create_likes(self, rng, user_ids, options):
+        if len(user_ids) < 2 or not options['likes']:
+            return 0
+
+        # Каждый лайк с вероятностью reciprocity получает ответный, так что всего строк ~= likes
+        count = options['likes']
+        primary = int(count / (1 + options['reciprocity']))
+        from_ids = rng.choice(user_ids, primary)
+        to_ids = rng.choice(user_ids, primary)
+        keep = from_ids != to_ids
+        from_ids, to_ids = from_ids[keep], to_ids[keep]
+        pairs = {(int(a), int(b)) for a, b in zip(from_ids, to_ids)}
+
+        reciprocal = rng.random(len(from_ids)) < options['reciprocity']
+        pairs.update((int(b), int(a)) for a, b in zip(from_ids[reciprocal], to_ids[reciprocal]))
+
+        # ignore_conflicts не сообщает, сколько строк вставлено: считаем по таблице до и после
+        existing = Match.objects.count()
+        pairs = list(pairs)
+        pair_set = set(pairs)
+        for offset in range(0, len(pairs), options['batch_size']):
+            batch = [
+                Match(from_user_id=a, to_user_id=b, matched=(b, a) in pair_set)
+                for a, b in pairs[offset:offset + options['batch_size']]
+            ]
+            with transaction.atomic():
+                Match.objects.bulk_create(batch, ignore_conflicts=True)
+        return Match.objects.count() - existing
@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from SocialMedia.utils import write_schema
+
+
+class Command(BaseCommand):
+    """Собирает схему OpenAPI в файл, который отдает /swagger.json."""
+
+    help = ('Строит схему OpenAPI интроспекцией всех view и сохраняет ее в OPENAPI_SCHEMA_PATH. Выполняется при '
+            'запуске (cmds.sh); работающие процессы подхватывают новую схему после перезапуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help=f'файл схемы (по умолчанию {settings.OPENAPI_SCHEMA_PATH})')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        size = write_schema(options['output'])
+        self.stdout.write(f'схема {settings.API_VERSION} собрана за {time.perf_counter() - started:.2f} с '
+                          f'({size} байт): {options["output"] or settings.OPENAPI_SCHEMA_PATH}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api import list_cache
+
+
+class Command(BaseCommand):
+    """Выводит счетчики попаданий и промахов кэша списка пользователей."""
+
+    help = 'Статистика кэша списка пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        stats = list_cache.stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(f'попаданий: {stats["hits"]}, промахов: {stats["misses"]}, доля попаданий: {ratio:.1%}')
+        if options['reset']:
+            list_cache.reset_stats()
@@ -0,0 +1,118 @@
+import json
+import random
+import time
+import uuid
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.models import User
+
+SCENARIOS = ('create', 'list', 'list_radius', 'match')
+
+
+class Command(BaseCommand):
+    """Прогоняет сценарии API внутри процесса и считает задержки, запросы к базе и пропускную способность."""
+
+    help = ('Нагрузочные сценарии clients/create, /list без радиуса и с радиусом и clients/<id>/match. '
+            'Данные удобно подготовить командой generate_population.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий')
+        parser.add_argument('--clients', type=int, default=20, help='число авторизованных пользователей')
+        parser.add_argument('--radius', type=float, default=5.0, help='радиус для list_radius, км')
+        parser.add_argument('--prefix', default='bench', help='префикс email пользователей generate_population')
+        parser.add_argument('--warmup', type=int, default=5, help='запросов прогрева на сценарий')
+        parser.add_argument('--json', dest='json_path', help='сохранить результаты в JSON-файл')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.users = list(
+            User.objects.filter(email__startswith=options['prefix'], location__isnull=False)
+            .order_by('?').values_list('id', 'location')[:max(options['clients'] * 10, 100)]
+        )
+        if len(self.users) < 2:
+            raise CommandError('Недостаточно пользователей: сначала выполните generate_population')
+
+        self.clients = []
+        for user_id, location in self.users[:options['clients']]:
+            client = Client()
+            client.force_login(User.objects.get(pk=user_id))
+            self.clients.append((user_id, location, client))
+
+        results = {}
+        header = f'{"сценарий":<12} {"запросов":>8} {"ошибок":>7} {"p50, мс":>8} {"p95, мс":>8} {"p99, мс":>8} ' \
+                 f'{"SQL/запр":>9} {"запр/с":>8}'
+        self.stdout.write(header)
+        for scenario in options['scenarios']:
+            request = getattr(self, f'request_{scenario}')
+            for _ in range(options['warmup']):
+                request()
+            results[scenario] = self.run(request, options['requests'])
+            row = results[scenario]
+            self.stdout.write(
+                f'{scenario:<12} {row["requests"]:>8} {row["errors"]:>7} {row["p50_ms"]:>8.1f} {row["p95_ms"]:>8.1f} '
+                f'{row["p99_ms"]:>8.1f} {row["queries_per_request"]:>9.1f} {row["throughput"]:>8.1f}'
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def run(self, request, count):
+        latencies, queries, errors = [], [], 0
+        started = time.perf_counter()
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = request()
+                latencies.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured))
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = time.perf_counter() - started
+
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            'requests': count,
+            'errors': errors,
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'queries_per_request': float(np.mean(queries)),
+            'throughput': count / elapsed,
+        }
+
+    def request_create(self):
+        data = {
+            'email': f'{self.options["prefix"]}-load-{uuid.uuid4().hex}@example.com',
+            'first_name': 'Load',
+            'last_name': 'Test',
+            'gender': self.rng.choice('MW'),
+            'password': 'Load.Password.1',
+            'password2': 'Load.Password.1',
+        }
+        return Client().post('/clients/create/', data)
+
+    def request_list(self):
+        _, _, client = self.rng.choice(self.clients)
+        return client.get('/list/')
+
+    def request_list_radius(self):
+        _, location, client = self.rng.choice(self.clients)
+        return client.get('/list/', {
+            'latitude': location.y + self.rng.uniform(-0.01, 0.01),
+            'longitude': location.x + self.rng.uniform(-0.01, 0.01),
+            'radius': self.options['radius'],
+        })
+
+    def request_match(self):
+        user_id, _, client = self.rng.choice(self.clients)
+        to_user_id, _ = self.rng.choice(self.users)
+        return client.post(f'/clients/{user_id}/match/', {'to_user': to_user_id})
@@ -0,0 +1,38 @@
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from api.models import User
+from api.utils import save_avatar_thumbnails
+
+
+class Command(BaseCommand):
+    """Переносит готовые аватары в хранилище по хэшу содержимого и готовит недостающие уменьшенные копии."""
+
+    help = ('Переименовывает аватары, сохраненные до перехода на хранилище по хэшу, и создает уменьшенные '
+            'копии размеров AVATAR_THUMBNAIL_SIZES (например, после изменения настройки). Старые файлы не удаляются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite-thumbnails', action='store_true',
+                            help='пересоздать и существующие уменьшенные копии (например, записанные в формате, '
+                                 'не совпадающем с расширением файла)')
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(avatar_status=User.AVATAR_READY, avatar__startswith='avatars/').only('id', 'avatar')
+        moved = thumbnails = 0
+        for user in users.iterator(chunk_size=500):
+            storage = user.avatar.storage
+            with user.avatar.open('rb') as avatar:
+                content = avatar.read()
+
+            renamed = not storage.is_hashed(user.avatar.name)
+            if renamed:
+                # Имя без каталога: upload_to поля снова добавит avatars/
+                user.avatar.save(user.avatar.name.rsplit('/', 1)[-1], ContentFile(content), save=False)
+                moved += 1
+            save_avatar_thumbnails(storage, user.avatar.name, content, overwrite=options['overwrite_thumbnails'])
+            thumbnails += 1
+            if renamed:
+                # Через save, чтобы сбросились кэш списка и кэш аутентификации
+                user.save(update_fields=['avatar'])
+
+        self.stdout.write(f'перенесено аватаров: {moved}, проверено уменьшенных копий: {thumbnails}')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from api import feed
+from api.models import User
+from api.tasks import rebuild_all_feeds
+
+
+class Command(BaseCommand):
+    """Пересчитывает ленты кандидатов всех пользователей."""
+
+    help = 'Пересчет лент кандидатов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='пользователей в одной задаче')
+        parser.add_argument('--sync', action='store_true', help='пересчитать в текущем процессе, без Celery')
+
+    def handle(self, *args, **options):
+        if not options['sync']:
+            result = rebuild_all_feeds.delay(options['batch_size'])
+            if result is None:
+                self.stdout.write('пересчет лент с такими параметрами уже ждет в очереди')
+            else:
+                self.stdout.write(f'пересчет лент поставлен в очередь: {result.id}')
+            return
+
+        user_ids = User.objects.filter(location__isnull=False).order_by('id').values_list('id', flat=True)
+        users = members = 0
+        for user_id in user_ids.iterator(chunk_size=2000):
+            members += feed.rebuild(user_id)
+            users += 1
+        self.stdout.write(f'лент пересчитано: {users}, кандидатов в них: {members}')
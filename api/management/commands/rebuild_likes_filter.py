@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.likes import like_filter
+from api.models import Match
+
+
+class Command(BaseCommand):
+    """Собирает фильтр Блума по лайкам из таблицы Match."""
+
+    help = ('Пересобирает фильтр Блума лайков в Redis по всем записям Match. Выполнить после развертывания, '
+            'изменения LIKES_BLOOM_CAPACITY/LIKES_BLOOM_ERROR_RATE или очистки Redis: до этого фильтр не используется.')
+
+    def handle(self, *args, **options):
+        edges = Match.objects.values_list('from_user_id', 'to_user_id').iterator(chunk_size=100_000)
+        size = like_filter.rebuild(edges)
+        self.stdout.write(f'фильтр собран: {like_filter.bits} бит, {like_filter.hashes} хэш-функций, '
+                          f'{size / 2 ** 20:.1f} МБ')
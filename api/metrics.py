@@ -0,0 +1,239 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from . import list_cache, queues
+
+logger = logging.getLogger('api.slow_requests')
+
+REQUEST_SECONDS = Histogram(
+    'api_request_seconds', 'Полное время обработки запроса', ['view', 'method', 'status'],
+)
+REQUEST_SQL_SECONDS = Histogram(
+    'api_request_sql_seconds', 'Суммарное время SQL-запросов за запрос', ['view'],
+)
+REQUEST_SQL_QUERIES = Histogram(
+    'api_request_sql_queries', 'Число SQL-запросов за запрос', ['view'],
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55, 89, float('inf')),
+)
+STAGE_SECONDS = Histogram(
+    'api_stage_seconds', 'Время отдельных этапов горячих путей (сериализация, хэширование пароля, изображения)',
+    ['stage'],
+)
+TASK_SECONDS = Histogram(
+    'api_task_seconds', 'Время выполнения задач Celery', ['task', 'state'],
+)
+TASK_QUEUE_SECONDS = Histogram(
+    'api_task_queue_seconds', 'Время ожидания задач Celery в очереди от постановки до начала выполнения', ['queue'],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float('inf')),
+)
+TASK_DUPLICATES = Counter(
+    'api_task_duplicates', 'Постановки задач Celery, отброшенные по ключу идемпотентности', ['task'],
+)
+
+
+class QueryCollector:
+    """Обертка выполнения SQL (connection.execute_wrapper), считающая запросы и их время."""
+
+    def __init__(self, keep_sql=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.keep_sql = keep_sql
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.seconds += duration
+            if self.keep_sql:
+                self.statements.append((duration, sql))
+
+
+# Сборщик SQL текущего запроса; передается и в потоки, где асинхронные view выполняют запросы к базе
+current_collector = ContextVar('current_collector', default=None)
+
+
+def _collect_queries(execute, sql, params, many, context):
+    collector = current_collector.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    return collector(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def _install_query_collector(sender, connection, **kwargs):
+    """Подключает учет SQL к каждому соединению, в том числе к соединениям потоков асинхронных view."""
+    if _collect_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_collect_queries)
+
+
+class MetricsMiddleware:
+    """Записывает по каждому view полное время запроса, число и время SQL-запросов.
+
+    Работает и в синхронном, и в асинхронном стеке. Запросы дольше SLOW_REQUEST_MS миллисекунд
+    пишутся в лог api.slow_requests вместе с SQL."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        collector = QueryCollector(keep_sql=settings.SLOW_REQUEST_MS is not None)
+        token = current_collector.set(collector)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        self.record(request, response, collector, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        collector = QueryCollector(keep_sql=settings.SLOW_REQUEST_MS is not None)
+        token = current_collector.set(collector)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_collector.reset(token)
+        self.record(request, response, collector, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def record(request, response, collector, total):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        REQUEST_SECONDS.labels(view, request.method, response.status_code).observe(total)
+        REQUEST_SQL_SECONDS.labels(view).observe(collector.seconds)
+        REQUEST_SQL_QUERIES.labels(view).observe(collector.count)
+
+        if settings.SLOW_REQUEST_MS is not None and total * 1000 >= settings.SLOW_REQUEST_MS:
+            statements = '\n'.join(f'  {duration * 1000:.1f} мс: {sql}' for duration, sql in collector.statements)
+            logger.warning(
+                'Медленный запрос %s %s: %.1f мс, SQL: %d запросов за %.1f мс\n%s',
+                request.method, request.get_full_path(), total * 1000,
+                collector.count, collector.seconds * 1000, statements,
+            )
+
+
+def stage_timer(stage):
+    """Контекстный менеджер, записывающий длительность этапа в api_stage_seconds."""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+@before_task_publish.connect
+def _task_published(headers=None, **kwargs):
+    if headers is not None:
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task_id, task, **kwargs):
+    task.request._metrics_started = time.perf_counter()
+    # Заголовки сообщения доступны как атрибуты request; у задач, выполненных без брокера, их нет
+    published = getattr(task.request, 'published_at', None)
+    if published is not None:
+        queue = (task.request.delivery_info or {}).get('routing_key') or queues.DEFAULT
+        TASK_QUEUE_SECONDS.labels(queue).observe(max(time.time() - published, 0))
+
+
+@task_postrun.connect
+def _task_finished(task_id, task, state=None, **kwargs):
+    started = getattr(task.request, '_metrics_started', None)
+    if started is not None:
+        TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started)
+
+
+class ListCacheCollector:
+    """Отдает счетчики попаданий и промахов кэша списка, которые хранятся в общем кэше."""
+
+    def describe(self):
+        # Описание без значений, чтобы регистрация не обращалась к кэшу
+        yield self._family()
+
+    def collect(self):
+        stats = list_cache.stats()
+        family = self._family()
+        family.add_metric(['hit'], stats['hits'])
+        family.add_metric(['miss'], stats['misses'])
+        yield family
+
+    @staticmethod
+    def _family():
+        return CounterMetricFamily('api_list_cache', 'Обращения к кэшу списка пользователей', labels=['result'])
+
+
+list_cache_collector = ListCacheCollector()
+REGISTRY.register(list_cache_collector)
+
+
+class QueueDepthCollector:
+    """Отдает число задач, ожидающих в каждой очереди Celery, читая длину очередей брокера при сборе метрик."""
+
+    def describe(self):
+        yield self._family()
+
+    def collect(self):
+        family = self._family()
+        for queue, depth in queues.queue_depths().items():
+            family.add_metric([queue], depth)
+        yield family
+
+    @staticmethod
+    def _family():
+        return GaugeMetricFamily('api_celery_queue_depth', 'Задачи, ожидающие в очереди Celery', labels=['queue'])
+
+
+queue_depth_collector = QueueDepthCollector()
+REGISTRY.register(queue_depth_collector)
+
+
+def metrics_allowed(request):
+    """Метрики видны адресам из METRICS_ALLOWED_IPS (адреса и подсети) и администраторам."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated and user.is_admin:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    """Отдает метрики в текстовом формате Prometheus.
+
+    Если задана переменная PROMETHEUS_MULTIPROC_DIR, метрики собираются со всех процессов
+    (воркеров веб-сервера и Celery), пишущих в этот каталог."""
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(list_cache_collector)
+        registry.register(queue_depth_collector)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_user_avatar_processing'),
+    ]
+
+    operations = [
+        # Удаляем повторные лайки, оставляя самый ранний, и проставляем флаг взаимности
+        migrations.RunSQL(
+            sql=[
+                'DELETE FROM api_match a USING api_match b '
+                'WHERE a.from_user_id = b.from_user_id AND a.to_user_id = b.to_user_id AND a.id > b.id',
+                'UPDATE api_match m SET matched = EXISTS ('
+                'SELECT 1 FROM api_match r WHERE r.from_user_id = m.to_user_id AND r.to_user_id = m.from_user_id)',
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='match',
+            constraint=models.UniqueConstraint(fields=('from_user', 'to_user'), name='unique_match_from_user_to_user'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['to_user', 'from_user'], name='match_to_user_from_user_idx'),
+        ),
+    ]
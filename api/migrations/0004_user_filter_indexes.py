@@ -0,0 +1,44 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import (BtreeGistExtension,
+                                                TrigramExtension)
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_match_unique_pair'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        BtreeGistExtension(),
+        # Выражения совпадают с тем, что Django строит для iexact и istartswith: UPPER(col::text);
+        # text_pattern_ops позволяет использовать индекс и для LIKE 'префикс%'
+        migrations.RunSQL(
+            sql=[
+                'CREATE INDEX user_first_name_upper_idx ON api_user ((UPPER(first_name::text)) text_pattern_ops)',
+                'CREATE INDEX user_last_name_upper_idx ON api_user ((UPPER(last_name::text)) text_pattern_ops)',
+            ],
+            reverse_sql=[
+                'DROP INDEX user_first_name_upper_idx',
+                'DROP INDEX user_last_name_upper_idx',
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['first_name'], name='user_first_name_trgm_idx', opclasses=['gin_trgm_ops'],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['last_name'], name='user_last_name_trgm_idx', opclasses=['gin_trgm_ops'],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['location', 'gender'], name='user_location_gender_gist'),
+        ),
+    ]
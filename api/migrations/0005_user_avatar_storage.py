@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+import api.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_user_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(default='default/default_avatar.png', storage=api.storage.ContentAddressedStorage(), upload_to='avatars/'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar_original',
+            field=models.ImageField(blank=True, storage=api.storage.ContentAddressedStorage(), upload_to='avatars/original/'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_user_avatar_storage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(condition=models.Q(matched=True), fields=['from_user', '-id'], name='match_pairs_idx'),
+        ),
+    ]
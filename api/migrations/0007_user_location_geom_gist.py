@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_match_pairs_idx'),
+    ]
+
+    operations = [
+        # Выражение совпадает с запросом тайлов плотности (api.density.GRID_SQL): location::geometry && прямоугольник
+        migrations.RunSQL(
+            sql='CREATE INDEX user_location_geom_gist ON api_user USING gist ((location::geometry))',
+            reverse_sql='DROP INDEX user_location_geom_gist',
+        ),
+    ]
@@ -1,6 +1,12 @@
+from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser, BaseUserManager
 from django.contrib.gis.db import models as gismodels
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.db import connections, models, router, transaction
+from django.db.models.expressions import RawSQL
+
+from .likes import like_filter
+from .storage import avatar_storage
 
 
 class UserManager(BaseUserManager):
@@ -30,11 +36,26 @@ class User(AbstractBaseUser):
         ('W', 'Women'),
     )
 
+    AVATAR_PENDING = 'pending'
+    AVATAR_PROCESSING = 'processing'
+    AVATAR_READY = 'ready'
+    AVATAR_FAILED = 'failed'
+    CHOICE_AVATAR_STATUS = (
+        (AVATAR_PENDING, 'Pending'),
+        (AVATAR_PROCESSING, 'Processing'),
+        (AVATAR_READY, 'Ready'),
+        (AVATAR_FAILED, 'Failed'),
+    )
+
     email = models.EmailField(verbose_name='email address', max_length=255, unique=True,)
     first_name = models.CharField(max_length=30)
     last_name = models.CharField(max_length=30)
     gender = models.CharField(max_length=1, choices=CHOICE_GENDER)
-    avatar = models.ImageField(upload_to='avatars/', default='default/default_avatar.png')
+    # Файлы аватаров называются по хэшу содержимого (см. api.storage), одинаковые загрузки хранятся один раз
+    avatar = models.ImageField(upload_to='avatars/', default='default/default_avatar.png', storage=avatar_storage)
+    # Исходный загруженный файл, из которого фоновая задача делает аватар с водяным знаком
+    avatar_original = models.ImageField(upload_to='avatars/original/', blank=True, storage=avatar_storage)
+    avatar_status = models.CharField(max_length=10, choices=CHOICE_AVATAR_STATUS, default=AVATAR_READY)
     location = gismodels.PointField(null=True, blank=True, geography=True)
 
     is_active = models.BooleanField(default=True)
@@ -51,9 +72,173 @@ class User(AbstractBaseUser):
         """Возвращает строковое представление пользователя (его email)."""
         return self.email
 
+    class Meta:
+        # Функциональные индексы UPPER(first_name) и UPPER(last_name) для поиска без учета регистра
+        # созданы в миграции 0004 через SQL: класс операторов для выражений Django 3.2 не задает;
+        # так же в миграции 0007 создан индекс GiST по location::geometry для запросов тайлов плотности
+        indexes = [
+            GinIndex(fields=['first_name'], name='user_first_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['last_name'], name='user_last_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            # Поиск по радиусу вместе с полом (требует расширения btree_gist)
+            GistIndex(fields=['location', 'gender'], name='user_location_gender_gist'),
+        ]
+
+
+def knn_distance(point):
+    """Выражение сортировки по оператору PostGIS <-> (расстояние до точки), которое обслуживается GiST-индексом."""
+    return RawSQL(f'"{User._meta.db_table}"."location" <-> ST_GeogFromText(%s)', (point.ewkt,))
+
+
+class MatchManager(models.Manager):
+    """Создает лайки, проверяя дубликаты и взаимность на стороне базы."""
+
+    LIKE_SQL = """
+        WITH targets AS (
+            SELECT u.id, u.email, u.first_name
+            FROM {user} u
+            WHERE u.id = ANY(%(to_ids)s) AND u.id <> %(from_id)s
+        ), ins AS (
+            INSERT INTO {match} (from_user_id, to_user_id, matched)
+            SELECT %(from_id)s, t.id, EXISTS (
+                SELECT 1 FROM {match} r WHERE r.from_user_id = t.id AND r.to_user_id = %(from_id)s
+            )
+            FROM targets t
+            ORDER BY t.id
+            ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+            RETURNING id, to_user_id, matched
+        ), reciprocal AS (
+            UPDATE {match} m SET matched = TRUE
+            FROM ins
+            WHERE ins.matched AND m.from_user_id = ins.to_user_id AND m.to_user_id = %(from_id)s
+        )
+        SELECT t.id, ins.id, ins.matched, t.email, t.first_name
+        FROM targets t LEFT JOIN ins ON ins.to_user_id = t.id
+    """
+
+    # Встречные лайки, вставленные одновременно, не видят друг друга; после фиксации каждая сторона
+    # проверяет свои новые лайки еще раз, и пару отмечает та, что увидит встречный лайк первой.
+    # Перед сверкой записи обоих направлений блокируются в порядке id: встречные сверки берут одни и те же
+    # записи в одном порядке и ждут друг друга, а не взаимоблокируются
+    LOCK_PAIRS_SQL = """
+        SELECT id FROM {match}
+        WHERE (from_user_id = %(from_id)s AND to_user_id = ANY(%(to_ids)s))
+            OR (to_user_id = %(from_id)s AND from_user_id = ANY(%(to_ids)s))
+        ORDER BY id
+        FOR UPDATE
+    """
+    RECONCILE_SQL = """
+        WITH pairs AS (
+            UPDATE {match} m SET matched = TRUE
+            WHERE m.from_user_id = %(from_id)s AND m.to_user_id = ANY(%(to_ids)s) AND NOT m.matched
+                AND EXISTS (SELECT 1 FROM {match} r WHERE r.from_user_id = m.to_user_id AND r.to_user_id = %(from_id)s)
+            RETURNING m.to_user_id
+        ), reciprocal AS (
+            UPDATE {match} r SET matched = TRUE
+            FROM pairs
+            WHERE r.from_user_id = pairs.to_user_id AND r.to_user_id = %(from_id)s AND NOT r.matched
+        )
+        SELECT to_user_id FROM pairs
+    """
+
+    def like_many(self, from_user, to_user_ids):
+        """Сохраняет лайки from_user для набора пользователей одним запросом.
+
+        Вставка, отказ при повторном лайке и проверка обратных лайков выполняются в одном
+        выражении для всех пользователей сразу; при образовании пары флаг matched выставляется
+        у обеих записей. Встречные лайки, вставленные одновременно, сверяются повторно после
+        фиксации (RECONCILE_SQL) под блокировкой записей обоих направлений, взятой в порядке id
+        (LOCK_PAIRS_SQL): встречные сверки выполняются по очереди, и пару отмечает ровно один из двух запросов.
+        Поэтому метод вызывается вне внешней транзакции (ATOMIC_REQUESTS выключен).
+        Возвращает список (to_user_id, статус, Match) в порядке переданных id без повторов;
+        Match есть только у новых лайков, его to_user заполнен только email и first_name.
+        """
+        to_user_ids = list(dict.fromkeys(to_user_ids))
+        duplicates = self.known_duplicates(from_user.pk, [pk for pk in to_user_ids if pk != from_user.pk])
+        pending = [pk for pk in to_user_ids if pk not in duplicates]
+
+        rows = {}
+        if pending:
+            tables = {'match': self.model._meta.db_table, 'user': User._meta.db_table}
+            using = self._db or router.db_for_write(self.model)
+            with transaction.atomic(using=using), connections[using].cursor() as cursor:
+                cursor.execute(self.LIKE_SQL.format(**tables), {'from_id': from_user.pk, 'to_ids': pending})
+                rows = {row[0]: row[1:] for row in cursor.fetchall()}
+            unmatched = [pk for pk, row in rows.items() if row[0] is not None and not row[1]]
+            if unmatched:
+                params = {'from_id': from_user.pk, 'to_ids': unmatched}
+                with transaction.atomic(using=using), connections[using].cursor() as cursor:
+                    cursor.execute(self.LOCK_PAIRS_SQL.format(**tables), params)
+                    cursor.execute(self.RECONCILE_SQL.format(**tables), params)
+                    for (to_user_id,) in cursor.fetchall():
+                        rows[to_user_id] = (rows[to_user_id][0], True, *rows[to_user_id][2:])
+            if settings.LIKES_BLOOM_ENABLED:
+                like_filter.add(from_user.pk, [pk for pk, row in rows.items() if row[0] is not None])
+
+        results = []
+        for to_user_id in to_user_ids:
+            if to_user_id == from_user.pk:
+                results.append((to_user_id, self.model.LIKE_SELF, None))
+            elif to_user_id in duplicates:
+                results.append((to_user_id, self.model.LIKE_DUPLICATE, None))
+            elif to_user_id not in rows:
+                results.append((to_user_id, self.model.LIKE_NOT_FOUND, None))
+            elif rows[to_user_id][0] is None:
+                results.append((to_user_id, self.model.LIKE_DUPLICATE, None))
+            else:
+                match_id, matched, email, first_name = rows[to_user_id]
+                to_user = User(pk=to_user_id, email=email, first_name=first_name)
+                match = self.model(pk=match_id, from_user=from_user, to_user=to_user, matched=matched)
+                results.append((to_user_id, self.model.LIKE_MATCHED if matched else self.model.LIKE_CREATED, match))
+        return results
+
+    def known_duplicates(self, from_id, to_user_ids):
+        """Возвращает id, которые from_id уже лайкал, обращаясь к базе только при срабатывании фильтра Блума.
+
+        Точно новые лайки (ответ фильтра "нет") сразу идут на вставку, подтвержденные повторы
+        отсекаются без вставки. Повторы и так отсекает ON CONFLICT в запросе вставки, поэтому фильтр
+        экономит только запрос для повторных лайков, а каждому лайку добавляет обращение к Redis: он
+        включается LIKES_BLOOM_ENABLED. Пока фильтр выключен или не собран, возвращает пустое множество."""
+        if not settings.LIKES_BLOOM_ENABLED:
+            return set()
+        candidates = like_filter.might_contain(from_id, to_user_ids)
+        if not candidates:
+            return set()
+        return set(self.filter(from_user_id=from_id, to_user_id__in=candidates).values_list('to_user_id', flat=True))
+
+    def like(self, from_user, to_user_id):
+        """Сохраняет один лайк from_user -> to_user_id.
+
+        Возвращает созданный Match или None, если лайк уже был; если пользователя
+        to_user_id нет, выбрасывает User.DoesNotExist.
+        """
+        [(_, like_status, match)] = self.like_many(from_user, [to_user_id])
+        if like_status == self.model.LIKE_NOT_FOUND:
+            raise User.DoesNotExist
+        return match
+
 
 class Match(models.Model):
     """Модель, хранящая matches."""
     from_user = models.ForeignKey(User, related_name='matches_from', on_delete=models.CASCADE)
     to_user = models.ForeignKey(User, related_name='matches_to', on_delete=models.CASCADE)
     matched = models.BooleanField(default=False)
+
+    # Результаты создания лайка
+    LIKE_CREATED = 'created'
+    LIKE_MATCHED = 'matched'
+    LIKE_DUPLICATE = 'duplicate'
+    LIKE_NOT_FOUND = 'not_found'
+    LIKE_SELF = 'self'
+
+    objects = MatchManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['from_user', 'to_user'], name='unique_match_from_user_to_user'),
+        ]
+        # Индекс для проверки встречного лайка (to_user -> from_user)
+        indexes = [
+            models.Index(fields=['to_user', 'from_user'], name='match_to_user_from_user_idx'),
+            # Список пар пользователя (GET /pairs/): только взаимные лайки, новые первыми
+            models.Index(fields=['from_user', '-id'], name='match_pairs_idx', condition=models.Q(matched=True)),
+        ]
@@ -0,0 +1,223 @@
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from .utils import get_async_redis, get_redis
+
+QUEUE_KEY = 'notifications:match'
+# Пачка, которую разбирает dispatch_pending: снимается после отправки
+PROCESSING_KEY = 'notifications:match:processing'
+DISPATCH_LOCK_KEY = 'notifications:dispatch'
+DISPATCH_LOCK_TIMEOUT = 600
+RATE_KEY = 'notifications:rate:{}'
+# Отметка об отправленном письме по ключу элемента очереди (пара и получатель): повтор того же элемента не уходит
+SENT_KEY = 'notifications:sent:{}'
+SENT_TTL = 24 * 3600
+
+MATCH_SUBJECT = 'У вас есть пара!'
+DIGEST_SUBJECT = 'У вас есть новые пары!'
+MATCH_LINE = 'Вы понравились "{match_name}"! Почта участника: {match_email}'
+
+# Переносит до ARGV[1] элементов из начала очереди в список обрабатываемых одной атомарной операцией
+CLAIM_SCRIPT = """
+local items = redis.call('lrange', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('ltrim', KEYS[1], #items, -1)
+    redis.call('rpush', KEYS[2], unpack(items))
+end
+return items
+"""
+
+
+def notification_items(matches):
+    """Элементы очереди писем: по письму обоим участникам каждой пары.
+
+    key - пара пользователей и получатель: по нему отбрасываются повторы одного и того же письма."""
+    items = []
+    for match in matches:
+        from_user, to_user = match.from_user, match.to_user
+        pair = '{}:{}'.format(*sorted((from_user.pk, to_user.pk)))
+        items.append({'key': f'{pair}:{to_user.pk}', 'to_email': to_user.email,
+                      'match_name': from_user.first_name, 'match_email': from_user.email})
+        items.append({'key': f'{pair}:{from_user.pk}', 'to_email': from_user.email,
+                      'match_name': to_user.first_name, 'match_email': to_user.email})
+    return items
+
+
+def queue_match_notifications(matches):
+    """Кладет в очередь письма обоим участникам каждой пары; отправляет их периодическая задача пачками."""
+    items = notification_items(matches)
+    if items:
+        get_redis().rpush(QUEUE_KEY, *[json.dumps(item) for item in items])
+
+
+async def aqueue_notification_items(items):
+    """Асинхронно кладет в очередь готовые элементы notification_items."""
+    if items:
+        await get_async_redis().rpush(QUEUE_KEY, *[json.dumps(item) for item in items])
+
+
+def build_messages(items, digest=True):
+    """Собирает письма из элементов очереди.
+
+    При digest=True несколько пар одного получателя объединяются в одно письмо."""
+    return [message for message, _ in _group_messages(items, digest)]
+
+
+def _group_messages(items, digest):
+    """Письма вместе с элементами очереди, из которых собрано каждое: список (письмо, элементы)."""
+    by_recipient = OrderedDict()
+    for item in items:
+        by_recipient.setdefault(item['to_email'], []).append(item)
+
+    messages = []
+    for to_email, recipient_items in by_recipient.items():
+        if digest and len(recipient_items) > 1:
+            lines = [MATCH_LINE.format(**item) for item in recipient_items]
+            messages.append((EmailMessage(subject=DIGEST_SUBJECT, body='\n'.join(lines), to=[to_email]),
+                             recipient_items))
+            continue
+        for item in recipient_items:
+            messages.append((EmailMessage(subject=MATCH_SUBJECT, body=MATCH_LINE.format(**item), to=[to_email]),
+                             [item]))
+    return messages
+
+
+def send_batch(items, connection=None, digest=True):
+    """Отправляет письма по одному соединению с почтовым сервером и возвращает число отправленных."""
+    messages = build_messages(items, digest=digest)
+    if not messages:
+        return 0
+    connection = connection or get_connection()
+    return connection.send_messages(messages) or 0
+
+
+def _apply_rate_limit(client, items):
+    """Делит элементы на разрешенные к отправке и отложенные по лимиту писем на получателя за окно."""
+    counts = OrderedDict()
+    for item in items:
+        counts[item['to_email']] = counts.get(item['to_email'], 0) + 1
+
+    window = settings.NOTIFICATION_RATE_WINDOW
+    pipe = client.pipeline(transaction=False)
+    for to_email, count in counts.items():
+        pipe.incrby(RATE_KEY.format(to_email), count)
+        pipe.expire(RATE_KEY.format(to_email), window, nx=True)
+    totals = pipe.execute()[::2]
+
+    allowed_left = {}
+    for (to_email, count), total in zip(counts.items(), totals):
+        allowed_left[to_email] = max(0, min(count, settings.NOTIFICATION_RATE_LIMIT - (total - count)))
+
+    allowed, deferred = [], []
+    for item in items:
+        if allowed_left[item['to_email']]:
+            allowed_left[item['to_email']] -= 1
+            allowed.append(item)
+        else:
+            deferred.append(item)
+
+    # Отложенные письма не должны расходовать лимит текущего окна
+    _refund_rate_limit(client, deferred)
+    return allowed, deferred
+
+
+def _refund_rate_limit(client, items):
+    """Возвращает в лимит получателей письма, которые не были отправлены."""
+    if not items:
+        return
+    pipe = client.pipeline(transaction=False)
+    for to_email in {item['to_email'] for item in items}:
+        pipe.decrby(RATE_KEY.format(to_email), sum(1 for item in items if item['to_email'] == to_email))
+    pipe.execute()
+
+
+def _drop_sent(client, items):
+    """Убирает элементы, письмо по которым уже отправлено (повторная постановка той же пары в очередь)."""
+    keyed = [item for item in items if item.get('key')]
+    if not keyed:
+        return items
+    pipe = client.pipeline(transaction=False)
+    for item in keyed:
+        pipe.exists(SENT_KEY.format(item['key']))
+    sent = {item['key'] for item, exists in zip(keyed, pipe.execute()) if exists}
+    return [item for item in items if item.get('key') not in sent]
+
+
+def _mark_sent(client, items):
+    pipe = client.pipeline(transaction=False)
+    for item in items:
+        if item.get('key'):
+            pipe.set(SENT_KEY.format(item['key']), 1, ex=SENT_TTL)
+    pipe.execute()
+
+
+def _finish_batch(client, requeue):
+    """Подтверждает обработку пачки: неотправленные элементы возвращаются в очередь, список обрабатываемых
+    очищается одной транзакцией."""
+    pipe = client.pipeline()
+    if requeue:
+        pipe.rpush(QUEUE_KEY, *[json.dumps(item) for item in requeue])
+    pipe.delete(PROCESSING_KEY)
+    pipe.execute()
+
+
+def _recover_processing(client):
+    """Возвращает в начало очереди пачку, оставшуюся от разборщика, упавшего до подтверждения.
+
+    Уже отправленные из нее письма отбросит проверка ключей элементов."""
+    while client.rpoplpush(PROCESSING_KEY, QUEUE_KEY) is not None:
+        pass
+
+
+def dispatch_pending(batch_size=None, max_batches=None, connection=None):
+    """Забирает письма из очереди пачками и отправляет каждую пачку по одному соединению.
+
+    Пачка атомарно переносится в список обрабатываемых и снимается с него только после отправки,
+    поэтому падение воркера не теряет письма: следующий запуск вернет пачку в очередь. Письма
+    отправляются по одному по общему соединению; при ошибке в очередь возвращаются только
+    неотправленные, а их лимит получателя освобождается. Письма сверх лимита получателя
+    возвращаются в конец очереди и уйдут в следующем окне, уже отправленные письма (по ключу
+    элемента) не повторяются. Возвращает число отправленных писем."""
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    max_batches = max_batches or settings.NOTIFICATION_MAX_BATCHES
+    client = get_redis()
+    # Разборщик один: иначе возврат пачки упавшего разборщика забрал бы пачку работающего
+    lock = client.lock(DISPATCH_LOCK_KEY, timeout=DISPATCH_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    claim = client.register_script(CLAIM_SCRIPT)
+    connection = connection or get_connection()
+    sent = 0
+
+    try:
+        _recover_processing(client)
+        with connection:
+            for _ in range(max_batches):
+                raw_items = claim(keys=[QUEUE_KEY, PROCESSING_KEY], args=[batch_size])
+                if not raw_items:
+                    break
+
+                items = _drop_sent(client, [json.loads(raw) for raw in raw_items])
+                allowed, deferred = _apply_rate_limit(client, items)
+                messages = _group_messages(allowed, settings.NOTIFICATION_DIGEST)
+                delivered = 0
+                try:
+                    for message, message_items in messages:
+                        sent += connection.send_messages([message]) or 0
+                        _mark_sent(client, message_items)
+                        delivered += 1
+                except Exception:
+                    unsent = [item for _, message_items in messages[delivered:] for item in message_items]
+                    _refund_rate_limit(client, unsent)
+                    _finish_batch(client, deferred + unsent)
+                    raise
+                _finish_batch(client, deferred)
+
+                if len(raw_items) < batch_size or (deferred and not allowed):
+                    break
+    finally:
+        lock.release()
+    return sent
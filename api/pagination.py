@@ -0,0 +1,41 @@
+from django.contrib.gis.measure import Distance as DistanceMeasure
+from rest_framework.pagination import CursorPagination
+
+
+class UserListCursorPagination(CursorPagination):
+    """Курсорная (keyset) пагинация списка пользователей.
+
+    По умолчанию список упорядочен по id. Если в queryset посчитано расстояние
+    (запрос с радиусом), страницы идут по возрастанию расстояния, а id служит
+    для стабильного порядка при равных расстояниях.
+    """
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('id',)
+
+    def get_ordering(self, request, queryset, view):
+        if 'distance' in queryset.query.annotations:
+            return ('distance', 'id')
+        return self.ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        field_name = ordering[0].lstrip('-')
+        if isinstance(instance, dict):
+            attr = instance[field_name]
+        else:
+            attr = getattr(instance, field_name)
+        # Расстояние хранится в курсоре числом в единицах базы (метры для geography)
+        if isinstance(attr, DistanceMeasure):
+            return str(attr.m)
+        return str(attr)
+
+
+class PairCursorPagination(CursorPagination):
+    """Курсорная пагинация списка пар: новые пары первыми, по частичному индексу match_pairs_idx."""
+
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-id',)
@@ -0,0 +1,183 @@
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Point
+
+from .models import User
+from .utils import get_redis
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lon, lat, lons, lats):
+    """Векторизованно считает расстояние по большому кругу (км) от точки до массивов координат в радианах."""
+    dlat = lats - lat
+    dlon = lons - lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class ProximityIndex:
+    """Индекс координат пользователей в памяти процесса для запросов по радиусу.
+
+    Координаты хранятся в массивах NumPy, отсортированных по широте: запрос сначала
+    бинарным поиском отсекает полосу широт, затем маской по долготе и только для
+    оставшихся кандидатов векторизованно считает гаверсинус.
+    Изменения накапливаются в буфере и вливаются в массивы при следующем запросе.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lats = np.empty(0, dtype=np.float64)
+        self._lons = np.empty(0, dtype=np.float64)
+        self._pending = {}
+        self.ready = False
+
+    def __len__(self):
+        return len(self._ids) + sum(1 for value in self._pending.values() if value is not None)
+
+    def build(self, rows):
+        """Строит индекс из итерируемого набора (id, долгота, широта) в градусах."""
+        data = np.array(list(rows), dtype=np.float64).reshape(-1, 3)
+        with self._lock:
+            self._set_arrays(data[:, 0].astype(np.int64), np.radians(data[:, 2]), np.radians(data[:, 1]))
+            self.ready = True
+
+    def update(self, user_id, point):
+        """Ставит в очередь новое местоположение пользователя (None удаляет его из индекса)."""
+        with self._lock:
+            self._pending[user_id] = (point.x, point.y) if point is not None else None
+
+    def query(self, lon, lat, radius_km):
+        """Возвращает массивы id и расстояний (км) пользователей в радиусе, отсортированные по расстоянию."""
+        lon, lat = np.radians(lon), np.radians(lat)
+        with self._lock:
+            self._merge_pending()
+            ids, lats, lons = self._ids, self._lats, self._lons
+
+        # Полоса широт, внутри которой может находиться результат
+        dlat = radius_km / EARTH_RADIUS_KM
+        start, stop = np.searchsorted(lats, [lat - dlat, lat + dlat])
+        ids, lats, lons = ids[start:stop], lats[start:stop], lons[start:stop]
+
+        # Отсекаем по долготе, если круг не накрывает полюс
+        cos_lat = np.cos(lat)
+        if abs(lat) + dlat < np.pi / 2 and cos_lat > 0:
+            dlon = np.arcsin(min(np.sin(dlat) / cos_lat, 1.0))
+            delta = np.abs((lons - lon + np.pi) % (2 * np.pi) - np.pi)
+            mask = delta <= dlon
+            ids, lats, lons = ids[mask], lats[mask], lons[mask]
+
+        distances = haversine_km(lon, lat, lons, lats)
+        mask = distances <= radius_km
+        ids, distances = ids[mask], distances[mask]
+        order = np.argsort(distances, kind='stable')
+        return ids[order], distances[order]
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        keep = ~np.isin(self._ids, np.fromiter(pending.keys(), dtype=np.int64, count=len(pending)))
+        added = [(user_id, *value) for user_id, value in pending.items() if value is not None]
+        added = np.array(added, dtype=np.float64).reshape(-1, 3)
+        self._set_arrays(
+            np.concatenate([self._ids[keep], added[:, 0].astype(np.int64)]),
+            np.concatenate([self._lats[keep], np.radians(added[:, 2])]),
+            np.concatenate([self._lons[keep], np.radians(added[:, 1])]),
+        )
+
+    def _set_arrays(self, ids, lats, lons):
+        order = np.argsort(lats, kind='stable')
+        self._ids, self._lats, self._lons = ids[order], lats[order], lons[order]
+
+
+proximity_index = ProximityIndex()
+
+# Журнал изменений координат, общий для всех процессов: индекс каждого процесса догоняет его перед запросом
+CHANGES_KEY = 'proximity:changes'
+CHANGES_SEQ_KEY = 'proximity:changes:seq'
+
+# Номер изменения и запись в журнал одной операцией: по разрыву в номерах процесс узнает, что журнал обрезан
+PUBLISH_SCRIPT = """
+local seq = redis.call('incr', KEYS[2])
+redis.call('xadd', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'seq', seq, 'id', ARGV[2], 'point', ARGV[3])
+return seq
+"""
+
+# Построение индекса блокирует запросы потоков процесса, догоняющий журнал поток - нет
+_build_lock = threading.Lock()
+_sync_lock = threading.Lock()
+# Последняя примененная запись журнала: (id записи в потоке Redis, номер изменения)
+_position = ['0-0', 0]
+
+
+def publish_changes(changes):
+    """Записывает в журнал новые местоположения пользователей: список (user_id, точка или None).
+
+    Журнал нужен только движку memory: местоположения пишут разные процессы (веб-воркеры, запись
+    буфера в Celery, загрузка данных), а индекс хранится в каждом процессе."""
+    if not use_memory_engine() or not changes:
+        return
+    client = get_redis()
+    publish = client.register_script(PUBLISH_SCRIPT)
+    pipe = client.pipeline(transaction=False)
+    for user_id, point in changes:
+        publish(keys=[CHANGES_KEY, CHANGES_SEQ_KEY], client=pipe,
+                args=[settings.PROXIMITY_CHANGES_MAXLEN, user_id, f'{point.x},{point.y}' if point is not None else ''])
+    pipe.execute()
+
+
+def get_proximity_index():
+    """Возвращает индекс процесса, при первом обращении загружая координаты пользователей из базы.
+
+    Перед каждым запросом индекс догоняет журнал изменений других процессов; если журнал
+    обрезан раньше, чем процесс его прочитал, индекс строится заново."""
+    if not proximity_index.ready:
+        with _build_lock:
+            if not proximity_index.ready:
+                _build()
+        return proximity_index
+    # Журнал уже читает другой поток: запрос обойдется изменениями, принятыми к этому моменту
+    if _sync_lock.acquire(blocking=False):
+        try:
+            if not _sync():
+                with _build_lock:
+                    _build()
+        finally:
+            _sync_lock.release()
+    return proximity_index
+
+
+def _build():
+    # Позиция журнала запоминается до чтения базы: изменения, сделанные во время построения, применятся повторно
+    pipe = get_redis().pipeline()
+    pipe.xrevrange(CHANGES_KEY, count=1)
+    pipe.get(CHANGES_SEQ_KEY)
+    last, seq = pipe.execute()
+    rows = User.objects.exclude(location__isnull=True).values_list('id', 'location').iterator(chunk_size=10000)
+    proximity_index.build((user_id, location.x, location.y) for user_id, location in rows)
+    _position[:] = [last[0][0] if last else '0-0', int(seq or 0)]
+
+
+def _sync():
+    """Применяет новые записи журнала; False, если часть записей уже вытеснена из журнала."""
+    stream_id, seq = _position
+    response = get_redis().xread({CHANGES_KEY: stream_id}, count=settings.PROXIMITY_CHANGES_MAXLEN)
+    entries = response[0][1] if response else []
+    if not entries:
+        return True
+    if int(entries[0][1][b'seq']) != seq + 1:
+        return False
+    for _, fields in entries:
+        point = fields[b'point'].decode()
+        proximity_index.update(int(fields[b'id']), Point(*map(float, point.split(',')), srid=4326) if point else None)
+    _position[:] = [entries[-1][0], int(entries[-1][1][b'seq'])]
+    return True
+
+
+def use_memory_engine():
+    """Проверяет, включен ли движок поиска по радиусу в памяти процесса."""
+    return settings.PROXIMITY_ENGINE == 'memory'
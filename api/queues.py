@@ -0,0 +1,91 @@
+import hashlib
+import json
+import time
+
+import redis
+from celery import Task
+from django.conf import settings
+
+from .utils import get_redis
+
+# Очереди Celery; у каждой свой воркер со своими параллелизмом и prefetch (см. docker-compose.yml)
+DEFAULT = 'celery'
+NOTIFICATIONS = 'notifications'
+MEDIA = 'media'
+MAINTENANCE = 'maintenance'
+QUEUES = (DEFAULT, NOTIFICATIONS, MEDIA, MAINTENANCE)
+
+IDEMPOTENCY_KEY = 'celery:once:{}:{}'
+
+# Ключи идемпотентности в режимах без Redis (CELERY_MODE eager или memory): ключ -> время истечения
+_local_keys = {}
+
+
+def claim(key, ttl):
+    """Занимает ключ идемпотентности на ttl секунд; False, если он уже занят."""
+    if settings.CELERY_MODE != 'redis':
+        now = time.monotonic()
+        if _local_keys.get(key, 0) > now:
+            return False
+        _local_keys[key] = now + ttl
+        return True
+    return bool(get_redis().set(key, 1, nx=True, ex=ttl))
+
+
+def release(key):
+    if settings.CELERY_MODE != 'redis':
+        _local_keys.pop(key, None)
+    else:
+        get_redis().delete(key)
+
+
+def queue_depths():
+    """Число сообщений, ожидающих в каждой очереди брокера Redis (в режимах без Redis - пустой словарь)."""
+    if settings.CELERY_MODE != 'redis':
+        return {}
+    pipe = redis.Redis.from_url(settings.CELERY_BROKER_URL).pipeline(transaction=False)
+    for queue in QUEUES:
+        pipe.llen(queue)
+    return dict(zip(QUEUES, pipe.execute()))
+
+
+class IdempotentTask(Task):
+    """Задача, повторная постановка которой с теми же аргументами отбрасывается.
+
+    При постановке в очередь занимается ключ из имени задачи и аргументов; пока он занят,
+    apply_async/delay ничего не отправляют и возвращают None. С release_on_start ключ снимается
+    в начале выполнения, то есть схлопываются только дубликаты, еще ждущие в очереди (пересчеты,
+    периодические задачи при отставшем воркере). Без него ключ живет idempotency_ttl секунд и
+    защищает от повторной отправки того же письма. При ошибке ключ снимается, повторы через
+    retry не проверяются. Если сообщение потеряно до начала выполнения, ключ держится до истечения
+    idempotency_ttl, поэтому периодическим задачам он задается около интервала расписания."""
+
+    idempotency_ttl = 3600
+    release_on_start = False
+
+    def idempotency_key(self, args, kwargs):
+        payload = json.dumps([list(args or ()), kwargs or {}], sort_keys=True, default=str)
+        return IDEMPOTENCY_KEY.format(self.name, hashlib.sha1(payload.encode()).hexdigest())
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        if options.get('retries'):
+            return super().apply_async(args, kwargs, **options)
+        key = self.idempotency_key(args, kwargs)
+        if not claim(key, self.idempotency_ttl):
+            # Импорт внутри метода: модуль метрик импортирует этот модуль
+            from .metrics import TASK_DUPLICATES
+
+            TASK_DUPLICATES.labels(self.name).inc()
+            return None
+        try:
+            return super().apply_async(args, kwargs, **options)
+        except Exception:
+            release(key)
+            raise
+
+    def before_start(self, task_id, args, kwargs):
+        if self.release_on_start:
+            release(self.idempotency_key(args, kwargs))
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        release(self.idempotency_key(args, kwargs))
@@ -1,10 +1,15 @@
+from django.conf import settings
+from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
+from django.db import transaction
 from rest_framework import serializers
 
+from .metrics import stage_timer
 from .models import Match, User
-from .utils import apply_watermark
+from .tasks import process_avatar
+from .tokens import issue_token
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -34,34 +39,38 @@ class UserSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        """Создает нового пользователя, применяет водяной знак к изображению аватара и сохраняет пользователя."""
+        """Создает нового пользователя и ставит обработку аватара в очередь.
+
+        Загруженный файл сохраняется как есть, водяной знак накладывает фоновая задача,
+        а до ее завершения у пользователя остается аватар по умолчанию."""
         avatar = validated_data.get('avatar')
-        if avatar:
-            try:
-                avatar = validated_data.pop('avatar')
-                validated_data['avatar'] = apply_watermark(avatar)
-            except Exception as e:
-                raise serializers.ValidationError("Ошибка обработки изображения: %s" % e)
-        else:
-            # Если аватар отсутствует, присваиваем дефолтный аватар
-            validated_data['avatar'] = 'default/default_avatar.png'
-
-        user = User.objects.create(
+
+        user = User(
             email=validated_data['email'],
             first_name=validated_data['first_name'],
             last_name=validated_data['last_name'],
             gender=validated_data['gender'],
-            avatar=validated_data['avatar']
+            avatar='default/default_avatar.png',
         )
+        if avatar:
+            user.avatar_original = avatar
+            user.avatar_status = User.AVATAR_PENDING
 
-        user.set_password(validated_data['password'])
+        with stage_timer('password_hash'):
+            user.set_password(validated_data['password'])
         user.save()
 
+        if avatar:
+            transaction.on_commit(lambda: process_avatar.delay(user.pk))
+
         return user
 
     class Meta:
         model = User
-        fields = ['id', 'email', 'first_name', 'last_name', 'gender', 'avatar', 'password', 'password2']
+        fields = [
+            'id', 'email', 'first_name', 'last_name', 'gender', 'avatar', 'avatar_status', 'password', 'password2'
+        ]
+        read_only_fields = ['avatar_status']
         extra_kwargs = {
             'first_name': {'required': True},
             'last_name': {'required': True},
@@ -69,6 +78,12 @@ class UserSerializer(serializers.ModelSerializer):
         }
 
 
+def avatar_size_param(request):
+    """Сторона уменьшенной копии аватара из параметра avatar_size или None (исходный размер)."""
+    value = request.GET.get('avatar_size') if request is not None else None
+    return int(value) if value and value.isdigit() else None
+
+
 class UserListSerializer(serializers.ModelSerializer):
     """Сериализатор для модели User - вывод списка пользователей."""
 
@@ -79,19 +94,27 @@ class UserListSerializer(serializers.ModelSerializer):
         if hasattr(obj, 'distance'):
             return obj.distance.km
 
+        distances = self.context.get('distances')
+        if distances is not None:
+            return distances.get(obj.pk)
+
     def to_representation(self, instance):
         """Метод проверяет есть ли радиус в запросе, если есть возвращает расстояние до пользователей,
         у которых он есть, если нет, то удаляем поле distance из response"""
         request = self.context.get('request')
-        radius = request.GET.get('radius') if request else None
+        radius = request.GET.get('radius') or request.GET.get('nearest') if request else None
 
         # вызываем оригинальный to_representation
         ret = super().to_representation(instance)
 
-        # удаляем поле 'distance', если радиус не указан
+        # удаляем поле 'distance', если не указан ни радиус, ни число ближайших
         if not radius and 'distance' in ret:
             ret.pop('distance')
 
+        size = avatar_size_param(request)
+        if size and instance.avatar:
+            ret['avatar'] = request.build_absolute_uri(instance.avatar.storage.url_for_size(instance.avatar.name, size))
+
         return ret
 
     class Meta:
@@ -99,21 +122,135 @@ class UserListSerializer(serializers.ModelSerializer):
         fields = ('first_name', 'last_name', 'gender', 'avatar', 'location', 'distance')
 
 
+class PairSerializer(UserListSerializer):
+    """Пара текущего пользователя: id, почта и поля UserListSerializer партнера (to_user взаимного лайка)."""
+
+    distance = None
+
+    def to_representation(self, instance):
+        return super().to_representation(instance.to_user)
+
+    class Meta(UserListSerializer.Meta):
+        fields = ('id', 'email', 'first_name', 'last_name', 'gender', 'avatar', 'location')
+
+
+class UserListFastSerializer:
+    """Быстрый путь сериализации списка пользователей.
+
+    Читает из базы только нужные столбцы через values() и формирует те же словари, что и
+    UserListSerializer, без создания моделей и полей сериализатора на каждую строку: наличие
+    поля distance определяется один раз на запрос, URL аватаров (с учетом avatar_size) считаются
+    один раз на имя файла.
+    """
+
+    value_fields = ('id', 'first_name', 'last_name', 'gender', 'avatar', 'location')
+
+    def __init__(self, context, include_distance=None):
+        self.request = context.get('request')
+        self.distances = context.get('distances')
+        if include_distance is None:
+            params = self.request.GET if self.request else {}
+            include_distance = bool(params.get('radius') or params.get('nearest'))
+        self.include_distance = include_distance
+        self.avatar_size = avatar_size_param(self.request)
+        self._avatar_urls = {}
+
+    def prepare(self, queryset):
+        """Возвращает queryset словарей только с выводимыми столбцами."""
+        fields = self.value_fields
+        if 'distance' in queryset.query.annotations:
+            fields += ('distance',)
+        return queryset.values(*fields)
+
+    def avatar_url(self, name):
+        if not name:
+            return None
+        url = self._avatar_urls.get(name)
+        if url is None:
+            url = User._meta.get_field('avatar').storage.url_for_size(name, self.avatar_size)
+            if self.request is not None:
+                url = self.request.build_absolute_uri(url)
+            self._avatar_urls[name] = url
+        return url
+
+    def represent(self, row):
+        """Преобразует одну строку values() в словарь ответа."""
+        location = row['location']
+        item = {
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'gender': row['gender'],
+            'avatar': self.avatar_url(row['avatar']),
+            'location': str(location) if location is not None else None,
+        }
+        if self.include_distance:
+            distance = row.get('distance')
+            if distance is not None:
+                item['distance'] = distance.km
+            elif self.distances is not None:
+                item['distance'] = self.distances.get(row['id'])
+            else:
+                item['distance'] = None
+        return item
+
+    def to_representation(self, rows):
+        """Преобразует строки values() в список словарей ответа."""
+        return [self.represent(row) for row in rows]
+
+
 class MatchSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Match."""
 
     from_user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    to_user = serializers.IntegerField(source='to_user_id')
 
     def validate(self, attrs):
-        """Проверяет, что пользователь не лайкает себя или повторно других пользователей."""
-        if attrs['from_user'] == attrs['to_user']:
+        """Проверяет, что пользователь не лайкает себя. Повторный лайк отсекается уникальным ограничением в базе."""
+        if attrs['from_user'].pk == attrs['to_user_id']:
             raise serializers.ValidationError({"detail": "Вы не можете лайкнуть сами себя!"})
 
-        if Match.objects.filter(from_user=attrs['from_user'], to_user=attrs['to_user']).exists():
+        return attrs
+
+    def create(self, validated_data):
+        """Сохраняет лайк и одновременно проверяет, образовалась ли пара."""
+        try:
+            match = Match.objects.like(validated_data['from_user'], validated_data['to_user_id'])
+        except User.DoesNotExist:
+            raise serializers.ValidationError({"to_user": "Пользователь не найден!"})
+
+        if match is None:
             raise serializers.ValidationError({"detail": "Вам уже нравился данный пользователь!"})
 
-        return attrs
+        return match
 
     class Meta:
         model = Match
         fields = ['from_user', 'to_user']
+
+
+class MatchBulkSerializer(serializers.Serializer):
+    """Сериализатор пакетного создания лайков."""
+
+    from_user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    to_users = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+
+    def create(self, validated_data):
+        """Сохраняет все лайки пакета и возвращает результат по каждому пользователю."""
+        return Match.objects.like_many(validated_data['from_user'], validated_data['to_users'])
+
+
+class TokenObtainSerializer(serializers.Serializer):
+    """Сериализатор выдачи токена по email и паролю."""
+
+    email = serializers.EmailField(write_only=True)
+    password = serializers.CharField(write_only=True, style={'input_type': 'password'})
+    token = serializers.CharField(read_only=True)
+    expires_in = serializers.IntegerField(read_only=True)
+
+    def validate(self, attrs):
+        """Проверяет пароль (единственное хэширование пароля за время жизни токена) и выдает токен."""
+        with stage_timer('password_hash'):
+            user = authenticate(self.context.get('request'), email=attrs['email'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError({"detail": "Неверный email или пароль!"})
+        return {'token': issue_token(user), 'expires_in': settings.AUTH_TOKEN_TTL}
@@ -0,0 +1,111 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import db, density, list_cache, proximity, tokens
+from .models import User
+
+# Отправляется, когда принято новое местоположение пользователя (аргументы: user_id, old, new)
+location_changed = Signal()
+# Отправляется после записи буфера местоположений в базу (аргумент moves: список (user_id, old, new))
+locations_saved = Signal()
+
+
+@receiver(post_save, sender=User)
+def update_proximity_index(sender, instance, update_fields=None, **kwargs):
+    """Передает новое местоположение пользователя индексам в памяти всех процессов."""
+    if update_fields is None or 'location' in update_fields:
+        proximity.publish_changes([(instance.pk, instance.location)])
+
+
+@receiver(location_changed)
+def move_in_proximity_index(sender, user_id, new, **kwargs):
+    """Обновляет индексы процессов сразу, не дожидаясь записи местоположения в базу."""
+    proximity.publish_changes([(user_id, new)])
+
+
+@receiver(locations_saved)
+def move_in_proximity_index_on_flush(sender, moves, **kwargs):
+    """Передает индексам местоположения, записанные в базу в обход сигналов модели (запись буфера, загрузка)."""
+    proximity.publish_changes([(user_id, new) for user_id, _, new in moves])
+
+
+@receiver(post_delete, sender=User)
+def remove_from_proximity_index(sender, instance, **kwargs):
+    """Удаляет пользователя из индексов процессов."""
+    proximity.publish_changes([(instance.pk, None)])
+
+
+@receiver(post_save, sender=User)
+def invalidate_list_cache_on_save(sender, instance, **kwargs):
+    """Сбрасывает закэшированные списки, в которые мог попасть сохраненный пользователь, в том числе списки
+    его прежней ячейки."""
+    list_cache.invalidate(instance.location, getattr(instance, '_previous_location', None))
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_location(sender, instance, update_fields=None, **kwargs):
+    """Запоминает местоположение пользователя в базе до сохранения, чтобы сбросить списки его прежней ячейки."""
+    if instance.pk is not None and (update_fields is None or 'location' in update_fields):
+        instance._previous_location = User.objects.filter(pk=instance.pk).values_list('location', flat=True).first()
+
+
+@receiver(post_delete, sender=User)
+def invalidate_list_cache_on_delete(sender, instance, **kwargs):
+    """Сбрасывает закэшированные списки, в которых мог быть удаленный пользователь."""
+    list_cache.invalidate(instance.location)
+
+
+@receiver(location_changed)
+def invalidate_list_cache_on_move(sender, old, new, **kwargs):
+    """Сбрасывает списки старой и новой ячейки пользователя (важно для поиска по индексу в памяти)."""
+    list_cache.invalidate(old, new)
+
+
+@receiver(locations_saved)
+def invalidate_list_cache_on_flush(sender, moves, **kwargs):
+    """Сбрасывает списки ячеек, в которых местоположения изменились в базе."""
+    list_cache.invalidate(*[point for _, old, new in moves for point in (old, new)])
+
+
+@receiver(location_changed)
+def update_feeds_on_move(sender, user_id, old, new, **kwargs):
+    """Ставит в очередь обновление лент кандидатов после перемещения пользователя."""
+    # Импорт внутри функции: модуль задач сам зависит от модулей, отправляющих этот сигнал
+    from .tasks import update_feeds_after_move
+
+    update_feeds_after_move.delay(
+        user_id,
+        old=(old.x, old.y) if old is not None else None,
+        new=(new.x, new.y) if new is not None else None,
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    """Убирает пользователя из кэша аутентификации по токену: смена пароля или активности сразу действует."""
+    tokens.forget_users(instance.pk)
+
+
+@receiver(location_changed)
+def pin_primary_on_move(sender, user_id, **kwargs):
+    """Пользователь, сменивший местоположение, некоторое время читает с основной базы."""
+    db.pin_primary(user_id)
+
+
+@receiver(locations_saved)
+def pin_primary_on_flush(sender, moves, **kwargs):
+    """Местоположения записаны в базу: переместившиеся пользователи читают с основной базы, пока реплики отстают."""
+    db.pin_primary(*[user_id for user_id, _, _ in moves])
+
+
+@receiver(locations_saved)
+def update_density_on_flush(sender, moves, **kwargs):
+    """Переносит переместившихся пользователей между ячейками построенных тайлов плотности."""
+    density.apply_moves(moves)
+
+
+@receiver(post_delete, sender=User)
+def remove_from_density(sender, instance, **kwargs):
+    """Убирает удаленного пользователя из построенных тайлов плотности."""
+    density.apply_moves([(instance.pk, instance.location, None)], {instance.pk: instance.gender})
@@ -0,0 +1,61 @@
+import hashlib
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Имя файла в хранилище: SHA-256 содержимого, у уменьшенных копий - с суффиксом размера
+HASHED_NAME_RE = re.compile(r'^(?P<digest>[0-9a-f]{64})(?:_(?P<size>\d+))?\.\w+$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище аватаров, в котором имя файла - хэш его содержимого.
+
+    Одинаковые загрузки записываются один раз (файл с таким хэшем уже есть - запись
+    пропускается), а содержимое файла по имени никогда не меняется, поэтому его можно отдавать
+    с ETag и долгим сроком кэширования. Уменьшенные копии хранятся рядом: <хэш>_<размер>.<расширение>."""
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        hexdigest = digest.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        name = posixpath.join(directory, hexdigest[:2], hexdigest + extension)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    @staticmethod
+    def is_hashed(name):
+        return bool(name) and HASHED_NAME_RE.match(posixpath.basename(name)) is not None
+
+    @staticmethod
+    def variant_name(name, size):
+        """Имя уменьшенной копии файла name со стороной size."""
+        root, extension = posixpath.splitext(name)
+        return f'{root}_{size}{extension}'
+
+    def save_variant(self, name, size, content):
+        """Сохраняет уменьшенную копию под именем variant_name, если ее еще нет."""
+        variant = self.variant_name(name, size)
+        if not self.exists(variant):
+            super().save(variant, content)
+        return variant
+
+    def url_for_size(self, name, size=None):
+        """URL файла или его уменьшенной копии, если она предусмотрена настройкой AVATAR_THUMBNAIL_SIZES."""
+        match = HASHED_NAME_RE.match(posixpath.basename(name))
+        if size in settings.AVATAR_THUMBNAIL_SIZES and match and not match.group('size'):
+            name = self.variant_name(name, size)
+        return self.url(name)
+
+
+avatar_storage = ContentAddressedStorage()
@@ -1,13 +1,107 @@
-from celery import shared_task
-from django.core.mail import EmailMessage
+import math
+
+from celery import group, shared_task
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from PIL import UnidentifiedImageError
+
+from . import feed
+from .location import flush_buffered_locations
+from .metrics import stage_timer
+from .models import User
+from .notifications import dispatch_pending, queue_match_notifications
+from .queues import IdempotentTask
+from .utils import apply_watermark, save_avatar_thumbnails
+
+# Пересчеты схлопываются, пока ждут в очереди; если сообщение потеряно, новый пересчет можно поставить через 5 минут
+REBUILD_IDEMPOTENCY_TTL = 300
+
+
+def notify_matches(matches):
+    """Ставит письма обоим участникам каждой образовавшейся пары в очередь рассылки."""
+    queue_match_notifications(matches)
+
+
+# Периодические задачи: если воркер отстал, в очереди остается одна копия, а не накопленные beat.
+# Ключ живет один интервал расписания: потерянное сообщение (перезапуск брокера, воркер убит до начала
+# задачи) задерживает следующий запуск не больше чем на интервал
+@shared_task(base=IdempotentTask, release_on_start=True, idempotency_ttl=math.ceil(settings.NOTIFICATION_INTERVAL))
+def dispatch_match_emails():
+    """Периодически отправляет накопленные письма о парах пачками по одному соединению."""
+    return dispatch_pending()
+
+
+@shared_task(base=IdempotentTask, release_on_start=True, idempotency_ttl=math.ceil(settings.LOCATION_FLUSH_INTERVAL))
+def flush_locations():
+    """Периодически сбрасывает буфер местоположений пользователей в базу."""
+    return flush_buffered_locations()
+
+
+# Повторный запуск безопасен, поэтому подтверждение после выполнения: задача не теряется при падении воркера
+@shared_task(bind=True, base=IdempotentTask, release_on_start=True, idempotency_ttl=REBUILD_IDEMPOTENCY_TTL,
+             acks_late=True, max_retries=3, default_retry_delay=10)
+def process_avatar(self, user_id):
+    """Накладывает водяной знак на загруженный аватар пользователя.
+
+    Повторный запуск безопасен: уже обработанный аватар не пересчитывается.
+    Временные ошибки повторяются, при битом файле или исчерпании попыток статус становится failed."""
+    user = User.objects.only('id', 'avatar', 'avatar_original', 'avatar_status').filter(pk=user_id).first()
+    if user is None or user.avatar_status == User.AVATAR_READY or not user.avatar_original:
+        return
+
+    User.objects.filter(pk=user_id).update(avatar_status=User.AVATAR_PROCESSING)
+    try:
+        with user.avatar_original.open('rb') as original, stage_timer('watermark'):
+            avatar = apply_watermark(original)
+    except UnidentifiedImageError:
+        User.objects.filter(pk=user_id).update(avatar_status=User.AVATAR_FAILED)
+        raise
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            User.objects.filter(pk=user_id).update(avatar_status=User.AVATAR_FAILED)
+            raise
+        raise self.retry(exc=exc)
+
+    # Имя файла - хэш содержимого; уменьшенные копии пишутся до того, как список начнет ссылаться на аватар
+    user.avatar.save(avatar.name, avatar, save=False)
+    with stage_timer('thumbnails'):
+        save_avatar_thumbnails(user.avatar.storage, user.avatar.name, avatar.file.getvalue())
+    user.avatar_status = User.AVATAR_READY
+    user.save(update_fields=['avatar', 'avatar_status'])
+
+
+@shared_task(base=IdempotentTask, release_on_start=True, idempotency_ttl=REBUILD_IDEMPOTENCY_TTL)
+def rebuild_feed(user_id):
+    """Пересчитывает ленту кандидатов пользователя."""
+    return feed.rebuild(user_id)
 
 
 @shared_task
-def send_match_email(to_email, match_name):
-    message = 'Вы понравились "{}"! Почта участника: {}'.format(match_name, to_email)
-    email = EmailMessage(
-        subject='У вас есть пара!',
-        body=message,
-        to=[to_email],
-    )
-    email.send()
+def rebuild_feeds_batch(user_ids):
+    """Пересчитывает ленты пачки пользователей."""
+    return sum(feed.rebuild(user_id) for user_id in user_ids)
+
+
+@shared_task(base=IdempotentTask, release_on_start=True, idempotency_ttl=REBUILD_IDEMPOTENCY_TTL)
+def rebuild_all_feeds(batch_size=500):
+    """Ставит пересчет лент всех пользователей с местоположением пачками по batch_size."""
+    user_ids = list(User.objects.filter(location__isnull=False).order_by('id').values_list('id', flat=True))
+    batches = [user_ids[i:i + batch_size] for i in range(0, len(user_ids), batch_size)]
+    if batches:
+        group(rebuild_feeds_batch.s(batch) for batch in batches).apply_async()
+    return len(batches)
+
+
+@shared_task
+def update_feeds_after_move(user_id, old=None, new=None):
+    """Обновляет ленту переместившегося пользователя и его позицию в лентах соседей.
+
+    old и new - координаты (долгота, широта) до и после перемещения."""
+    user = User.objects.only('id', 'gender').filter(pk=user_id).first()
+    if user is None:
+        return 0
+    old_point = Point(*old, srid=4326) if old else None
+    new_point = Point(*new, srid=4326) if new else None
+    if feed.is_ready(user_id):
+        feed.rebuild(user_id)
+    return feed.apply_move(user_id, user.gender, old_point, new_point)
@@ -0,0 +1,630 @@
+import json
+import threading
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from celery import shared_task
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D, Distance
+from django.core import mail
+from django.core.cache import cache
+from django.db import connections
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from SocialMedia.celery import app as celery_app
+
+from . import db, density, list_cache, notifications, proximity, queues, tokens
+from .likes import LikeBloomFilter
+from .models import Match, User
+from .notifications import queue_match_notifications
+from .proximity import ProximityIndex
+from .queues import IdempotentTask
+from .serializers import UserListFastSerializer, UserListSerializer
+from .tasks import dispatch_match_emails
+from .utils import get_redis
+
+# Кэш Django в памяти процесса: закрепления за основной базой и кэш списка изолированы между тестами. Данным
+# приложения (буфер местоположений, ленты, очередь писем) по-прежнему нужен Redis из настроек (API_REDIS_URL)
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Отдельная база Redis для тестов, которые проверяют данные приложения в Redis: очищается перед каждым тестом
+TEST_REDIS_URL = f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/15'
+
+
+class RedisTestMixin:
+    """Подменяет базу Redis данных приложения на TEST_REDIS_URL и очищает ее перед тестом."""
+
+    def setUp(self):
+        super().setUp()
+        redis_settings = override_settings(API_REDIS_URL=TEST_REDIS_URL)
+        redis_settings.enable()
+        self.addCleanup(redis_settings.disable)
+        get_redis.cache_clear()
+        self.addCleanup(get_redis.cache_clear)
+        get_redis().flushdb()
+
+
+def create_user(number, gender='M', location=None):
+    user = User.objects.create_user(f'user{number}@example.com', f'User{number}', f'Name{number}', gender,
+                                    password='password')
+    if location is not None:
+        # Местоположение записывается в обход сигналов, как при записи буфера местоположений
+        User.objects.filter(pk=user.pk).update(location=location)
+        user.location = location
+    return user
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], CACHES=LOCMEM_CACHES)
+class ReplicaRouterTests(SimpleTestCase):
+    """Маршрутизация чтений и записей между основной базой и репликами без обращения к базе."""
+
+    def setUp(self):
+        cache.clear()
+        self.router = db.ReplicaRouter()
+
+    def test_reads_go_to_primary_by_default(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_replica_reads_route_only_reads(self):
+        with db.replica_reads() as alias:
+            self.assertEqual(alias, 'replica1')
+            self.assertEqual(self.router.db_for_read(User), 'replica1')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+        self.assertIsNone(db.current_replica.get())
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_migrations_run_on_primary_only(self):
+        self.assertTrue(self.router.allow_migrate('default', 'api'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'api'))
+
+    def test_pinned_user_reads_from_primary(self):
+        db.pin_primary(1)
+        self.assertIsNone(db.choose_replica(User(pk=1)))
+        self.assertEqual(db.choose_replica(User(pk=2)), 'replica1')
+
+    def test_pin_is_skipped_without_replicas(self):
+        with override_settings(DATABASE_REPLICAS=[]):
+            db.pin_primary(1)
+            self.assertIsNone(db.choose_replica(User(pk=1)))
+        self.assertIsNone(cache.get(db.PIN_KEY.format(1)))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'нужна реплика (DB_REPLICA_HOSTS): в тестах она зеркалит основную базу')
+@override_settings(CACHES=LOCMEM_CACHES, LIST_CACHE_ENABLED=False)
+class ReplicaReadsTests(TransactionTestCase):
+    """Список пользователей читается с реплики, пока пользователь не записал что-то в базу."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.replica = settings.DATABASE_REPLICAS[0]
+        self.user = create_user(1)
+        self.other = create_user(2, gender='W')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def user_queries(self, alias):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            response = self.client.get('/list/')
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries if User._meta.db_table in query['sql']]
+
+    def test_list_reads_from_replica_and_resets_context(self):
+        with override_settings(DATABASE_REPLICAS=[self.replica]):
+            self.assertTrue(self.user_queries(self.replica))
+        self.assertIsNone(db.current_replica.get())
+
+    def test_write_pins_user_to_primary(self):
+        with override_settings(DATABASE_REPLICAS=[self.replica]):
+            response = self.client.post(f'/clients/{self.user.pk}/match/', {'to_user': self.other.pk}, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertFalse(self.user_queries(self.replica))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIST_CACHE_ENABLED=False, PROXIMITY_ENGINE='postgis')
+class UserListPaginationTests(TestCase):
+    """Курсорная пагинация списка: по расстоянию при запросе с радиусом, по id без него; потоковая выгрузка."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(0, location=Point(37.6, 55.75, srid=4326))
+        # Пользователи 1..7 все дальше от текущего, но созданы не по порядку удаления
+        for number in (4, 1, 7, 2, 6, 3, 5):
+            create_user(number, location=Point(37.6 + 0.01 * number, 55.75, srid=4326))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect_pages(self, url):
+        items, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            items.extend(response.data['results'])
+            url, pages = response.data['next'], pages + 1
+        return items, pages
+
+    def test_radius_pages_follow_distance(self):
+        items, pages = self.collect_pages('/list/?radius=50&page_size=3')
+        self.assertEqual([item['first_name'] for item in items],
+                         ['User0'] + [f'User{number}' for number in range(1, 8)])
+        distances = [item['distance'] for item in items]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(pages, 3)
+
+    def test_pages_without_radius_follow_id(self):
+        items, _ = self.collect_pages('/list/?page_size=3')
+        self.assertEqual([item['first_name'] for item in items],
+                         ['User0', 'User4', 'User1', 'User7', 'User2', 'User6', 'User3', 'User5'])
+        self.assertTrue(all('distance' not in item for item in items))
+
+    def test_stream_returns_whole_list(self):
+        response = self.client.get('/list/stream/?radius=50')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['first_name'] for line in lines],
+                         ['User0'] + [f'User{number}' for number in range(1, 8)])
+
+        response = self.client.get('/list/stream/?output=json')
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 8)
+
+
+class LikeBloomFilterTests(SimpleTestCase):
+    """Фильтр Блума лайков на локальной битовой карте, без Redis."""
+
+    def test_no_false_negatives_and_expected_error_rate(self):
+        rng = np.random.default_rng(0)
+        bloom = LikeBloomFilter(capacity=20_000, error_rate=0.01)
+        edges = np.unique(rng.integers(1, 5_000, size=(20_000, 2)), axis=0)
+        bitmap = bloom.build_bitmap(map(tuple, edges.tolist()))
+        self.assertTrue(bloom.bitmap_contains(bitmap, edges[:, 0], edges[:, 1]).all())
+
+        # Пары с id вне диапазона ребер точно не лайкнуты
+        probes = rng.integers(5_000, 10_000, size=(20_000, 2))
+        self.assertLess(bloom.bitmap_contains(bitmap, probes[:, 0], probes[:, 1]).mean(), 0.02)
+
+    @override_settings(LIKES_BLOOM_ENABLED=False)
+    def test_disabled_filter_skips_redis_and_database(self):
+        self.assertEqual(Match.objects.known_duplicates(1, [2, 3]), set())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIKES_BLOOM_ENABLED=False)
+class LikeTests(TestCase):
+    """Создание лайков одним запросом (MatchManager.like_many) и ендпоинт пачки лайков."""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [create_user(number, gender='MW'[number % 2]) for number in range(4)]
+
+    def test_reverse_like_marks_both_rows_matched(self):
+        first, second = self.users[:2]
+        [(_, like_status, match)] = Match.objects.like_many(first, [second.pk])
+        self.assertEqual(like_status, Match.LIKE_CREATED)
+        self.assertFalse(match.matched)
+
+        [(_, like_status, match)] = Match.objects.like_many(second, [first.pk])
+        self.assertEqual(like_status, Match.LIKE_MATCHED)
+        self.assertEqual(match.to_user.email, first.email)
+        self.assertEqual(Match.objects.filter(matched=True).count(), 2)
+
+    def test_batch_statuses(self):
+        first, second, third, _ = self.users
+        Match.objects.like_many(first, [second.pk])
+        Match.objects.like_many(third, [first.pk])
+
+        results = Match.objects.like_many(first, [second.pk, first.pk, 0, third.pk, third.pk])
+        self.assertEqual([(to_user_id, like_status) for to_user_id, like_status, _ in results], [
+            (second.pk, Match.LIKE_DUPLICATE),
+            (first.pk, Match.LIKE_SELF),
+            (0, Match.LIKE_NOT_FOUND),
+            (third.pk, Match.LIKE_MATCHED),
+        ])
+        self.assertEqual(Match.objects.filter(from_user=first).count(), 2)
+
+    def test_like_raises_for_missing_user(self):
+        with self.assertRaises(User.DoesNotExist):
+            Match.objects.like(self.users[0], 0)
+
+    def test_bulk_requires_authentication(self):
+        response = APIClient().post(f'/clients/{self.users[0].pk}/match/bulk/', {'to_users': [self.users[1].pk]},
+                                    format='json')
+        self.assertIn(response.status_code, (401, 403))
+        self.assertFalse(Match.objects.exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIKES_BLOOM_ENABLED=False)
+class ConcurrentLikeTests(TransactionTestCase):
+    """Встречные пачки лайков из параллельных потоков: без взаимоблокировок, каждую пару отмечает один запрос."""
+
+    def like_all(self, users):
+        barrier = threading.Barrier(len(users))
+        results, errors = {}, []
+
+        def like(user):
+            try:
+                barrier.wait()
+                results[user.pk] = Match.objects.like_many(user, [other.pk for other in users if other != user])
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=like, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_crossing_likes_do_not_deadlock(self):
+        for round_number in range(5):
+            users = [create_user(round_number * 10 + number, gender='MW'[number % 2]) for number in range(4)]
+            results = self.like_all(users)
+
+            reported = [frozenset((from_id, to_user_id)) for from_id, statuses in results.items()
+                        for to_user_id, like_status, _ in statuses if like_status == Match.LIKE_MATCHED]
+            self.assertEqual(len(reported), 6)
+            self.assertEqual(len(set(reported)), 6)
+            self.assertFalse(Match.objects.filter(from_user__in=users, matched=False).exists())
+
+
+@override_settings(CACHES=LOCMEM_CACHES, DENSITY_MAX_ZOOM=16, DENSITY_MAX_TILES=64)
+class DensityTests(TestCase):
+    """Проверка области /density/ до построения списка тайлов."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(create_user(1))
+
+    def test_tile_count_matches_tiles(self):
+        bbox = (37.3, 55.55, 37.9, 55.9)
+        self.assertEqual(density.tile_count(*bbox, 11), len(density.tiles_in_bbox(*bbox, 11)))
+        self.assertEqual(density.tile_count(-180, -89, 180, 89, 16), 2 ** 32)
+
+    def test_too_large_bbox_is_rejected(self):
+        response = self.client.get('/density/', {'bbox': '-180,-89,180,89', 'zoom': 16})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, CELERY_MODE='eager', METRICS_ALLOWED_IPS=['127.0.0.0/8'])
+class MetricsAccessTests(TestCase):
+    """Доступ к /metrics/: разрешенные адреса и администраторы."""
+
+    def test_allowed_network(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 200)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_admin_from_any_address(self):
+        admin = create_user(1)
+        User.objects.filter(pk=admin.pk).update(is_admin=True)
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get('/metrics/', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenTests(TestCase):
+    """Токены: в кэше только поля аутентификации, смена пароля отзывает токены."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user(1)
+        self.token = tokens.issue_token(self.user)
+
+    def test_cache_holds_only_auth_fields(self):
+        self.assertEqual(tokens.user_from_token(self.token).pk, self.user.pk)
+        self.assertEqual(cache.get(tokens.USER_CACHE_KEY.format(self.user.pk)),
+                         (self.user.pk, True, self.user.get_session_auth_hash()))
+
+        user = tokens.user_from_token(self.token)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, self.user.email)
+
+    def test_password_change_revokes_cached_token(self):
+        self.assertIsNotNone(tokens.user_from_token(self.token))
+        self.user.set_password('another-password')
+        self.user.save()
+        self.assertIsNone(tokens.user_from_token(self.token))
+
+        response = self.client.get('/list/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 401)
+
+
+class UserListFastSerializerTests(SimpleTestCase):
+    """Быстрый путь сериализации списка дает тот же ответ, что и UserListSerializer."""
+
+    def make_rows(self, with_distance):
+        avatar = 'avatars/ab/' + 'ab' * 32 + '.png'
+        instances, rows = [], []
+        for number, (location, avatar_name) in enumerate([
+            (Point(37.6, 55.75, srid=4326), 'default/default_avatar.png'),
+            (Point(37.7, 55.8, srid=4326), avatar),
+            (None, avatar),
+        ], 1):
+            user = User(pk=number, first_name=f'User{number}', last_name=f'Name{number}', gender='MW'[number % 2],
+                        avatar=avatar_name, location=location)
+            row = {'id': number, 'first_name': user.first_name, 'last_name': user.last_name, 'gender': user.gender,
+                   'avatar': avatar_name, 'location': location}
+            if with_distance:
+                user.distance = row['distance'] = Distance(m=1000 * number)
+            instances.append(user)
+            rows.append(row)
+        return instances, rows
+
+    def assert_same_output(self, query, with_distance=False, distances=None):
+        request = Request(APIRequestFactory().get('/list/', query))
+        context = {'request': request, 'distances': distances}
+        instances, rows = self.make_rows(with_distance)
+        expected = UserListSerializer(instances, many=True, context=context).data
+        actual = UserListFastSerializer(context).to_representation(rows)
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+    def test_radius(self):
+        self.assert_same_output({'radius': '10'}, with_distance=True)
+
+    def test_nearest(self):
+        self.assert_same_output({'nearest': '3'}, with_distance=True)
+
+    def test_distances_from_memory_index(self):
+        self.assert_same_output({'radius': '10'}, distances={1: 0.5, 2: 1.5})
+
+    def test_without_distance(self):
+        self.assert_same_output({})
+
+    def test_avatar_size(self):
+        with override_settings(AVATAR_THUMBNAIL_SIZES=[64]):
+            self.assert_same_output({'radius': '10', 'avatar_size': '64'}, with_distance=True)
+            self.assert_same_output({'avatar_size': '128'})
+
+
+def create_located_users(points):
+    """Пользователи с координатами одним запросом, без хэширования пароля и сигналов."""
+    return User.objects.bulk_create(
+        User(email=f'located{number}@example.com', first_name=f'Located{number}', last_name='Name',
+             gender='MW'[number % 2], location=point)
+        for number, point in enumerate(points)
+    )
+
+
+class ProximityIndexTests(SimpleTestCase):
+    """Индекс координат в памяти: обновление и удаление пользователей."""
+
+    def setUp(self):
+        self.index = ProximityIndex()
+        self.index.build([(1, 37.6, 55.75), (2, 37.61, 55.75), (3, 37.9, 55.75)])
+
+    def query_ids(self, radius_km=5):
+        ids, _ = self.index.query(37.6, 55.75, radius_km)
+        return ids.tolist()
+
+    def test_query_orders_by_distance(self):
+        ids, distances = self.index.query(37.6, 55.75, 50)
+        self.assertEqual(ids.tolist(), [1, 2, 3])
+        self.assertEqual(distances.tolist(), sorted(distances.tolist()))
+        self.assertEqual(self.query_ids(), [1, 2])
+
+    def test_update_moves_and_adds_users(self):
+        self.index.update(3, Point(37.605, 55.75, srid=4326))
+        self.index.update(4, Point(37.6, 55.751, srid=4326))
+        self.assertEqual(self.query_ids(), [1, 4, 3, 2])
+        self.assertEqual(len(self.index), 4)
+
+    def test_remove(self):
+        self.index.update(2, None)
+        self.index.update(5, None)
+        self.assertEqual(self.query_ids(), [1])
+        self.assertEqual(len(self.index), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PROXIMITY_ENGINE='postgis')
+class ProximityIndexQueryTests(TestCase):
+    """Ответ индекса в памяти совпадает с запросом dwithin к PostGIS на тех же пользователях."""
+
+    def test_matches_postgis_dwithin(self):
+        rng = np.random.default_rng(0)
+        center = Point(37.6, 55.75, srid=4326)
+        users = create_located_users(
+            Point(float(lon), float(lat), srid=4326)
+            for lon, lat in zip(rng.normal(37.6, 0.15, 300), rng.normal(55.75, 0.1, 300))
+        )
+        index = ProximityIndex()
+        index.build((user.pk, user.location.x, user.location.y) for user in users)
+
+        for radius_km in (1, 5, 10, 20):
+            ids, distances = index.query(center.x, center.y, radius_km)
+            # PostGIS считает расстояния на сфероиде, индекс - на сфере: точки у самой границы не сравниваются
+            inner = set(User.objects.filter(location__dwithin=(center, D(km=radius_km * 0.995)))
+                        .values_list('id', flat=True))
+            outer = set(User.objects.filter(location__dwithin=(center, D(km=radius_km * 1.005)))
+                        .values_list('id', flat=True))
+            self.assertTrue(inner <= set(ids.tolist()) <= outer)
+            self.assertEqual(distances.tolist(), sorted(distances.tolist()))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, PROXIMITY_ENGINE='memory', PROXIMITY_CHANGES_MAXLEN=1000)
+class ProximitySyncTests(RedisTestMixin, TestCase):
+    """Журнал изменений в Redis: индекс процесса догоняет чужие изменения и строится заново при разрыве."""
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (('proximity_index', ProximityIndex()), ('_position', ['0-0', 0])):
+            patcher = mock.patch.object(proximity, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.near, self.far = create_located_users([Point(37.6, 55.75, srid=4326), Point(37.62, 55.75, srid=4326)])
+
+    def query_ids(self):
+        ids, _ = proximity.get_proximity_index().query(37.6, 55.75, 5)
+        return ids.tolist()
+
+    def test_published_changes_reach_index(self):
+        self.assertEqual(self.query_ids(), [self.near.pk, self.far.pk])
+        proximity.publish_changes([(self.far.pk, None), (self.near.pk, Point(37.61, 55.75, srid=4326))])
+        self.assertEqual(self.query_ids(), [self.near.pk])
+        ids, distances = proximity.get_proximity_index().query(37.61, 55.75, 1)
+        self.assertEqual(ids.tolist(), [self.near.pk])
+        self.assertLess(distances[0], 0.01)
+
+    def test_gap_in_changes_rebuilds_from_database(self):
+        self.assertEqual(self.query_ids(), [self.near.pk, self.far.pk])
+        # Изменение, вытесненное из журнала до чтения: индекс не может его применить и читает базу заново
+        get_redis().incr(proximity.CHANGES_SEQ_KEY)
+        User.objects.filter(pk=self.far.pk).update(location=None)
+        proximity.publish_changes([(self.near.pk, Point(37.61, 55.75, srid=4326))])
+        self.assertEqual(self.query_ids(), [self.near.pk])
+        self.assertEqual(len(proximity.proximity_index), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIKES_BLOOM_ENABLED=False, PROXIMITY_ENGINE='postgis',
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', NOTIFICATION_DIGEST=False)
+class MatchEmailTests(RedisTestMixin, TestCase):
+    """Письма о парах: очередь в Redis разбирается задачей dispatch_match_emails."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.users = [create_user(number, gender='MW'[number % 2]) for number in range(3)]
+
+    def like(self, from_user, to_user):
+        client = APIClient()
+        client.force_authenticate(from_user)
+        response = client.post(f'/clients/{from_user.pk}/match/', {'to_user': to_user.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def dispatch(self):
+        dispatch_match_emails.apply().get()
+
+    def test_one_message_per_participant_and_no_resend(self):
+        first, second, _ = self.users
+        self.like(first, second)
+        self.like(second, first)
+        self.dispatch()
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted([first.email, second.email]))
+
+        # Та же пара, поставленная в очередь повторно, отбрасывается по ключам отправленных писем
+        queue_match_notifications([Match.objects.select_related('from_user', 'to_user').get(from_user=first)])
+        self.dispatch()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(get_redis().llen(notifications.QUEUE_KEY), 0)
+
+    @override_settings(NOTIFICATION_RATE_LIMIT=1)
+    def test_rate_limit_defers_second_message(self):
+        first, second, third = self.users
+        self.like(second, first)
+        self.like(third, first)
+        self.like(first, second)
+        self.like(first, third)
+        self.dispatch()
+        self.assertEqual([message.to[0] for message in mail.outbox].count(first.email), 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+        self.dispatch()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(get_redis().llen(notifications.QUEUE_KEY), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES, LIST_CACHE_ENABLED=True, PROXIMITY_ENGINE='postgis')
+class UserListCacheTests(RedisTestMixin, TestCase):
+    """Кэш ответов /list/: попадание, ссылки пагинации текущего запроса, сброс при перемещении и clear()."""
+
+    url = '/list/?radius=50&page_size=2'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = create_user(0, location=Point(37.6, 55.75, srid=4326))
+        self.others = [create_user(number, location=Point(37.6 + 0.01 * number, 55.75, srid=4326))
+                       for number in range(1, 5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url=None):
+        response = self.client.get(url or self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_second_request_is_cache_hit_with_own_links(self):
+        first = self.get()
+        self.assertEqual(list_cache.stats(), {'hits': 0, 'misses': 1})
+
+        # Параметр, не влияющий на ответ: тот же ключ, но ссылки строятся от текущего запроса
+        second = self.get(self.url + '&source=test')
+        self.assertEqual(list_cache.stats(), {'hits': 1, 'misses': 1})
+        self.assertEqual(second['results'], first['results'])
+        self.assertIn('source=test', second['next'])
+        self.assertEqual(parse_qs(urlsplit(second['next']).query)['cursor'],
+                         parse_qs(urlsplit(first['next']).query)['cursor'])
+
+    def test_move_invalidates_cached_list(self):
+        names = [item['first_name'] for item in self.get()['results']]
+        self.assertEqual(names, ['User0', 'User1'])
+
+        moved = self.others[0]
+        moved.location = Point(40.0, 55.75, srid=4326)
+        moved.save()
+        names = [item['first_name'] for item in self.get()['results']]
+        self.assertEqual(names, ['User0', 'User2'])
+        self.assertEqual(list_cache.stats(), {'hits': 0, 'misses': 2})
+
+    def test_clear_drops_all_entries(self):
+        self.get()
+        list_cache.clear()
+        self.get()
+        self.assertEqual(list_cache.stats(), {'hits': 0, 'misses': 2})
+
+
+idempotent_calls = []
+
+
+@shared_task(base=IdempotentTask, idempotency_ttl=60)
+def record_once(value):
+    idempotent_calls.append(value)
+
+
+@shared_task(base=IdempotentTask, release_on_start=True)
+def record_each_run(value):
+    idempotent_calls.append(value)
+
+
+@override_settings(CELERY_MODE='eager', CELERY_TASK_ALWAYS_EAGER=True)
+class IdempotentTaskTests(SimpleTestCase):
+    """Ключи идемпотентности задач без Redis: локальный словарь режимов eager и memory."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(queues._local_keys, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Настройки Celery прочитаны при создании приложения, override_settings до них не доходит
+        always_eager = celery_app.conf.task_always_eager
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', always_eager)
+        idempotent_calls.clear()
+
+    def test_claim_and_release(self):
+        self.assertTrue(queues.claim('key', 60))
+        self.assertFalse(queues.claim('key', 60))
+        queues.release('key')
+        self.assertTrue(queues.claim('key', 60))
+        # Истекший ключ занимается снова
+        self.assertTrue(queues.claim('expired', 0))
+        self.assertTrue(queues.claim('expired', 0))
+
+    def test_second_delay_within_ttl_is_dropped(self):
+        self.assertIsNotNone(record_once.delay(1))
+        self.assertIsNone(record_once.delay(1))
+        self.assertIsNotNone(record_once.delay(2))
+        self.assertEqual(idempotent_calls, [1, 2])
+
+    def test_release_on_start_drops_only_queued_duplicates(self):
+        record_each_run.delay(1)
+        record_each_run.delay(1)
+        self.assertEqual(idempotent_calls, [1, 1])
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+
+from .models import User
+
+TOKEN_SALT = 'api.tokens'
+USER_CACHE_KEY = 'auth:user:{}'
+
+
+def issue_token(user):
+    """Выдает подписанный токен пользователя.
+
+    Токен хранит id и отпечаток пароля (HMAC, как у сессий Django), поэтому смена пароля отзывает
+    все выданные токены, а проверка не требует хранилища и хэширования пароля."""
+    return signing.dumps({'u': user.pk, 'h': user.get_session_auth_hash()}, salt=TOKEN_SALT, compress=True)
+
+
+def get_cached_user(user_id):
+    """Возвращает пользователя и отпечаток его пароля: из кэша, при промахе - из базы с сохранением в кэш.
+
+    В кэше лежат только id, is_active и отпечаток пароля, а не весь пользователь с хэшем пароля и
+    профилем. Остальные поля возвращенного пользователя отложены и читаются из базы при первом
+    обращении, как у queryset.only(). Возвращает (None, None), если пользователя нет."""
+    key = USER_CACHE_KEY.format(user_id)
+    cached = cache.get(key)
+    if cached is None:
+        user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            return None, None
+        cached = (user.pk, user.is_active, user.get_session_auth_hash())
+        cache.set(key, cached, settings.AUTH_USER_CACHE_TIMEOUT)
+    pk, is_active, auth_hash = cached
+    return User.from_db(None, ['id', 'is_active'], [pk, is_active]), auth_hash
+
+
+def forget_users(*user_ids):
+    """Удаляет пользователей из кэша аутентификации после изменения их данных."""
+    cache.delete_many([USER_CACHE_KEY.format(user_id) for user_id in user_ids])
+
+
+def user_from_token(token):
+    """Проверяет подпись и срок действия токена и возвращает его активного пользователя или None."""
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=settings.AUTH_TOKEN_TTL)
+    except signing.BadSignature:
+        # В том числе SignatureExpired
+        return None
+
+    user, auth_hash = get_cached_user(payload['u'])
+    if user is None or not user.is_active:
+        return None
+    if not constant_time_compare(payload['h'], auth_hash):
+        return None
+    return user
@@ -1,30 +1,169 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
 
+import redis
+import redis.asyncio
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.db import close_old_connections
 from PIL import Image
 
+OUTPUT_EXTENSIONS = {
+    'PNG': 'png',
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+}
 
-def apply_watermark(image, watermark_path='media/watermark/watermark.png'):
-    """Метод применяет водяной знак к изображению."""
 
-    # Открываем водяной знак и изображение, конвертируем их в формат RGBA
-    watermark = Image.open(watermark_path).convert("RGBA")
-    base_image = Image.open(image).convert("RGBA")
+class WatermarkCompositor:
+    """Накладывает водяной знак в правый нижний угол изображения.
 
-    base_width, base_height = base_image.size
+    Водяной знак читается с диска один раз на процесс, а его копии, уже приведенные к
+    размеру (1/4 от размеров изображения), хранятся в LRU-кэше: большинство загрузок
+    приходит в нескольких типовых разрешениях. Смешивание выполняется только в углу,
+    остальная часть изображения не конвертируется.
+    """
 
-    # Меняем размер изображения (1/4 от размеров базового изображения)
-    watermark_width = base_width // 4
-    watermark_height = base_height // 4
+    def __init__(self, watermark_path=None, cache_size=32):
+        self.watermark_path = watermark_path
+        self._watermark = None
+        self.scaled = lru_cache(maxsize=cache_size)(self._scale)
 
-    # Меняем размер водяного знака с помощью алгоритма Lanczos
-    watermark = watermark.resize((watermark_width, watermark_height), Image.LANCZOS)
+    @property
+    def watermark(self):
+        """Исходный водяной знак в RGBA, загружается при первом обращении."""
+        if self._watermark is None:
+            path = self.watermark_path or os.path.join(settings.MEDIA_ROOT, 'watermark', 'watermark.png')
+            with Image.open(path) as watermark:
+                self._watermark = watermark.convert('RGBA')
+        return self._watermark
 
-    # Определяем позицию в правом нижнем углу, накладываем водяной знак, создаем буфер сохранения и сохраняем рез.
-    watermark_position = (base_width - watermark_width, base_height - watermark_height)
-    base_image.paste(watermark, watermark_position, watermark)
+    def _scale(self, size):
+        # Меняем размер водяного знака с помощью алгоритма Lanczos
+        return self.watermark.resize(size, Image.LANCZOS)
+
+    def apply(self, image, output_format='PNG', max_size=None, quality=85):
+        """Возвращает байты изображения с водяным знаком в формате output_format (PNG, JPEG или WEBP).
+
+        Если задан max_size, изображение вписывается в квадрат max_size x max_size до наложения знака;
+        для JPEG уменьшение начинается уже при декодировании."""
+        base_image = Image.open(image)
+        if max_size:
+            base_image.draft('RGB', (max_size, max_size))
+            base_image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+        has_alpha = base_image.mode in ('RGBA', 'LA') or 'transparency' in base_image.info
+        keep_alpha = has_alpha and output_format != 'JPEG'
+        mode = 'RGBA' if keep_alpha else 'RGB'
+        if base_image.mode != mode:
+            base_image = base_image.convert(mode)
+
+        base_width, base_height = base_image.size
+        watermark_width = base_width // 4
+        watermark_height = base_height // 4
+
+        if watermark_width and watermark_height:
+            watermark = self.scaled((watermark_width, watermark_height))
+            watermark_position = (base_width - watermark_width, base_height - watermark_height)
+            base_image.paste(watermark, watermark_position, watermark)
+
+        output = BytesIO()
+        if output_format == 'PNG':
+            base_image.save(output, format=output_format)
+        else:
+            base_image.save(output, format=output_format, quality=quality)
+        return output.getvalue()
+
+
+compositor = WatermarkCompositor()
+
+
+def apply_watermark(image, watermark_path=None):
+    """Метод применяет водяной знак к изображению.
+
+    Формат, качество и максимальный размер результата задаются настройками AVATAR_FORMAT,
+    AVATAR_QUALITY и AVATAR_MAX_SIZE."""
+    worker = compositor if watermark_path is None else WatermarkCompositor(watermark_path)
+    output_format = settings.AVATAR_FORMAT
+    content = worker.apply(
+        image,
+        output_format=output_format,
+        max_size=settings.AVATAR_MAX_SIZE,
+        quality=settings.AVATAR_QUALITY,
+    )
+
+    name = '%s.%s' % (os.path.splitext(os.path.basename(image.name))[0], OUTPUT_EXTENSIONS[output_format])
+    return ContentFile(content, name)
+
+
+def render_thumbnail(content, size):
+    """Уменьшенная копия готового аватара, вписанная в квадрат size x size.
+
+    Копия кодируется в формате исходного файла, а не текущего AVATAR_FORMAT: ее имя (variant_name)
+    повторяет расширение исходного файла, и по нему определяется Content-Type при отдаче."""
+    image = Image.open(BytesIO(content))
+    image_format = image.format
+    image.thumbnail((size, size), Image.LANCZOS)
     output = BytesIO()
-    base_image.save(output, format='PNG')
-    output.seek(0)
+    if image_format == 'PNG':
+        image.save(output, format=image_format)
+    else:
+        image.save(output, format=image_format, quality=settings.AVATAR_QUALITY)
+    return ContentFile(output.getvalue())
+
+
+def save_avatar_thumbnails(storage, name, content, overwrite=False):
+    """Один раз готовит уменьшенные копии аватара размеров AVATAR_THUMBNAIL_SIZES; уже существующие пропускаются
+    (с overwrite=True - пересоздаются)."""
+    for size in settings.AVATAR_THUMBNAIL_SIZES:
+        variant = storage.variant_name(name, size)
+        if overwrite and storage.exists(variant):
+            storage.delete(variant)
+        if not storage.exists(variant):
+            storage.save_variant(name, size, render_thumbnail(content, size))
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    """Возвращает общий для процесса клиент Redis для данных приложения (буферы, очереди, счетчики)."""
+    return redis.Redis.from_url(settings.API_REDIS_URL)
+
+
+@lru_cache(maxsize=None)
+def get_async_redis():
+    """Возвращает асинхронный клиент Redis для данных приложения (для view, работающих в цикле событий ASGI)."""
+    return redis.asyncio.Redis.from_url(settings.API_REDIS_URL)
+
+
+@lru_cache(maxsize=None)
+def get_blocking_executor():
+    """Пул потоков для блокирующих вызовов асинхронных view; его размер ограничивает число соединений с базой."""
+    return ThreadPoolExecutor(max_workers=settings.ASYNC_BLOCKING_THREADS, thread_name_prefix='api-blocking')
+
+
+def _call_in_worker(func, args, kwargs):
+    # Импорт внутри функции: модуль db сам использует run_blocking
+    from .db import check_connections
+
+    # Как в начале обычного запроса: постоянное соединение потока проверяется перед использованием
+    check_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Как в конце обычного запроса: соединение потока закрывается, если истек CONN_MAX_AGE или оно сломано
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполняет блокирующий вызов (ORM, кэш Django, постановка задачи Celery) в пуле потоков.
 
-    return ContentFile(output.read(), image.name)
+    Цикл событий в это время обслуживает другие запросы. Контекстные переменные (например,
+    сборщик метрик запроса) передаются в поток."""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _call_in_worker, func, args, kwargs)
+    return await asyncio.get_running_loop().run_in_executor(get_blocking_executor(), call)
@@ -1,17 +1,38 @@
+import json
+import posixpath
+
+from django.conf import settings
 from django.contrib.gis.db.models.functions import Distance
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
+from django.views.static import serve
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.mixins import ListModelMixin
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.viewsets import (GenericViewSet, ModelViewSet,
+                                     ReadOnlyModelViewSet)
 
-from .models import Match, User
-from .serializers import MatchSerializer, UserListSerializer, UserSerializer
-from .tasks import send_match_email
+from . import db, density, feed, list_cache
+from .filters import UserListFilter
+from .location import get_buffered_location, record_location
+from .metrics import stage_timer
+from .models import Match, User, knn_distance
+from .pagination import PairCursorPagination, UserListCursorPagination
+from .proximity import get_proximity_index, use_memory_engine
+from .serializers import (MatchBulkSerializer, MatchSerializer, PairSerializer,
+                          TokenObtainSerializer, UserListFastSerializer,
+                          UserListSerializer, UserSerializer)
+from .storage import avatar_storage
+from .tasks import notify_matches, rebuild_feed
 
 
 class UserViewSet(ModelViewSet):
@@ -22,61 +43,245 @@ class UserViewSet(ModelViewSet):
     serializer_class = UserSerializer
 
 
+class TokenViewSet(GenericViewSet):
+    """ViewSet выдачи токенов для аутентификации "Authorization: Bearer <токен>"."""
+
+    serializer_class = TokenObtainSerializer
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def create(self, request, *args, **kwargs):
+        """Проверяет email и пароль и возвращает подписанный токен и срок его действия в секундах."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class UserListViewSet(ReadOnlyModelViewSet):
     """ViewSet для списка пользователей."""
 
     queryset = User.objects.all()
     serializer_class = UserListSerializer
+    pagination_class = UserListCursorPagination
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = {
-        'gender': ['iexact'],
-        'first_name': ['iexact'],
-        'last_name': ['iexact']
-    }  # поля для фильтрации без учета регистра но сохраняя уникальность (сделано из-за тестовых данных)
+    filterset_class = UserListFilter  # пол, имя и фамилия без учета регистра, поиск по префиксу и нечеткий
     permission_classes = [IsAuthenticated]  # только для авторизованных пользователей
+    stream_chunk_size = 2000  # строк за одно чтение серверного курсора при потоковой выгрузке
+    max_nearest = 500  # наибольшее N в режиме nearest
+    distances = None  # расстояния (км) по id пользователя, если поиск по радиусу выполнен в памяти процесса
+    _search_point = None
+    _search_point_resolved = False
+    _replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Выбор базы после аутентификации: недавно писавший пользователь читает с основной базы
+        self._replica_token = db.current_replica.set(db.choose_replica(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self._replica_token is not None:
+            db.current_replica.reset(self._replica_token)
+            self._replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
 
     @swagger_auto_schema(manual_parameters=[
         openapi.Parameter('latitude', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
         openapi.Parameter('longitude', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
-        openapi.Parameter('radius', openapi.IN_QUERY, type=openapi.TYPE_NUMBER)
+        openapi.Parameter('radius', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+        openapi.Parameter('nearest', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                          description='вернуть N ближайших пользователей (радиус ограничивает поиск)'),
+        openapi.Parameter('avatar_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                          description='сторона уменьшенной копии аватара (AVATAR_THUMBNAIL_SIZES)'),
     ])
     def list(self, request, *args, **kwargs):
-        """Возвращает список пользователей с возможностью фильтрации по радиусу и координатам."""
-        return super().list(request, *args, **kwargs)
+        """Возвращает список пользователей с возможностью фильтрации по радиусу и координатам.
+
+        Ответ кэшируется по фильтрам и ячейке местоположения пользователя, так что соседние
+        пользователи с одинаковыми параметрами получают общий результат."""
+        if not settings.LIST_CACHE_ENABLED:
+            return self.render_list()
+
+        key = list_cache.build_key(request.query_params, self.get_search_point())
+        data = list_cache.get_response(key, request)
+        if data is not None:
+            return Response(data)
+
+        response = self.render_list()
+        list_cache.set_response(key, response.data)
+        return response
+
+    def render_list(self):
+        """Формирует страницу списка через быстрый сериализатор, читающий из базы только выводимые столбцы."""
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = UserListFastSerializer(self.get_serializer_context())
+        rows = serializer.prepare(queryset)
+
+        nearest = self.get_nearest()
+        if nearest is not None:
+            return self.render_nearest(serializer, rows, nearest)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            with stage_timer('list_serialization'):
+                data = serializer.to_representation(page)
+            return self.get_paginated_response(data)
+        with stage_timer('list_serialization'):
+            data = serializer.to_representation(rows)
+        return Response(data)
+
+    def render_nearest(self, serializer, rows, nearest):
+        """Формирует ответ режима nearest: N ближайших одной страницей без курсоров."""
+        rows = list(rows[:nearest])
+        if rows and 'distance' in rows[0]:
+            # Индекс упорядочивает по расстоянию на сфере, в ответе - точное расстояние на сфероиде
+            rows.sort(key=lambda row: (row['distance'].m, row['id']))
+        with stage_timer('list_serialization'):
+            data = serializer.to_representation(rows)
+        return Response({'next': None, 'previous': None, 'results': data})
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('latitude', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+        openapi.Parameter('longitude', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+        openapi.Parameter('radius', openapi.IN_QUERY, type=openapi.TYPE_NUMBER),
+        openapi.Parameter('nearest', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('avatar_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        openapi.Parameter('output', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['ndjson', 'json'])
+    ])
+    @action(detail=False, methods=['get'], pagination_class=None)
+    def stream(self, request, *args, **kwargs):
+        """Потоково отдает весь отфильтрованный список пользователей в формате NDJSON или JSON-массивом.
+
+        Строки читаются из базы серверным курсором порциями, поэтому список целиком в памяти не держится."""
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = UserListFastSerializer(self.get_serializer_context())
+        nearest = self.get_nearest()
+        if nearest is not None:
+            # Порядок ближайших уже задан в get_queryset
+            rows = serializer.prepare(queryset)[:nearest]
+        else:
+            ordering = ('distance', 'id') if 'distance' in queryset.query.annotations else ('id',)
+            rows = serializer.prepare(queryset).order_by(*ordering)
+        rows = rows.iterator(chunk_size=self.stream_chunk_size)
+
+        if request.query_params.get('output') == 'json':
+            content = self._stream_json_array(serializer, rows)
+            content_type = 'application/json'
+        else:
+            content = self._stream_ndjson(serializer, rows)
+            content_type = 'application/x-ndjson'
+        return StreamingHttpResponse(content, content_type=content_type)
+
+    @staticmethod
+    def _dumps(data):
+        return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+    def _stream_ndjson(self, serializer, rows):
+        for row in rows:
+            yield self._dumps(serializer.represent(row)) + '\n'
+
+    def _stream_json_array(self, serializer, rows):
+        separator = '['
+        for row in rows:
+            yield separator + self._dumps(serializer.represent(row))
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+    def get_search_point(self):
+        """Возвращает точку, от которой ищутся пользователи по радиусу, попутно принимая новое местоположение.
+
+        Если пользователь передает широту и долготу, они буферизуются и позже пакетно записываются
+        в базу, а текущий запрос сразу использует переданные координаты. При включенном кэше списка
+        точка приводится к центру ячейки, чтобы соседние пользователи делили записи кэша."""
+        if self._search_point_resolved:
+            return self._search_point
 
-    def get_queryset(self):
-        """Возвращает queryset пользователей с примененным фильтром по радиусу или координатам,
-        если пользователь аутентифицирован."""
-        queryset = super().get_queryset()
         user = self.request.user
-        radius = self.request.query_params.get('radius', None)
         latitude = self.request.query_params.get('latitude', None)
         longitude = self.request.query_params.get('longitude', None)
+        point = None
 
         if user.is_authenticated:
-            # Если пользователь передает в параметрах широту и долготу, то:
             if longitude and latitude:
-                # Обновляется местоположения пользователя в базе данных
-                user.location = Point(float(longitude), float(latitude))
-                user.save()
-
-            # Если параметр радиуса передан, то:
-            if radius:
-                # Получаем текущее местоположение пользователя, если оно есть
-                point = user.location if user.location else None
-                if point:
-                    # Фильтрация queryset по радиусу относительно местоположения пользователя
-                    queryset = queryset.filter(location__distance_lte=(point, D(km=float(radius))))
-
-                    # Добавляем к queryset вычисляемое поле "distance", представляющее расстояние до
-                    # каждого пользователя от заданной точки.
-                    queryset = queryset.annotate(distance=Distance('location', point))
+                point = Point(float(longitude), float(latitude), srid=4326)
+                record_location(user, point)
+                user.location = point
+            else:
+                # Берем последнее принятое местоположение, если оно еще не записано в базу
+                user.location = get_buffered_location(user.pk) or user.location
+                point = user.location
+
+        if point is not None and settings.LIST_CACHE_ENABLED:
+            point = list_cache.quantize(point)
+
+        self._search_point, self._search_point_resolved = point, True
+        return point
+
+    def get_nearest(self):
+        """Возвращает N из параметра nearest или None, если режим ближайших не запрошен."""
+        value = self.request.query_params.get('nearest')
+        if not value:
+            return None
+        try:
+            nearest = int(value)
+        except ValueError:
+            nearest = 0
+        if not 1 <= nearest <= self.max_nearest:
+            raise serializers.ValidationError({'nearest': f'Ожидается целое число от 1 до {self.max_nearest}!'})
+        return nearest
+
+    def set_search_point(self, point):
+        """Задает точку поиска, уже определенную вызывающим кодом (асинхронным view списка)."""
+        self._search_point, self._search_point_resolved = point, True
+
+    def get_queryset(self):
+        """Возвращает queryset пользователей с примененным фильтром по радиусу или координатам,
+        если пользователь аутентифицирован."""
+        queryset = super().get_queryset()
+        replica = db.current_replica.get()
+        if replica is not None:
+            # База фиксируется сразу: потоковая выгрузка читает строки уже после выхода из view
+            queryset = queryset.using(replica)
+        radius = self.request.query_params.get('radius', None)
+        nearest = self.get_nearest()
+        point = self.get_search_point()
+
+        if nearest is not None:
+            if point is None:
+                queryset = queryset.order_by('id')
+            else:
+                # Строки читаются из GiST-индекса по возрастанию расстояния (KNN), поэтому стоимость
+                # зависит от N, а не от числа пользователей вокруг; расстояние считается только для них
+                queryset = queryset.annotate(distance=Distance('location', point)).order_by(knn_distance(point), 'id')
+                if radius:
+                    queryset = queryset.filter(location__dwithin=(point, D(km=float(radius))))
+
+        # Если параметр радиуса передан и местоположение пользователя известно, то:
+        elif radius and point:
+            if use_memory_engine():
+                # Кандидаты и расстояния считаются по индексу в памяти, база отдает только строки по id
+                ids, distances = get_proximity_index().query(point.x, point.y, float(radius))
+                self.distances = dict(zip(ids.tolist(), distances.tolist()))
+                queryset = queryset.filter(pk__in=self.distances.keys())
+            else:
+                # Фильтрация queryset по радиусу относительно местоположения пользователя (ST_DWithin использует
+                # пространственный индекс, в том числе составной с полом)
+                queryset = queryset.filter(location__dwithin=(point, D(km=float(radius))))
+
+                # Добавляем к queryset вычисляемое поле "distance", представляющее расстояние до
+                # каждого пользователя от заданной точки.
+                queryset = queryset.annotate(distance=Distance('location', point))
 
         # Исключаем из queryset пользователей без местоположения
         queryset = queryset.exclude(location__isnull=True)
 
         return queryset
 
+    def get_serializer_context(self):
+        """Добавляет в контекст сериализатора расстояния, посчитанные в памяти процесса."""
+        context = super().get_serializer_context()
+        context['distances'] = self.distances
+        return context
+
 
 class MatchViewSet(ModelViewSet):
     """ViewSet для модели Match."""
@@ -84,6 +289,7 @@ class MatchViewSet(ModelViewSet):
     http_method_names = ('post',)
     queryset = Match.objects.all()
     serializer_class = MatchSerializer
+    permission_classes = [IsAuthenticated]
 
     def create(self, request, *args, **kwargs):
         """Создает новый матч и отправляет уведомления об образовавшейся паре."""
@@ -91,27 +297,190 @@ class MatchViewSet(ModelViewSet):
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
 
-        # Проверка наличия обратного матча (пары) в базе данных
-        if Match.objects.filter(from_user=serializer.validated_data['to_user'],
-                                to_user=serializer.validated_data['from_user']).exists():
-
-            # Получаем пользователей кто создал матч и к которому создан матч
-            to_user = serializer.validated_data['to_user']
-            from_user = serializer.validated_data['from_user']
+        # Запрос на создание лайка сразу сообщает, образовалась ли пара
+        match = serializer.instance
+        if match.matched:
 
             # Отправка уведомлений замэтчиным пользователям по электронной почте
-            send_match_email.delay(
-                to_email=to_user.email,
-                match_name=from_user.first_name  # Получаем имя участника
-            )
-            send_match_email.delay(
-                to_email=from_user.email,
-                match_name=to_user.first_name
-            )
+            notify_matches([match])
+            feed.remove_liked(match.from_user.pk, [match.to_user.pk])
             return Response(
-                {"match": f"У вас есть пара! Почта участника: {to_user.email}"},
+                {"match": f"У вас есть пара! Почта участника: {match.to_user.email}"},
                 status=status.HTTP_201_CREATED
             )
 
+        feed.remove_liked(match.from_user.pk, [match.to_user.pk])
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @action(detail=False, methods=['post'], serializer_class=MatchBulkSerializer)
+    def bulk(self, request, *args, **kwargs):
+        """Создает пачку лайков одним запросом и возвращает результат по каждому пользователю.
+
+        Статусы: created - лайк сохранен, matched - образовалась пара (в ответе почта участника),
+        duplicate - лайк уже был, not_found - пользователя нет, self - лайк самому себе."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = serializer.save()
+
+        notify_matches([match for _, like_status, match in results if like_status == Match.LIKE_MATCHED])
+        feed.remove_liked(request.user.pk, [match.to_user.pk for _, _, match in results if match is not None])
+
+        items = []
+        for to_user_id, like_status, match in results:
+            item = {'to_user': to_user_id, 'status': like_status}
+            if like_status == Match.LIKE_MATCHED:
+                item['email'] = match.to_user.email
+            items.append(item)
+        return Response({'results': items}, status=status.HTTP_201_CREATED)
+
+
+class PairViewSet(ListModelMixin, GenericViewSet):
+    """ViewSet списка пар (взаимных лайков) текущего пользователя."""
+
+    serializer_class = PairSerializer
+    pagination_class = PairCursorPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Лайки пользователя с флагом matched вместе с партнером: страница читается одним запросом
+        по частичному индексу match_pairs_idx, без соединения графа лайков с самим собой."""
+        return (
+            Match.objects.filter(from_user_id=self.request.user.pk, matched=True)
+            .select_related('to_user')
+            .only('id', 'to_user', 'to_user__email', 'to_user__first_name', 'to_user__last_name', 'to_user__gender',
+                  'to_user__avatar', 'to_user__location')
+        )
+
+
+class FeedViewSet(GenericViewSet):
+    """ViewSet ленты кандидатов: ближайшие пользователи, которых текущий пользователь еще не лайкал."""
+
+    permission_classes = [IsAuthenticated]
+    default_page_size = 20
+    max_page_size = 100
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('gender', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['M', 'W']),
+        openapi.Parameter('after', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                          description='курсор следующей страницы из поля next'),
+        openapi.Parameter('page_size', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+    ])
+    def list(self, request, *args, **kwargs):
+        """Возвращает следующую страницу ленты кандидатов, упорядоченных по расстоянию.
+
+        Лента хранится в Redis и обновляется при лайках и перемещениях. Если она еще не
+        построена, пересчет ставится в очередь, а первая страница считается запросом к базе."""
+        user = request.user
+        gender = request.query_params.get('gender', '').upper() or None
+        if gender is not None and gender not in feed.GENDERS:
+            raise serializers.ValidationError({'gender': 'Введено некорректное значение пола пользователя!'})
+        try:
+            size = int(request.query_params.get('page_size', self.default_page_size))
+            size = max(1, min(size, self.max_page_size))
+            after = request.query_params.get('after')
+            after = (float(after.split(':')[0]), int(after.split(':')[1])) if after else None
+        except (ValueError, IndexError):
+            raise serializers.ValidationError({'detail': 'Некорректные параметры страницы!'})
+
+        if feed.is_ready(user.pk):
+            items, next_cursor = feed.page(user.pk, gender=gender, after=after, size=size)
+        else:
+            rebuild_feed.delay(user.pk)
+            items, next_cursor = self._page_from_database(user, gender, after, size)
+
+        distances = dict(items)
+        serializer = UserListFastSerializer({'request': request, 'distances': distances}, include_distance=True)
+        rows = {row['id']: row for row in serializer.prepare(User.objects.filter(pk__in=distances))}
+        results = [serializer.represent(rows[candidate_id]) for candidate_id, _ in items if candidate_id in rows]
+
+        return Response({
+            'next': f'{next_cursor[0]}:{next_cursor[1]}' if next_cursor else None,
+            'results': results,
+        })
+
+    def _page_from_database(self, user, gender, after, size):
+        point = get_buffered_location(user.pk) or user.location
+        if point is None:
+            return [], None
+        queryset = feed.candidates(user.pk, point)
+        if gender:
+            queryset = queryset.filter(gender=gender)
+        if after:
+            queryset = queryset.filter(distance__gte=D(km=after[0]))
+        items = [(candidate_id, distance.km) for candidate_id, distance in queryset.values_list('id', 'distance')
+                 [:size + 50]]
+        if after:
+            items = [item for item in items if (item[1], item[0]) > after]
+        items = items[:size + 1]
+        next_cursor = (items[size - 1][1], items[size - 1][0]) if len(items) > size else None
+        return items[:size], next_cursor
+
+
+class DensityViewSet(GenericViewSet):
+    """ViewSet плотности пользователей для карты: число пользователей по ячейкам тайлов."""
+
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('bbox', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                          description='видимая область: долгота и широта юго-западного и северо-восточного углов '
+                                      '(minlon,minlat,maxlon,maxlat)'),
+        openapi.Parameter('zoom', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=True),
+        openapi.Parameter('gender', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['M', 'W']),
+    ])
+    def list(self, request, *args, **kwargs):
+        """Возвращает тайлы XYZ (веб-Меркатор), покрывающие область, с числом пользователей в их ячейках.
+
+        Ячейка (cx, cy) - часть тайла размером 1/bins его стороны, пустые ячейки не передаются.
+        Тайлы берутся из Redis, недостающие считаются одним запросом к PostGIS."""
+        try:
+            west, south, east, north = (float(value) for value in request.query_params['bbox'].split(','))
+            zoom = int(request.query_params['zoom'])
+        except (KeyError, ValueError):
+            raise serializers.ValidationError({'detail': 'Укажите bbox=minlon,minlat,maxlon,maxlat и zoom!'})
+        if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+            raise serializers.ValidationError({'bbox': 'Некорректные границы области!'})
+        if not 0 <= zoom <= settings.DENSITY_MAX_ZOOM:
+            raise serializers.ValidationError({'zoom': f'Масштаб должен быть от 0 до {settings.DENSITY_MAX_ZOOM}!'})
+        gender = request.query_params.get('gender', '').upper() or None
+        if gender is not None and gender not in dict(User.CHOICE_GENDER):
+            raise serializers.ValidationError({'gender': 'Введено некорректное значение пола пользователя!'})
+
+        # Число тайлов проверяется до построения списка: на крупном масштабе область может накрыть миллиарды тайлов
+        if density.tile_count(west, south, east, north, zoom) > settings.DENSITY_MAX_TILES:
+            raise serializers.ValidationError({'detail': 'Слишком большая область для этого масштаба!'})
+        tiles = density.tiles_in_bbox(west, south, east, north, zoom)
+
+        counts = density.get_tiles(zoom, tiles, gender=gender)
+        return Response({
+            'zoom': zoom,
+            'bins': settings.DENSITY_TILE_BINS,
+            'tiles': [
+                {
+                    'x': x,
+                    'y': y,
+                    'bounds': [round(value, 6) for value in density.tile_bounds(zoom, x, y)],
+                    'total': sum(counts[x, y].values()),
+                    'cells': [[cx, cy, count] for (cx, cy), count in sorted(counts[x, y].items())],
+                }
+                for x, y in tiles
+            ],
+        })
+
+
+def _avatar_etag(request, path):
+    # Неизменяемым файлам (имя - хэш содержимого) ETag дает само имя
+    name = posixpath.basename(path)
+    return posixpath.splitext(name)[0] if avatar_storage.is_hashed(name) else None
+
+
+@etag(_avatar_etag)
+def serve_avatar(request, path):
+    """Отдает файл аватара с сильным ETag и долгим сроком кэширования.
+
+    Повторный запрос с If-None-Match получает 304 без чтения файла."""
+    response = serve(request, path, document_root=avatar_storage.path('avatars'))
+    if avatar_storage.is_hashed(path):
+        patch_cache_control(response, public=True, max_age=settings.AVATAR_CACHE_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Нагрузочный прогон на локальном PostGIS (подходит для CI):
+# поднимает базу и Redis, применяет миграции, генерирует популяцию и выполняет сценарии.
+# Параметры: BENCH_USERS, BENCH_LIKES, BENCH_REQUESTS.
+set -e
+
+docker-compose up -d db redis
+docker-compose run --rm app sh -c "
+    while ! nc -z \$DB_HOST \$DB_PORT; do sleep 1; done;
+    python3 manage.py migrate &&
+    python3 manage.py generate_population --users ${BENCH_USERS:-10000} --likes ${BENCH_LIKES:-50000} &&
+    python3 manage.py loadtest --requests ${BENCH_REQUESTS:-200} --json bench_output.json
+"
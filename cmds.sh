@@ -3,6 +3,8 @@
 while ! nc -z $DB_HOST $DB_PORT; do sleep 1; done;
 
 python3 manage.py migrate
+# Схема OpenAPI собирается один раз, а не при каждом обращении к /swagger/
+python3 manage.py generate_schema
 
 export PGPASSWORD=$DB_PASS
 